@@ -0,0 +1,46 @@
+# pylint: disable=missing-docstring
+
+import argparse
+import gc
+import json
+import tempfile
+import tracemalloc
+
+from benchmarks import workload
+from trask import phase1, phase2
+
+
+def measure(path):
+    """Get the tracemalloc peak and retained sizes of loading |path|."""
+    tracemalloc.start()
+    steps = phase1.load(path)
+    _, phase1_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    gc.collect()
+    # Restart to measure phase2 alone, reset_peak needs Python 3.9
+    tracemalloc.start()
+    root = phase2.Phase2.load(phase2.get_schema(), steps)
+    gc.collect()
+    phase2_retained, phase2_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'steps': len(root),
+        'phase1_peak': phase1_peak,
+        'phase2_peak': phase2_peak,
+        'phase2_retained': phase2_retained,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='measure memory used to load a synthetic trask file')
+    parser.add_argument('--steps', type=int, default=3000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = workload.generate(temp_dir, workload.Workload(steps=args.steps))
+        print(json.dumps(measure(path)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+# pylint: disable=missing-docstring
+
+import argparse
+import json
+import os
+import tempfile
+import timeit
+
+from benchmarks import workload
+from trask import phase1
+
+
+def best_time(func, repeat):
+    return min(timeit.repeat(func, number=1, repeat=repeat))
+
+
+def measure(text_path, json_path, repeat):
+    """Time phase1.load for the same steps in both formats."""
+    # Compile the grammar outside of the timed region
+    phase1.get_model()
+    text_time = best_time(lambda: phase1.load(text_path), repeat)
+    json_time = best_time(lambda: phase1.load(json_path), repeat)
+    return {
+        'text_seconds': text_time,
+        'json_seconds': json_time,
+        'speedup': text_time / json_time,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='compare the text and JSON front-ends')
+    parser.add_argument('--steps', type=int, default=1500)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        # A single file, since the JSON is converted from it alone
+        text_path = workload.generate(
+            temp_dir, workload.Workload(steps=args.steps, depth=0))
+        json_path = os.path.join(temp_dir, 'bench.trask.json')
+        with open(json_path, 'w') as wfile:
+            wfile.write(phase1.format_json(phase1.parse(text_path)))
+        print(json.dumps(measure(text_path, json_path, args.repeat)))
+
+
+if __name__ == '__main__':
+    main()
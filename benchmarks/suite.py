@@ -0,0 +1,170 @@
+# pylint: disable=missing-docstring
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import attr
+
+from benchmarks import workload
+from trask import phase1, phase2, phase3
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+
+def stub_context():
+    """A dry-run context with the workload's variables bound."""
+    ctx = phase3.Context(dry_run=True)
+    ctx.variables = {name: name for name in workload.variable_names()}
+    ctx.run_cmd = lambda *cmd, **kwargs: None
+    ctx.check_output = lambda *cmd: ''
+    return ctx
+
+
+def bench_import():
+    """Time a fresh interpreter importing trask."""
+    start = time.perf_counter()
+    subprocess.check_call([sys.executable, '-c', 'import trask'],
+                          cwd=ROOT_DIR)
+    return time.perf_counter() - start
+
+
+def timed(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def bench_phase1(path):
+    return timed(lambda: phase1.load(path))
+
+
+def bench_phase2(path):
+    steps = phase1.load(path)
+    return timed(lambda: phase2.Phase2.load(phase2.get_schema(), steps))
+
+
+def bench_resolve(path):
+    # Resolving modifies the steps, so load them each time
+    steps = phase2.Phase2.load(phase2.get_schema(), phase1.load(path))
+    ctx = stub_context()
+
+    def resolve_all():
+        for step in steps:
+            ctx.step = step
+            phase3.resolve_step(step, ctx)
+
+    return timed(resolve_all)
+
+
+def bench_run(path):
+    steps = phase2.Phase2.load(phase2.get_schema(), phase1.load(path))
+    ctx = stub_context()
+    with contextlib.redirect_stdout(io.StringIO()):
+        return timed(lambda: phase3.run(steps, ctx))
+
+
+BENCHMARKS = (
+    ('import', bench_import),
+    ('phase1_load', bench_phase1),
+    ('phase2_load', bench_phase2),
+    ('phase3_resolve_step', bench_resolve),
+    ('phase3_run', bench_run),
+)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=ROOT_DIR,
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(path, repeat, names=None):
+    """Run each benchmark |repeat| times, returning the timings."""
+    # Compile the grammar outside of the timed regions
+    phase1.get_model()
+    results = {}
+    for name, func in BENCHMARKS:
+        if names and name not in names:
+            continue
+        if name == 'import':
+            times = [func() for _ in range(repeat)]
+        else:
+            times = [func(path) for _ in range(repeat)]
+        results[name] = {
+            'best': min(times),
+            'mean': sum(times) / len(times),
+            'times': times,
+        }
+    return results
+
+
+def compare(old, new):
+    """Print the ratio of new to old best times for each benchmark."""
+    for name in sorted(new['benchmarks']):
+        if name not in old['benchmarks']:
+            continue
+        before = old['benchmarks'][name]['best']
+        after = new['benchmarks'][name]['best']
+        print('{:22} {:10.4f}s {:10.4f}s {:7.2f}x'.format(
+            name, before, after, before / after))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='time trask on a synthetic workload')
+    parser.add_argument('--steps', type=int, default=1000)
+    parser.add_argument('--depth', type=int, default=2)
+    parser.add_argument('--fanout', type=int, default=3)
+    parser.add_argument('--list-size', type=int, default=4)
+    parser.add_argument(
+        '--variables',
+        type=float,
+        default=0.5,
+        help='fraction of values that are variables')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument(
+        '--only', action='append', help='run only this benchmark')
+    parser.add_argument('-o', '--output', help='write the results as JSON')
+    parser.add_argument(
+        '--compare', help='results from an earlier run to compare against')
+    args = parser.parse_args()
+
+    load = workload.Workload(
+        steps=args.steps,
+        depth=args.depth,
+        fanout=args.fanout,
+        list_size=args.list_size,
+        variables=args.variables)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = workload.generate(temp_dir, load)
+        results = {
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'workload': attr.asdict(load),
+            'benchmarks': run_suite(path, args.repeat, args.only),
+        }
+
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as wfile:
+            wfile.write(text + '\n')
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare) as rfile:
+            compare(json.load(rfile), results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+# pylint: disable=missing-docstring
+
+import os
+
+import attr
+
+
+@attr.s
+class Workload:
+    """Shape of a synthetic trask file and the files it includes.
+
+    |steps| steps are spread over a tree of files |depth| includes
+    deep, where each file includes |fanout| others. Lists in recipes
+    have |list_size| elements, and |variables| is the fraction of
+    values that refer to a variable instead of being literals.
+    """
+    steps = attr.ib(default=1000)
+    depth = attr.ib(default=2)
+    fanout = attr.ib(default=3)
+    list_size = attr.ib(default=4)
+    variables = attr.ib(default=0.5)
+
+
+NUM_VARIABLES = 10
+
+
+def variable_names():
+    return ['var-{}'.format(index) for index in range(NUM_VARIABLES)]
+
+
+def quote(text):
+    return "'" + text + "'"
+
+
+def quote_list(items):
+    return '[ ' + ' '.join(quote(item) for item in items) + ' ]'
+
+
+class Generator:
+    def __init__(self, workload):
+        self.workload = workload
+        self.count = 0
+
+    def value(self, literal):
+        """Get either |literal| quoted or a variable, per the workload."""
+        self.count += 1
+        # Spread the variable references evenly over the values
+        used = int(self.count * self.workload.variables)
+        if used > int((self.count - 1) * self.workload.variables):
+            return variable_names()[self.count % NUM_VARIABLES]
+        return quote(literal)
+
+    def items(self, prefix):
+        return [
+            '{}-{}'.format(prefix, index)
+            for index in range(self.workload.list_size)
+        ]
+
+    def step(self, index):
+        kind = index % 5
+        if kind == 0:
+            return 'ssh {{ user {} host {} commands {} }}'.format(
+                self.value('deploy'), self.value('host{}'.format(index)),
+                quote_list(self.items('echo')))
+        elif kind == 1:
+            volumes = ' '.join(
+                '{{ host {} container {} }}'.format(
+                    self.value(item), quote('/' + item))
+                for item in self.items('vol'))
+            return ('docker-run {{ image {} init true volumes [ {} ] '
+                    'commands {} }}').format(
+                        self.value('image'), volumes,
+                        quote_list(self.items('make')))
+        elif kind == 2:
+            return 'copy {{ src {} dst {} }}'.format(
+                quote_list(self.items('src')), self.value('dst'))
+        elif kind == 3:
+            return ('docker-build {{ tag {} from {} recipes {{ '
+                    'yum-install {{ pkg {} }} }} workdir {} }}').format(
+                        self.value('tag'), self.value('amazonlinux:2'),
+                        quote_list(self.items('pkg')), quote('/app'))
+        return ('upload {{ user {} host {} src {} dst {} '
+                'exclude {} }}').format(
+                    self.value('deploy'), self.value('host'),
+                    self.value('src'), quote('/dst'),
+                    quote_list(self.items('exclude')))
+
+    def write_file(self, directory, name, depth, steps):
+        """Write |name| with |steps| steps split over it and its includes."""
+        children = self.workload.fanout if depth > 0 else 0
+        own = steps // (children + 1) + steps % (children + 1)
+        lines = []
+        if depth == self.workload.depth:
+            lines.append('set {{ {} }}'.format(' '.join(
+                '{} {}'.format(var, quote(var)) for var in variable_names())))
+        for child in range(children):
+            child_name = '{}-{}.trask'.format(name.split('.')[0], child)
+            self.write_file(directory, child_name, depth - 1,
+                            steps // (children + 1))
+            lines.append('include {{ file {} }}'.format(quote(child_name)))
+        for index in range(own):
+            lines.append(self.step(index))
+        with open(os.path.join(directory, name), 'w') as wfile:
+            wfile.write('\n'.join(lines) + '\n')
+
+
+def generate(directory, workload):
+    """Write the files for |workload|, returning the path of the root."""
+    Generator(workload).write_file(directory, 'main.trask', workload.depth,
+                                   workload.steps)
+    return os.path.join(directory, 'main.trask')
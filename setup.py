@@ -21,4 +21,5 @@ setuptools.setup(
     package_data={
         'trask': ['schema'],
     },
+    python_requires='>=3.5',
     install_requires=['attrs', 'tatsu'])
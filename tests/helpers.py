@@ -0,0 +1,26 @@
+# pylint: disable=missing-docstring
+
+import io
+import json
+import tarfile
+
+
+def add_file(tar, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    tar.addfile(info, io.BytesIO(data))
+
+
+def write_image(path, layers):
+    """Write a minimal `docker save` archive with the given layers."""
+    config = {'rootfs': {'diff_ids': [diff_id for diff_id, _ in layers]}}
+    manifest = [{
+        'Config': 'config.json',
+        'RepoTags': ['img:latest'],
+        'Layers': [name for _, name in layers]
+    }]
+    with tarfile.open(path, 'w') as tar:
+        add_file(tar, 'config.json', json.dumps(config).encode())
+        add_file(tar, 'manifest.json', json.dumps(manifest).encode())
+        for _, name in layers:
+            add_file(tar, name, name.encode())
@@ -0,0 +1,60 @@
+# pylint: disable=missing-docstring
+
+import os
+import unittest
+
+import trask
+from trask import builder, phase2, types
+
+SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
+
+
+class TestBuilder(unittest.TestCase):
+    def test_key_name(self):
+        self.assertEqual(builder.key_name('from_'), 'from')
+        self.assertEqual(builder.key_name('install_rust'), 'install-rust')
+
+    def test_sample1(self):
+        built = trask.Builder(SCRIPT_DIR).docker_build(
+            tag='sample1',
+            from_='amazonlinux:2',
+            recipes={
+                'yum_install': {
+                    'pkg': ['gcc', 'openssl-devel']
+                },
+                'install_rust': {
+                    'channel': 'nightly'
+                }
+            },
+            workdir='/app').docker_run(
+                image='sample1',
+                init=True,
+                volumes=[{
+                    'host': '..',
+                    'container': '/app'
+                }],
+                commands=['cargo build --release', 'cargo test --release'])
+        expected = trask.load(os.path.join(SCRIPT_DIR, 'sample1.trask'))
+        self.assertEqual(built.load(), expected)
+
+    def test_var_and_call(self):
+        built = trask.Builder('/base')
+        built.set(my_host=trask.Call('env', ['HOST']))
+        built.create_temp_dir(var='out')
+        built.copy(src=['a'], dst=trask.Var('out'))
+        steps = built.load()
+        self.assertEqual(steps[0].recipe.my_host,
+                         types.Value(types.Call('env', ['HOST'])))
+        self.assertEqual(steps[2].recipe.dst,
+                         types.Value(types.Var('out'), is_path=True))
+        self.assertEqual(steps[2].path, '/base')
+
+    def test_invalid(self):
+        with self.assertRaises(phase2.SchemaError):
+            trask.Builder().ssh(user='me').load()
+        with self.assertRaises(AttributeError):
+            trask.Builder()._private()  # pylint: disable=protected-access
+
+    def test_run(self):
+        ctx = trask.Builder().set(a='b').run()
+        self.assertEqual(ctx.variables, {'a': 'b'})
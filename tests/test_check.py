@@ -0,0 +1,54 @@
+# pylint: disable=missing-docstring
+
+import io
+import os
+import tempfile
+import unittest
+
+from trask import check
+
+
+class TestCheck(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = self.temp_dir.name
+        self.files = {
+            'good.trask': "include { file 'common/inc.trask' }",
+            'common/inc.trask': "set { a 'b' }",
+            'common/other.txt': '',
+            'bad.trask.json': '[{"ssh": {"user": "x"}}]',
+        }
+        for name, contents in self.files.items():
+            path = os.path.join(self.root, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as wfile:
+                wfile.write(contents)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    def test_find_files(self):
+        self.assertEqual(
+            sorted(check.find_files([self.root, '/explicit'])),
+            sorted([
+                self.path('good.trask'),
+                self.path('bad.trask.json'),
+                self.path('common/inc.trask'), '/explicit'
+            ]))
+
+    def test_check_files(self):
+        files = [self.path('good.trask'), self.path('bad.trask.json')]
+        for jobs in (1, 2):
+            errors = check.check_files(files, jobs)
+            self.assertIsNone(errors[0])
+            self.assertTrue(errors[1].startswith('MissingKey'))
+
+    def test_check(self):
+        out = io.StringIO()
+        self.assertEqual(check.check([self.path('good.trask')], out=out), 0)
+        out = io.StringIO()
+        self.assertEqual(check.check([self.root], jobs=2, out=out), 1)
+        self.assertIn('3 file(s) checked, 1 failed', out.getvalue())
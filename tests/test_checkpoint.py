@@ -0,0 +1,70 @@
+# pylint: disable=missing-docstring
+
+import os
+
+import attr
+from pyfakefs import fake_filesystem_unittest
+
+from trask import checkpoint, phase3, types
+
+
+def make_step(name, **recipe):
+    cls = attr.make_class('Mock', list(recipe))
+    values = {key: types.Value(val) for key, val in recipe.items()}
+    return types.Step(name, cls(**values), '/')
+
+
+class TestCheckpoint(fake_filesystem_unittest.TestCase):
+    def setUp(self):
+        self.setUpPyfakefs()
+        self.steps = [make_step('set', x='a'), make_step('set', y='b')]
+        self.hashes = [checkpoint.step_hash(step) for step in self.steps]
+
+    def test_step_hash(self):
+        self.assertNotEqual(self.hashes[0], self.hashes[1])
+        self.assertEqual(self.hashes[0],
+                         checkpoint.step_hash(make_step('set', x='a')))
+
+    def test_save_load(self):
+        os.makedirs('/tmp/keep')
+        saved = checkpoint.Checkpoint('/cache/a.json')
+        ctx = phase3.Context()
+        ctx.variables['x'] = 'a'
+        ctx.temp_dirs += ['/tmp/keep', '/tmp/other-file']
+        ctx.file_temp_dirs.append('/tmp/keep')
+        saved.record(self.hashes[0], ctx)
+        # The variables may hold secrets
+        self.assertEqual(os.stat('/cache/a.json').st_mode & 0o777, 0o600)
+
+        loaded = checkpoint.Checkpoint.load('/cache/a.json')
+        ctx = phase3.Context()
+        self.assertEqual(loaded.restore(self.hashes, ctx), 1)
+        self.assertEqual(ctx.variables, {'x': 'a'})
+        self.assertEqual(ctx.temp_dirs, ['/tmp/keep'])
+        self.assertEqual(ctx.file_temp_dirs, ['/tmp/keep'])
+
+        loaded.remove()
+        self.assertFalse(os.path.exists('/cache/a.json'))
+        self.assertEqual(
+            checkpoint.Checkpoint.load('/cache/a.json').restore(
+                self.hashes, phase3.Context()), 0)
+
+    def test_discard(self):
+        os.makedirs('/tmp/keep')
+        saved = checkpoint.Checkpoint('/cache/a.json')
+        saved.temp_dirs = ['/tmp/keep']
+        saved.save()
+        checkpoint.Checkpoint.load('/cache/a.json').discard()
+        self.assertFalse(os.path.exists('/tmp/keep'))
+        self.assertFalse(os.path.exists('/cache/a.json'))
+
+    def test_stale(self):
+        saved = checkpoint.Checkpoint('/cache/a.json')
+        saved.steps = [self.hashes[1]]
+        with self.assertRaises(checkpoint.StaleCheckpoint):
+            saved.restore(self.hashes, phase3.Context())
+
+        saved.steps = [self.hashes[0]]
+        saved.temp_dirs = ['/tmp/gone']
+        with self.assertRaises(checkpoint.StaleCheckpoint):
+            saved.restore(self.hashes, phase3.Context())
@@ -0,0 +1,93 @@
+# pylint: disable=missing-docstring
+
+import subprocess
+import unittest
+from unittest import mock
+
+import attr
+
+from trask import events, phase3, types
+
+
+class TestHooks(unittest.TestCase):
+    def test_emit(self):
+        hooks = events.Hooks()
+        self.assertFalse(hooks)
+        received = []
+        hooks.on(events.BYTES_COPIED, lambda size: received.append(size))
+        self.assertTrue(hooks)
+        hooks.emit(events.BYTES_COPIED, size=3)
+        hooks.emit(events.BYTES_UPLOADED, host='h', size=4)
+        self.assertEqual(received, [3])
+
+        with self.assertRaises(ValueError):
+            hooks.on('unknown', print)
+
+    def test_load_plugins(self):
+        entry_points = []
+        for name in ('a', 'b'):
+            entry_point = mock.Mock()
+            entry_point.name = name
+            entry_points.append(entry_point)
+        hooks = events.Hooks()
+        with mock.patch('trask.events.entry_points',
+                        return_value=entry_points):
+            events.load_plugins(hooks, ['b'])
+            with self.assertRaises(ValueError):
+                events.load_plugins(hooks, ['c'])
+        entry_points[0].load.assert_not_called()
+        entry_points[1].load.return_value.assert_called_once_with(hooks)
+
+
+class TestRunEvents(unittest.TestCase):
+    def setUp(self):
+        self.hooks = events.Hooks()
+        self.received = []
+        for event in events.EVENTS:
+            self.hooks.on(event, self.recorder(event))
+        self.ctx = phase3.Context(
+            dry_run=False, session=phase3.Session(hooks=self.hooks))
+
+    def recorder(self, event):
+        def record(**fields):
+            fields.pop('seconds', None)
+            self.received.append((event, fields))
+
+        return record
+
+    def run_step(self, *cmd):
+        def handler(_, ctx):
+            ctx.run_cmd(*cmd)
+
+        step = types.Step('cmd', attr.make_class('Mock', [])(), '/')
+        with mock.patch.dict(phase3.HANDLERS, cmd=handler):
+            phase3.run_step(step, self.ctx)
+        return step
+
+    def test_success(self):
+        step = self.run_step('true')
+        self.assertEqual(self.received, [
+            (events.STEP_START, {'step': step}),
+            (events.COMMAND_START, {'cmd': ('true', )}),
+            (events.COMMAND_END, {'cmd': ('true', ), 'exit_code': 0}),
+            (events.STEP_END, {'step': step, 'error': None}),
+        ])
+
+    def test_failure(self):
+        with self.assertRaises(subprocess.CalledProcessError) as cm:
+            self.run_step('false')
+        self.assertEqual(self.received[2],
+                         (events.COMMAND_END,
+                          {'cmd': ('false', ), 'exit_code': 1}))
+        self.assertIs(self.received[3][1]['error'], cm.exception)
+
+    def test_missing_command(self):
+        with self.assertRaises(FileNotFoundError):
+            self.run_step('/nonexistent/command')
+        self.assertEqual(self.received[2][1]['exit_code'], 'error')
+
+    def test_timeout(self):
+        self.ctx.timeout = 0.1
+        with self.assertRaises(phase3.StepTimeout):
+            self.run_step('sleep', '1')
+        self.assertEqual(self.received[2][1]['exit_code'], 'timeout')
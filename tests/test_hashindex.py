@@ -0,0 +1,87 @@
+# pylint: disable=missing-docstring
+
+import hashlib
+import os
+from unittest import mock
+
+from pyfakefs import fake_filesystem_unittest
+
+from trask import hashindex
+
+
+def sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class TestHashIndex(fake_filesystem_unittest.TestCase):
+    def setUp(self):
+        self.setUpPyfakefs()
+
+    def test_digest(self):
+        self.fs.create_file('/a', contents='a')
+        index = hashindex.HashIndex()
+        with mock.patch('trask.hashindex.hash_file',
+                        wraps=hashindex.hash_file) as hash_file:
+            self.assertEqual(index.digest('/a'), sha256(b'a'))
+            self.assertEqual(index.digest('/a'), sha256(b'a'))
+            self.assertEqual(hash_file.call_count, 1)
+
+            with open('/a', 'w') as wfile:
+                wfile.write('changed')
+            self.assertEqual(index.digest('/a'), sha256(b'changed'))
+            self.assertEqual(hash_file.call_count, 2)
+
+    def test_scan(self):
+        self.fs.create_file('/root/a', contents='a')
+        self.fs.create_file('/root/b/c', contents='c')
+        self.fs.create_dir('/root/empty')
+        index = hashindex.HashIndex()
+        files = index.scan('/root')
+        self.assertEqual([(info.path, info.digest) for info in files],
+                         [('a', sha256(b'a')), ('b/c', sha256(b'c'))])
+
+    @mock.patch('trask.hashindex.LARGE_FILE_SIZE', 2)
+    def test_scan_large(self):
+        self.fs.create_file('/root/small', contents='s')
+        self.fs.create_file('/root/large', contents='large')
+        index = hashindex.HashIndex(max_workers=2)
+        files = index.scan('/root')
+        self.assertEqual([(info.path, info.digest) for info in files],
+                         [('large', sha256(b'large')),
+                          ('small', sha256(b's'))])
+        self.assertEqual(len(index.entries), 2)
+
+    def test_save(self):
+        self.fs.create_file('/root/a', contents='a')
+        index = hashindex.HashIndex('/cache/index.json')
+        index.save()
+        self.assertFalse(os.path.exists('/cache/index.json'))
+
+        index.scan('/root')
+        index.save()
+        index = hashindex.HashIndex('/cache/index.json')
+        self.assertIn('/root/a', index.entries)
+        with mock.patch('trask.hashindex.hash_file') as hash_file:
+            index.scan('/root')
+            hash_file.assert_not_called()
+
+    def test_prune(self):
+        self.fs.create_file('/root/a', contents='a')
+        self.fs.create_file('/root/tmp/b', contents='b')
+        self.fs.create_file('/root/tmp2/c', contents='c')
+        index = hashindex.HashIndex('/cache/index.json')
+        index.scan('/root')
+        index.save()
+        index = hashindex.HashIndex('/cache/index.json')
+        with mock.patch('os.path.exists') as exists:
+            index.prune(['/root/tmp'])
+        exists.assert_not_called()
+        self.assertTrue(index.dirty)
+        index.save()
+        index = hashindex.HashIndex('/cache/index.json')
+        self.assertEqual(sorted(index.entries), ['/root/a', '/root/tmp2/c'])
+
+    def test_default_path(self):
+        with mock.patch.dict(os.environ, {'XDG_CACHE_HOME': '/xdg'}):
+            self.assertEqual(hashindex.default_path(),
+                             '/xdg/trask/hashindex.json')
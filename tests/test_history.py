@@ -0,0 +1,53 @@
+# pylint: disable=missing-docstring
+
+import os
+import tempfile
+import unittest
+
+from trask import events, history, types
+
+
+class TestHistory(unittest.TestCase):
+    def test_step_keys(self):
+        steps = [
+            types.Step('ssh', None, '/'),
+            types.Step('ssh', None, '/', label='deploy'),
+            types.Step('ssh', None, '/')
+        ]
+        self.assertEqual(
+            history.step_keys('/a.trask', steps),
+            ['/a.trask:ssh:1', '/a.trask:deploy:1', '/a.trask:ssh:2'])
+
+    def test_format_duration(self):
+        self.assertEqual(history.format_duration(1.25), '1.2s')
+        self.assertEqual(history.format_duration(125), '2m 05s')
+        self.assertEqual(history.format_duration(7500), '2h 05m')
+
+    def test_estimate(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'trask', 'history.sqlite')
+            timing = history.History(path)
+            self.assertIsNone(timing.estimate('a'))
+            for seconds in range(history.KEEP + 3):
+                timing.record('a', seconds)
+            timing.record('b', 1.5)
+            timing.save()
+            timing.close()
+
+            timing = history.History(path)
+            self.assertEqual(timing.estimate('b'), 1.5)
+            # Only the last KEEP are kept
+            self.assertEqual(timing.estimate('a'), 7.5)
+            timing.close()
+
+    def test_register(self):
+        hooks = events.Hooks()
+        timing = history.History()
+        step = types.Step('ssh', None, '/')
+        other = types.Step('ssh', None, '/')
+        timing.register(hooks, {id(step): 'a'})
+        hooks.emit(events.STEP_END, step=step, seconds=2, error=None)
+        hooks.emit(events.STEP_END, step=step, seconds=4, error=OSError())
+        hooks.emit(events.STEP_END, step=other, seconds=8, error=None)
+        timing.save()
+        self.assertEqual(timing.estimate('a'), 2)
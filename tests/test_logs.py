@@ -0,0 +1,85 @@
+# pylint: disable=missing-docstring
+
+import io
+import os
+import subprocess
+import tempfile
+import unittest
+from unittest import mock
+
+import attr
+
+from trask import logs, phase3, types
+
+
+class TestLogCapture(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.out = io.StringIO()
+        self.capture = logs.LogCapture(self.temp_dir.name,
+                                       logs.Status(self.out))
+        self.ctx = phase3.Context(dry_run=False)
+        self.ctx.logs = self.capture
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def run_step(self, script, label=None):
+        def handler(_, ctx):
+            ctx.run_cmd('sh', '-c', script)
+            return ctx.check_output('echo', 'captured')
+
+        step = types.Step('sh', attr.make_class('Mock', [])(), '/', label)
+        with mock.patch.dict(phase3.HANDLERS, sh=handler):
+            phase3.run_step(step, self.ctx)
+
+    def read_log(self, name):
+        self.capture.close()
+        with open(os.path.join(self.temp_dir.name, name)) as rfile:
+            return rfile.read()
+
+    def test_success(self):
+        with mock.patch('trask.phase3.run_logged',
+                        wraps=phase3.run_logged) as run_logged:
+            self.run_step('echo out; echo err >&2')
+            self.assertEqual(run_logged.call_count, 2)
+        self.run_step('echo second', label='two')
+        # stdout and stderr are read on separate threads
+        lines = self.read_log('001-sh.log').splitlines()
+        self.assertEqual(lines[0], '$ sh -c echo out; echo err >&2')
+        self.assertEqual(sorted(lines[1:3]), ['err', 'out'])
+        self.assertEqual(lines[3:], ['$ echo captured'])
+        self.assertEqual(
+            self.read_log('002-two.log'),
+            '$ sh -c echo second\nsecond\n$ echo captured\n')
+        self.assertIn('[sh] done', self.out.getvalue())
+
+    def test_label_path(self):
+        self.run_step('echo out', label='../a/b c')
+        self.assertEqual(os.listdir(self.temp_dir.name), ['001-a-b-c.log'])
+        self.assertIn('[../a/b c] done', self.out.getvalue())
+
+    def test_slugify(self):
+        self.assertEqual(logs.slugify('build: web/app'), 'build-web-app')
+        self.assertEqual(logs.slugify('..'), 'step')
+        self.assertEqual(len(logs.slugify('x' * 100)), logs.MAX_SLUG)
+
+    def test_failure(self):
+        self.capture.tail_lines = 2
+        with self.assertRaises(subprocess.CalledProcessError):
+            self.run_step('seq 5; exit 3')
+        lines = self.out.getvalue().splitlines()
+        self.assertTrue(lines[0].startswith('[sh] failed: '))
+        self.assertEqual(lines[1:], ['  4', '  5'])
+        self.assertEqual(
+            self.read_log('001-sh.log'),
+            '$ sh -c seq 5; exit 3\n1\n2\n3\n4\n5\n')
+
+    def test_check_output(self):
+        log = self.capture.open_step(types.Step('x', None, '/'))
+        self.assertEqual(
+            phase3.run_process(['sh', '-c', 'echo a; echo b >&2'],
+                               log=log,
+                               stdout=subprocess.PIPE), b'a\n')
+        self.assertEqual(list(log.tail), [b'b\n'])
+        log.close()
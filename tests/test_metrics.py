@@ -0,0 +1,57 @@
+# pylint: disable=missing-docstring
+
+import os
+import tempfile
+import unittest
+
+from trask import events, metrics, types
+
+
+class TestPrometheusExporter(unittest.TestCase):
+    def test_format(self):
+        hooks = events.Hooks()
+        exporter = metrics.PrometheusExporter(None)
+        exporter.register(hooks)
+        step = types.Step('ssh', None, '/', label='dep"loy')
+        hooks.emit(events.STEP_END, step=step, seconds=2, error=None)
+        hooks.emit(events.STEP_END, step=step, seconds=1, error=None)
+        hooks.emit(
+            events.COMMAND_END, cmd=('/usr/bin/ssh', 'h'), exit_code=255,
+            seconds=1)
+        for exit_code in ('timeout', 'error'):
+            hooks.emit(
+                events.COMMAND_END,
+                cmd=('ssh', ),
+                exit_code=exit_code,
+                seconds=1)
+        hooks.emit(events.CACHE_HIT, cache='copy', count=5)
+        hooks.emit(events.BYTES_UPLOADED, host='me@h', size=10)
+
+        lines = exporter.format(success=False).splitlines()
+        self.assertIn('trask_run_success 0.0', lines)
+        self.assertIn('# TYPE trask_steps_total counter', lines)
+        self.assertIn(
+            'trask_steps_total{label="dep\\"loy",result="success",'
+            'step="ssh"} 2.0', lines)
+        self.assertIn(
+            'trask_step_duration_seconds_total{label="dep\\"loy",'
+            'step="ssh"} 3.0', lines)
+        self.assertIn(
+            'trask_commands_total{command="ssh",exit_code="255"} 1.0', lines)
+        self.assertIn(
+            'trask_commands_total{command="ssh",exit_code="timeout"} 1.0',
+            lines)
+        self.assertIn(
+            'trask_commands_total{command="ssh",exit_code="error"} 1.0',
+            lines)
+        self.assertIn('trask_cache_hits_total{cache="copy"} 5.0', lines)
+        self.assertIn('trask_uploaded_bytes_total{host="me@h"} 10.0', lines)
+        self.assertNotIn('# TYPE trask_copied_bytes_total counter', lines)
+
+    def test_write(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'trask.prom')
+            metrics.PrometheusExporter(path).write(success=True)
+            self.assertEqual(os.listdir(temp_dir), ['trask.prom'])
+            with open(path) as rfile:
+                self.assertIn('trask_run_success 1.0\n', rfile.read())
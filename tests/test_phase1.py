@@ -1,6 +1,7 @@
 # pylint: disable=missing-docstring
 
 import unittest
+from unittest import mock
 
 from pyfakefs import fake_filesystem_unittest
 
@@ -9,8 +10,8 @@ from trask import phase1, types
 
 class TestGrammar(unittest.TestCase):
     def test_bool(self):
-        self.assertIs(phase1.MODEL.parse('true', 'boolean'), True)
-        self.assertIs(phase1.MODEL.parse('false', 'boolean'), False)
+        self.assertIs(phase1.get_model().parse('true', 'boolean'), True)
+        self.assertIs(phase1.get_model().parse('false', 'boolean'), False)
 
     def test_invalid_bool(self):
         with self.assertRaises(ValueError):
@@ -18,21 +19,21 @@ class TestGrammar(unittest.TestCase):
 
     def test_string(self):
         self.assertEqual(
-            phase1.MODEL.parse("'myString'", 'string'), 'myString')
+            phase1.get_model().parse("'myString'", 'string'), 'myString')
 
     def test_call(self):
         self.assertEqual(
-            phase1.MODEL.parse("myFunc('myArg')", 'call'),
+            phase1.get_model().parse("myFunc('myArg')", 'call'),
             types.Call('myFunc', ['myArg']))
 
     def test_list(self):
         self.assertEqual(
-            phase1.MODEL.parse("['a' 'b' 'c']", 'list'), ['a', 'b', 'c'])
+            phase1.get_model().parse("['a' 'b' 'c']", 'list'), ['a', 'b', 'c'])
 
     def test_dictionary(self):
         text = "{a 'b'\nc 'd'}"
         self.assertEqual(
-            phase1.MODEL.parse(text, 'dictionary'), {
+            phase1.get_model().parse(text, 'dictionary'), {
                 'a': 'b',
                 'c': 'd',
             })
@@ -54,6 +55,19 @@ class TestPhase1(fake_filesystem_unittest.TestCase):
         expected = phase1.load('/b')
         self.assertEqual(result, expected)
 
+    def test_include_cache(self):
+        self.fs.create_file('/a', contents="include { file 'c' } x {}")
+        self.fs.create_file('/b', contents="include { file 'c' }")
+        self.fs.create_file('/c', contents="foo {}")
+        cache = {}
+        phase1.load('/a', cache)
+        self.assertEqual(sorted(cache), ['/a', '/c'])
+        with mock.patch(
+                'trask.phase1.parse_text',
+                wraps=phase1.parse_text) as parse_text:
+            self.assertEqual(len(phase1.load('/b', cache)), 1)
+            parse_text.assert_called_once()
+
     def test_include_not_variable(self):
         self.fs.create_file('/a', contents="include { file myVar }")
         with self.assertRaises(TypeError):
@@ -63,3 +77,52 @@ class TestPhase1(fake_filesystem_unittest.TestCase):
         self.fs.create_file('/a/b/c.trask', contents="set {}")
         result = phase1.load('/a/b/c.trask')
         self.assertEqual(result[0].path, '/a/b')
+
+
+class TestJson(unittest.TestCase):
+    def test_parse_json(self):
+        text = '''[
+          {"set": {"a": {"$call": "env", "args": ["X"]}}},
+          {"ssh": {"host": {"$var": "a"}, "commands": ["x"], "b": true}}
+        ]'''
+        self.assertEqual(
+            phase1.parse_json(text), [
+                types.Step('set', {'a': types.Call('env', ['X'])}, None),
+                types.Step('ssh', {
+                    'host': types.Var('a'),
+                    'commands': ['x'],
+                    'b': True
+                }, None)
+            ])
+
+    def test_invalid_json(self):
+        with self.assertRaises(phase1.JsonFormatError):
+            phase1.parse_json('[{"a": {}, "b": {}}]')
+        with self.assertRaises(phase1.JsonFormatError):
+            phase1.parse_json('[{"a": {"x": {"$var": "y", "z": 1}}}]')
+        with self.assertRaises(phase1.JsonFormatError):
+            phase1.parse_json('[{"a": {"x": {"$call": "y", "z": 1}}}]')
+
+    def test_same_as_text(self):
+        text = ("foo { a 'b' c [ true x ] d { e f('g' h) } }\n"
+                "bar {}")
+        steps = phase1.parse_text(text)
+        json_text = phase1.format_json(steps)
+        self.assertEqual(phase1.parse_json(json_text), steps)
+        self.assertEqual(phase1.parse_text(phase1.format_text(steps)), steps)
+
+    def test_format_quote(self):
+        with self.assertRaises(ValueError):
+            phase1.format_text([types.Step('a', {'b': "'"}, None)])
+
+
+class TestLoadJson(fake_filesystem_unittest.TestCase):
+    def setUp(self):
+        self.setUpPyfakefs()
+
+    def test_mixed_include(self):
+        self.fs.create_file(
+            '/a.trask.json', contents='[{"include": {"file": "b.trask"}}]')
+        self.fs.create_file('/b.trask', contents="foo {} bar {}")
+        self.assertEqual(phase1.load('/a.trask.json'), phase1.load('/b.trask'))
+        self.assertEqual(phase1.parse('/a.trask.json')[0].name, 'include')
@@ -2,7 +2,7 @@
 
 import unittest
 
-from trask import phase2, types
+from trask import phase1, phase2, types
 
 
 class TestMakeKeysSafe(unittest.TestCase):
@@ -18,21 +18,21 @@ class TestMakeKeysSafe(unittest.TestCase):
 
 class TestPhase2Primitives(unittest.TestCase):
     def test_bool(self):
-        schema = phase2.MODEL.parse('bool', 'type')
+        schema = phase2.get_model().parse('bool', 'type')
         result = phase2.Phase2.load(schema, True)
         self.assertEqual(result, types.Value(True))
         with self.assertRaises(phase2.TypeMismatch):
             phase2.Phase2.load(schema, 'foo')
 
     def test_string(self):
-        schema = phase2.MODEL.parse('string', 'type')
+        schema = phase2.get_model().parse('string', 'type')
         result = phase2.Phase2.load(schema, 'myString')
         self.assertEqual(result, types.Value('myString'))
         with self.assertRaises(phase2.TypeMismatch):
             phase2.Phase2.load(schema, True)
 
     def test_any(self):
-        schema = phase2.MODEL.parse('any', 'type')
+        schema = phase2.get_model().parse('any', 'type')
         result = phase2.Phase2.load(schema, 'myString')
         self.assertEqual(result, types.Value('myString'))
         result = phase2.Phase2.load(schema, True)
@@ -47,19 +47,19 @@ class TestPhase2Primitives(unittest.TestCase):
 
 class TestPhase2(unittest.TestCase):
     def test_empty(self):
-        schema = phase2.MODEL.parse('')
+        schema = phase2.get_model().parse('')
         result = phase2.Phase2.load(schema, [])
         self.assertEqual(result, [])
 
     def test_path(self):
-        schema = phase2.MODEL.parse('path', 'type')
+        schema = phase2.get_model().parse('path', 'type')
         result = phase2.Phase2.load(schema, 'myPath')
         self.assertEqual(result, types.Value('myPath', is_path=True))
         with self.assertRaises(phase2.TypeMismatch):
             phase2.Phase2.load(schema, True)
 
     def test_string_array(self):
-        schema = phase2.MODEL.parse('string[]', 'type')
+        schema = phase2.get_model().parse('string[]', 'type')
         result = phase2.Phase2.load(schema, ['a', 'b'])
         self.assertEqual(result, [types.Value('a'), types.Value('b')])
         with self.assertRaises(phase2.TypeMismatch):
@@ -70,7 +70,7 @@ class TestPhase2(unittest.TestCase):
             phase2.Phase2.load(schema, ['foo', True])
 
     def test_object(self):
-        schema = phase2.MODEL.parse("{ foo: string; }", 'type')
+        schema = phase2.get_model().parse("{ foo: string; }", 'type')
         result = phase2.Phase2.load(schema, {'foo': 'bar'})
         self.assertEqual(result.foo, types.Value('bar'))
         result = phase2.Phase2.load(schema, {})
@@ -79,27 +79,27 @@ class TestPhase2(unittest.TestCase):
             phase2.Phase2.load(schema, {'bad-key': 'bar'})
 
     def test_required_key(self):
-        schema = phase2.MODEL.parse("{ required foo: string; }", 'type')
+        schema = phase2.get_model().parse("{ required foo: string; }", 'type')
         result = phase2.Phase2.load(schema, {'foo': 'bar'})
         self.assertEqual(result.foo, types.Value('bar'))
         with self.assertRaises(phase2.MissingKey):
             phase2.Phase2.load(schema, {})
 
     def test_wildcard(self):
-        schema = phase2.MODEL.parse("{ *: string; }", 'type')
+        schema = phase2.get_model().parse("{ *: string; }", 'type')
         phase2.Phase2.load(schema, {})
         result = phase2.Phase2.load(schema, {'foo': 'bar'})
         self.assertEqual(result.foo, types.Value('bar'))
 
     def test_choice(self):
-        schema = phase2.MODEL.parse("string choices('x', 'y')", 'type')
+        schema = phase2.get_model().parse("string choices('x', 'y')", 'type')
         result = phase2.Phase2.load(schema, 'x')
         self.assertEqual(result, types.Value('x'))
         with self.assertRaises(phase2.InvalidChoice):
             phase2.Phase2.load(schema, 'foo')
 
     def test_var(self):
-        schema = phase2.MODEL.parse('string', 'type')
+        schema = phase2.get_model().parse('string', 'type')
         result = phase2.Phase2.load(schema, types.Var('x'),
                                     {'x': types.Kind.String})
         self.assertEqual(result, types.Value(types.Var('x')))
@@ -109,7 +109,7 @@ class TestPhase2(unittest.TestCase):
             phase2.Phase2.load(schema, types.Var('x'))
 
     def test_call(self):
-        schema = phase2.MODEL.parse('string', 'type')
+        schema = phase2.get_model().parse('string', 'type')
         result = phase2.Phase2.load(schema, types.Call('env', ('x', )))
         self.assertEqual(result, types.Value(types.Call('env', ('x', ))))
         with self.assertRaises(phase2.InvalidFunction):
@@ -117,7 +117,7 @@ class TestPhase2(unittest.TestCase):
 
     def test_set(self):
         loader = phase2.Phase2()
-        loader.load_one(phase2.SCHEMA, [
+        loader.load_one(phase2.get_schema(), [
             types.Step('set', {
                 'a': 'x',
                 'b': True,
@@ -133,38 +133,92 @@ class TestPhase2(unittest.TestCase):
     def test_set_bad_type(self):
         loader = phase2.Phase2()
         with self.assertRaises(phase2.SchemaError):
-            loader.load_one(phase2.SCHEMA,
+            loader.load_one(phase2.get_schema(),
                             [types.Step('set', {'a': object()}, None)], [])
 
     def test_step(self):
-        schema = phase2.MODEL.parse('foo {}')
+        schema = phase2.get_model().parse('foo {}')
         result = phase2.Phase2.load(schema, [types.Step('foo', {}, None)])
         self.assertEqual(len(result), 1)
         self.assertEqual(result[0].__class__, types.Step)
         self.assertEqual(result[0].name, 'foo')
 
+    def test_step_timeout(self):
+        schema = phase2.get_model().parse('foo {}')
+        for timeout, seconds in (('90', 90), ('1.5m', 90), ('2h', 7200),
+                                 (30, 30)):
+            result = phase2.Phase2.load(
+                schema, [types.Step('foo', {'timeout': timeout}, None)])
+            self.assertEqual(result[0].timeout, seconds)
+        for timeout in ('', 'soon', '5d', '0'):
+            with self.assertRaises(phase2.InvalidTimeout):
+                phase2.Phase2.load(
+                    schema, [types.Step('foo', {'timeout': timeout}, None)])
+        with self.assertRaises(phase2.TypeMismatch):
+            phase2.Phase2.load(schema,
+                               [types.Step('foo', {'timeout': True}, None)])
+
+    def test_set_step_keys(self):
+        """Check that set can bind the keys other steps reserve."""
+        steps = phase2.Phase2.load(
+            phase2.get_schema(),
+            phase1.parse_text(
+                "set { label 'a' timeout 'b' worker 'c' }"
+                "ssh { user label host timeout commands [worker] }"))
+        self.assertEqual((steps[0].label, steps[0].timeout, steps[0].worker),
+                         (None, None, None))
+        recipe = steps[0].recipe
+        self.assertEqual(
+            (recipe.label.data, recipe.timeout.data, recipe.worker.data),
+            ('a', 'b', 'c'))
+
+    def test_temp_dir_size(self):
+        self.assertEqual(phase2.parse_size('512', []), 512)
+        self.assertEqual(phase2.parse_size('1.5k', []), 1536)
+        self.assertEqual(phase2.parse_size('2G', []), 2 * 1024**3)
+        for size in ('', 'big', '5X', '0'):
+            with self.assertRaises(phase2.InvalidSize):
+                phase2.parse_size(size, [])
+        with self.assertRaises(phase2.InvalidSize):
+            phase2.Phase2.load(phase2.get_schema(), [
+                types.Step('create-temp-dir', {
+                    'var': 'tmp',
+                    'size': 'lots'
+                }, None)
+            ])
+
     def test_invalid_object(self):
-        schema = phase2.MODEL.parse('{}', 'type')
+        schema = phase2.get_model().parse('{}', 'type')
         with self.assertRaises(phase2.TypeMismatch):
             phase2.Phase2.load(schema, True)
 
     def test_set_call(self):
         loader = phase2.Phase2()
         loader.load_one(
-            phase2.SCHEMA,
+            phase2.get_schema(),
             [types.Step('set', {'foo': types.Call('env',
                                                   ('key', ))}, None)], [])
         self.assertEqual(loader.variables, {'foo': types.Kind.String})
 
+    def test_export(self):
+        loader = phase2.Phase2()
+        loader.variables['a'] = types.Kind.String
+        loader.load_one(phase2.get_schema(),
+                        [types.Step('export', {'vars': ['a']}, None)], [])
+        with self.assertRaises(phase2.TypeMismatch):
+            loader.load_one(
+                phase2.get_schema(),
+                [types.Step('export', {'vars': [types.Var('a')]}, None)], [])
+
     def test_create_temp_dir(self):
         loader = phase2.Phase2()
-        loader.load_one(phase2.SCHEMA,
+        loader.load_one(phase2.get_schema(),
                         [types.Step('create-temp-dir', {'var': 'foo'}, None)],
                         [])
         self.assertEqual(loader.variables, {'foo': types.Kind.Path})
 
     def test_call_to_path(self):
-        schema = phase2.MODEL.parse('path', 'type')
+        schema = phase2.get_model().parse('path', 'type')
         result = phase2.Phase2.load(schema, types.Call('env', ('key', )))
         self.assertEqual(
             result, types.Value(types.Call('env', ('key', )), is_path=True))
@@ -172,9 +226,24 @@ class TestPhase2(unittest.TestCase):
             phase2.Phase2.load(schema, True)
 
     def test_invalid_call_type(self):
-        schema = phase2.MODEL.parse('bool', 'type')
+        schema = phase2.get_model().parse('bool', 'type')
         with self.assertRaises(phase2.TypeMismatch):
             phase2.Phase2.load(schema, types.Call('env', ('key', )))
 
+    def test_interned_values(self):
+        schema = phase2.get_model().parse(
+            '{ a: string; b: string[]; c: bool; }', 'type')
+        result = phase2.Phase2.load(schema, {'a': 'x', 'b': ['x', 'y']})
+        self.assertIs(result.a, result.b[0])
+        self.assertIsNot(result.a, result.b[1])
+        self.assertEqual(result.c, types.Value(None))
+
+    def test_recipe_class_shared(self):
+        schema = phase2.get_model().parse('{ a: string; }', 'type')
+        result1 = phase2.Phase2.load(schema, {'a': 'x'})
+        result2 = phase2.Phase2.load(schema, {'a': 'y'})
+        self.assertIs(result1.__class__, result2.__class__)
+        self.assertFalse(hasattr(result1, '__dict__'))
+
     def test_non_object_wildcard(self):
         self.assertFalse(phase2.Type(types.Kind.Bool).wildcard_key())
@@ -1,13 +1,24 @@
 # pylint: disable=missing-docstring
 
+import contextlib
+import io
 import os
+import shlex
+import stat
+import subprocess
+import tarfile
+import tempfile
+import threading
+import time
 import unittest
 from unittest import mock
 
 import attr
 from pyfakefs import fake_filesystem_unittest
 
-from trask import phase2, phase3, types
+from trask import (events, phase1, phase2, phase3, scheduler, store,
+                   types)
+from tests import helpers
 
 
 class TestResolveValue(unittest.TestCase):
@@ -116,15 +127,54 @@ class TestResolve(unittest.TestCase):
         self.assertEqual(ctx.repath('myPath'), '/base/myPath')
 
 
-def context_command_recorder():
-    ctx = phase3.Context()
+def context_command_recorder(session=None):
+    ctx = phase3.Context(session=session)
     ctx.commands = []
 
-    def run_cmd(self, *cmd):
+    def run_cmd(self, *cmd, **_):
         self.commands.append(cmd)
 
+    def check_output(self, *cmd):
+        self.commands.append(cmd)
+        return ''
+
     # pylint: disable=assignment-from-no-return
     ctx.run_cmd = run_cmd.__get__(ctx, phase3.Context)
+    ctx.pipe_cmd = run_cmd.__get__(ctx, phase3.Context)
+    ctx.check_output = check_output.__get__(ctx, phase3.Context)
+    return ctx
+
+
+def context_on_hosts(homes):
+    """Make a context that runs ssh and scp commands on local directories.
+
+    |homes| maps each host to the directory used as its home.
+    """
+    ctx = phase3.Context(dry_run=False)
+
+    def local_path(arg):
+        target, sep, path = arg.partition(':')
+        if sep and '@' in target:
+            return os.path.join(homes[target.split('@')[1]], path)
+        return arg
+
+    def run_cmd(*cmd, stdin=None, stdout=None, cwd=None):
+        if cmd[0] == 'scp':
+            subprocess.check_call(
+                ['cp', '-r'] + [local_path(arg) for arg in cmd[2:]],
+                cwd=cwd)
+            return
+        args = [arg for arg in cmd[1:] if arg != '-A']
+        home = homes[args[0].split('@')[1]]
+        if args[1] == 'scp':
+            run_cmd(*args[1:], cwd=home)
+            return
+        with phase3.open_or_none(stdin, 'rb') as rfile:
+            subprocess.check_call(['sh', '-c', ' '.join(args[1:])],
+                                  stdin=rfile,
+                                  cwd=home)
+
+    ctx.run_cmd = run_cmd
     return ctx
 
 
@@ -132,13 +182,29 @@ class TestPhase3(unittest.TestCase):
     def test_handlers(self):
         """Check that all of the steps in the schema have handlers."""
         step_names = set()
-        for step in phase2.SCHEMA.array_type.fields:
+        for step in phase2.get_schema().array_type.fields:
             step_names.add(step.name)
 
         # Includes are expanded in phase1
         step_names.remove('include')
 
         self.assertEqual(step_names, phase3.HANDLERS.keys())
+        self.assertEqual(step_names, phase3.RESOURCE_CLASSES.keys())
+        self.assertEqual(step_names, phase3.COSTS.keys())
+
+    def test_step_resources(self):
+        steps = phase2.Phase2.load(
+            phase2.get_schema(),
+            phase1.parse_text(
+                "set { h 'h1' } ssh { user 'me' host h commands ['true'] }"
+                "docker-build { from 'amazonlinux:2' }"))
+        ctx = phase3.Context()
+        ctx.variables['h'] = 'h1'
+        self.assertEqual(
+            phase3.step_resources(steps[1], ctx), ('network', 'host:h1'))
+        self.assertEqual(steps[1].recipe.host.data, types.Var('h'))
+        self.assertEqual(
+            phase3.step_resources(steps[2], ctx), ('cpu', 'docker'))
 
     def test_run_cmd(self):
         # pylint: disable=no-self-use
@@ -147,6 +213,55 @@ class TestPhase3(unittest.TestCase):
         ctx.dry_run = True
         ctx.run_cmd('false')
 
+    def test_pipe_cmd(self):
+        ctx = phase3.Context(dry_run=False)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            out = os.path.join(temp_dir, 'out')
+            ctx.pipe_cmd(
+                'sh', '-c', 'cat > ' + out,
+                feed=lambda wfile: wfile.write(b'data'))
+            with open(out, 'rb') as rfile:
+                self.assertEqual(rfile.read(), b'data')
+
+        # The command's failure is raised, not the broken pipe
+        def feed(wfile):
+            while True:
+                wfile.write(b'x' * 65536)
+
+        with self.assertRaises(subprocess.CalledProcessError):
+            ctx.pipe_cmd('false', feed=feed)
+
+        def fail(_):
+            raise ValueError()
+
+        with self.assertRaises(ValueError):
+            ctx.pipe_cmd('cat', feed=fail)
+
+    def test_for_each_concurrently_limit(self):
+        lock = threading.Lock()
+        running = []
+        most = []
+
+        def func(_):
+            with lock:
+                running.append(None)
+                most.append(len(running))
+            time.sleep(0.01)
+            with lock:
+                running.pop()
+
+        phase3.for_each_concurrently(func, [(index, ) for index in range(8)],
+                                     2)
+        self.assertEqual(len(most), 8)
+        self.assertLessEqual(max(most), 2)
+
+    def test_transfer_limit(self):
+        self.assertEqual(phase3.Context().transfer_limit(),
+                         scheduler.DEFAULT_LIMITS['network'])
+        session = phase3.Session(limits={'network': 3})
+        self.assertEqual(
+            phase3.Context(session=session).transfer_limit(), 3)
+
     def test_set(self):
         cls = attr.make_class('SetMock', ['foo'])
         obj = cls('bar')
@@ -167,14 +282,20 @@ class TestPhase3(unittest.TestCase):
 
     def test_handle_update(self):
         cls = attr.make_class(
-            'Mock', ['user', 'host', 'identity', 'replace', 'src', 'dst'])
+            'Mock',
+            ['user', 'host', 'hosts', 'identity', 'replace', 'store', 'src',
+             'dst', 'include', 'exclude'])
         obj = cls(
             user='me',
             host='myHost',
+            hosts=None,
             identity='/myId',
             replace=False,
+            store=None,
             src='/src',
-            dst='/dst')
+            dst='/dst',
+            include=None,
+            exclude=None)
 
         ctx = context_command_recorder()
 
@@ -191,6 +312,139 @@ class TestPhase3(unittest.TestCase):
             [('ssh', '-i', '/myId', 'me@myHost', 'rm', '-fr', '/dst'),
              ('scp', '-i', '/myId', '-r', '/src', 'me@myHost:/dst')])
 
+    def test_session(self):
+        cls = attr.make_class('Mock', ['identity', 'user', 'host', 'commands'])
+        obj = cls(identity=None, user='me', host='myHost', commands=['a'])
+
+        session = phase3.Session()
+        ctx = context_command_recorder(session)
+        self.assertIs(ctx.temp_dirs, session.temp_dirs)
+        phase3.handle_ssh(obj, ctx)
+        control_dir = session.ssh_control_dir
+        self.assertEqual(ctx.commands, [
+            ('ssh', '-o', 'ControlMaster=auto', '-o',
+             'ControlPath=' + os.path.join(control_dir, '%C'), '-o',
+             'ControlPersist=60', 'me@myHost', 'a')
+        ])
+
+        ctx.variables['x'] = 'y'
+        phase3.handle_export(attr.make_class('Mock', ['vars'])(['x']), ctx)
+        self.assertEqual(session.exports, {'x': 'y'})
+
+        session.close()
+        self.assertFalse(os.path.exists(control_dir))
+
+    def test_relay_rounds(self):
+        self.assertEqual(phase3.relay_rounds([]), [])
+        self.assertEqual(phase3.relay_rounds(['a']), [[(None, 'a')]])
+        rounds = phase3.relay_rounds(['a', 'b', 'c', 'd', 'e'])
+        self.assertEqual(rounds, [[(None, 'a')], [('a', 'b'), (None, 'c')],
+                                  [('a', 'd'), ('b', 'e')]])
+        self.assertEqual(len(phase3.relay_rounds(list(range(100)))), 7)
+
+    def test_handle_upload_relay(self):
+        cls = attr.make_class(
+            'Mock',
+            ['user', 'host', 'hosts', 'identity', 'replace', 'store', 'src',
+             'dst', 'include', 'exclude'])
+        obj = cls(
+            user='me',
+            host=None,
+            hosts=['h1', 'h2'],
+            identity=None,
+            replace=False,
+            store=None,
+            src='/src',
+            dst='dst',
+            include=None,
+            exclude=None)
+
+        ctx = context_command_recorder()
+        with mock.patch('uuid.uuid4', return_value=mock.Mock(hex='x')):
+            phase3.handle_upload(obj, ctx)
+        self.assertEqual(ctx.commands, [
+            ('ssh', 'me@h1', 'mkdir', '.trask-upload-x'),
+            ('scp', '-r', '/src', 'me@h1:.trask-upload-x/src'),
+            ('ssh', '-A', 'me@h1', 'scp', '-r', '.trask-upload-x',
+             'me@h2:.trask-upload-x'),
+            ('ssh', 'me@h1', 'cp -r .trask-upload-x/src dst && '
+             'rm -fr .trask-upload-x'),
+            ('ssh', 'me@h2', 'cp -r .trask-upload-x/src dst && '
+             'rm -fr .trask-upload-x'),
+        ])
+
+        obj.hosts = None
+        with self.assertRaises(ValueError):
+            phase3.handle_upload(obj, ctx)
+
+    def test_upload_relay_layout(self):
+        """Check that relayed hosts get the same files as a direct upload.
+
+        Filters must not change where the files go either.
+        """
+        cls = attr.make_class(
+            'Mock',
+            ['user', 'host', 'hosts', 'identity', 'replace', 'store', 'src',
+             'dst', 'include', 'exclude'])
+        with tempfile.TemporaryDirectory() as temp_dir:
+            src = os.path.join(temp_dir, 'src')
+            os.makedirs(os.path.join(src, 'sub'))
+            open(os.path.join(src, 'sub', 'a'), 'w').close()
+            hosts = ['h0', 'h1', 'h2', 'h3']
+            for run, (include, exclude) in enumerate(((None, None),
+                                                      (None, ['x']))):
+                homes = {
+                    host: os.path.join(temp_dir, str(run), host)
+                    for host in hosts
+                }
+                for home in homes.values():
+                    # An earlier upload left dst as a directory
+                    os.makedirs(os.path.join(home, 'dst', 'old'))
+                ctx = context_on_hosts(homes)
+                phase3.handle_upload(
+                    cls('me', 'h0', None, None, False, None, src, 'dst',
+                        include, exclude), ctx)
+                phase3.handle_upload(
+                    cls('me', None, hosts[1:], None, False, None, src, 'dst',
+                        include, exclude), ctx)
+                layouts = [
+                    sorted(
+                        os.path.relpath(os.path.join(path, name), home)
+                        for path, dirs, files in os.walk(home)
+                        for name in dirs + files) for home in homes.values()
+                ]
+                self.assertEqual(layouts[0], [
+                    'dst', 'dst/old', 'dst/src', 'dst/src/sub', 'dst/src/sub/a'
+                ])
+                for layout in layouts[1:]:
+                    self.assertEqual(layout, layouts[0])
+
+    def test_handle_upload_filtered(self):
+        cls = attr.make_class(
+            'Mock',
+            ['user', 'host', 'hosts', 'identity', 'replace', 'store', 'src',
+             'dst', 'include', 'exclude'])
+        with tempfile.TemporaryDirectory() as temp_dir:
+            obj = cls(
+                user='me',
+                host='h',
+                hosts=None,
+                identity=None,
+                replace=False,
+                store=None,
+                src=temp_dir,
+                dst='my dst',
+                include=None,
+                exclude=['*.o'])
+            ctx = context_command_recorder()
+            phase3.handle_upload(obj, ctx)
+        name = shlex.quote(os.path.basename(temp_dir))
+        self.assertEqual(ctx.commands, [
+            ('ssh', 'me@h', "if [ -d 'my dst' ]; then dir='my dst'/{}; "
+             "else dir='my dst'; fi && "
+             'mkdir -p "$dir" && tar -C "$dir" -xf -'.format(name))
+        ])
+
     def test_run(self):
         cls = attr.make_class('MockSet', ['a'])
         recipe = cls(types.Value('b'))
@@ -285,6 +539,22 @@ class TestDocker(unittest.TestCase):
             [('sudo', 'docker', 'run', '--init', '--volume',
               '/host:/container:z', 'myImage', 'sh', '-c', 'x && y')])
 
+    @mock.patch('subprocess.call')
+    def test_handle_docker_run_timeout(self, call):
+        cls = attr.make_class('Mock', ['init', 'volumes', 'image', 'commands'])
+        obj = cls(init=False, volumes=[], image='myImage', commands=['x'])
+        ctx = context_command_recorder()
+        ctx.deadline = 0
+        ctx.run_cmd = mock.Mock(
+            side_effect=subprocess.TimeoutExpired('docker', 0))
+        with self.assertRaises(subprocess.TimeoutExpired):
+            phase3.handle_docker_run(obj, ctx)
+        cmd = ctx.run_cmd.call_args[0]
+        name = cmd[cmd.index('--name') + 1]
+        call.assert_called_once_with(
+            ['sudo', 'docker', 'rm', '--force', name],
+            stdout=subprocess.DEVNULL)
+
     @mock.patch('trask.phase3.create_dockerfile')
     def test_handle_docker_build(self, mock_dock):
         mock_dock.return_value = 'mockContents'
@@ -311,24 +581,293 @@ class TestDocker(unittest.TestCase):
         self.assertEqual(cmd[0:4], ('sudo', 'docker', 'build', '--file'))
 
 
+def write_stub(directory, name, script):
+    path = os.path.join(directory, name)
+    with open(path, 'w') as wfile:
+        wfile.write('#!/bin/sh\n' + script)
+    os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+
+
+class TestDockerShip(unittest.TestCase):
+    def setUp(self):
+        self.cls = attr.make_class(
+            'Mock', ['image', 'identity', 'user', 'hosts', 'sudo'])
+
+    def test_handle_docker_ship(self):
+        obj = self.cls(
+            image='img',
+            identity=None,
+            user='me',
+            hosts=['host1', 'host2'],
+            sudo=False)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            image_tar = os.path.join(temp_dir, 'image.tar')
+            helpers.write_image(image_tar, [('a', 'a/layer.tar'),
+                                            ('b', 'b/layer.tar')])
+            write_stub(temp_dir, 'docker', 'cat {}\n'.format(image_tar))
+            # host1 already has layer 'a', host2 has nothing. docker
+            # load records what its stdin is.
+            write_stub(
+                temp_dir, 'ssh', 'case "$2" in\n'
+                '  *"image ls"*) if [ "$1" = me@host1 ]; then echo a; fi ;;\n'
+                '  *) readlink /proc/$$/fd/0 > {0}/"$1".stdin\n'
+                '     cat > {0}/"$1".out ;;\n'
+                'esac\n'.format(temp_dir))
+            path = temp_dir + os.pathsep + os.environ['PATH']
+            with mock.patch.dict(os.environ, {'PATH': path}):
+                phase3.handle_docker_ship(obj, phase3.Context(dry_run=False))
+
+            layers = {}
+            for host in obj.hosts:
+                out = os.path.join(temp_dir, 'me@{}.out'.format(host))
+                with tarfile.open(out) as tar:
+                    layers[host] = [
+                        name for name in tar.getnames() if 'layer' in name
+                    ]
+            self.assertEqual(layers, {
+                'host1': ['b/layer.tar'],
+                'host2': ['a/layer.tar', 'b/layer.tar']
+            })
+            # The image is streamed to each host, not written per host
+            for host in obj.hosts:
+                stdin = os.path.join(temp_dir, 'me@{}.stdin'.format(host))
+                with open(stdin) as rfile:
+                    self.assertTrue(rfile.read().startswith('pipe:'))
+
+    def test_handle_docker_ship_dry(self):
+        obj = self.cls(
+            image='img', identity='/myId', user='me', hosts=['h'], sudo=True)
+        ctx = context_command_recorder()
+        phase3.handle_docker_ship(obj, ctx)
+        self.assertEqual(ctx.commands[0], ('sudo', 'docker', 'save', 'img'))
+        self.assertEqual(ctx.commands[1][:4], ('ssh', '-i', '/myId', 'me@h'))
+        self.assertEqual(ctx.commands[2], ('ssh', '-i', '/myId', 'me@h',
+                                           'sudo', 'docker', 'load'))
+
+    def test_handle_docker_ship_no_sudo(self):
+        obj = self.cls(
+            image='img', identity=None, user='me', hosts=['h'], sudo=None)
+        ctx = context_command_recorder()
+        phase3.handle_docker_ship(obj, ctx)
+        self.assertEqual(ctx.commands[0], ('docker', 'save', 'img'))
+        self.assertEqual(ctx.commands[2], ('ssh', 'me@h', 'docker', 'load'))
+
+
+class TestUploadStore(unittest.TestCase):
+    def setUp(self):
+        self.cls = attr.make_class(
+            'Mock',
+            ['user', 'host', 'hosts', 'identity', 'replace', 'store', 'src',
+             'dst', 'include', 'exclude'])
+
+    def test_upload_to_store(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            src = os.path.join(temp_dir, 'src')
+            os.makedirs(os.path.join(src, 'sub'))
+            for name in ('a', 'sub/b'):
+                with open(os.path.join(src, name), 'w') as wfile:
+                    wfile.write(name)
+            # Run "remote" commands locally, logging each one
+            log = os.path.join(temp_dir, 'log')
+            write_stub(temp_dir, 'ssh',
+                       'shift\necho "$*" >> {}\nexec sh -c "$*"\n'.format(log))
+            # A real directory at dst is replaced
+            dst = os.path.join(temp_dir, 'app')
+            os.makedirs(os.path.join(dst, 'old'))
+            obj = self.cls(
+                user='me',
+                host='myHost',
+                hosts=None,
+                identity=None,
+                replace=None,
+                store=os.path.join(temp_dir, 'store'),
+                src=src,
+                dst=dst,
+                include=None,
+                exclude=None)
+            path = temp_dir + os.pathsep + os.environ['PATH']
+            with mock.patch.dict(os.environ, {
+                    'PATH': path,
+                    'XDG_CACHE_HOME': temp_dir
+            }):
+                phase3.handle_upload(obj, phase3.Context(dry_run=False))
+                release1 = os.readlink(dst)
+                with open(os.path.join(dst, 'sub/b')) as rfile:
+                    self.assertEqual(rfile.read(), 'sub/b')
+                self.assertEqual(sorted(os.listdir(temp_dir)),
+                                 ['app', 'log', 'src', 'ssh', 'store'])
+
+                # Unchanged upload sends no blobs
+                phase3.handle_upload(obj, phase3.Context(dry_run=False))
+                self.assertEqual(os.readlink(dst), release1)
+
+                # Changing one file sends only that blob, and the old
+                # release and blob are collected
+                with open(os.path.join(src, 'a'), 'w') as wfile:
+                    wfile.write('new')
+                with mock.patch.object(store, 'GC_GRACE_MINUTES', 0):
+                    phase3.handle_upload(obj,
+                                         phase3.Context(dry_run=False))
+                self.assertNotEqual(os.readlink(dst), release1)
+                with open(os.path.join(dst, 'a')) as rfile:
+                    self.assertEqual(rfile.read(), 'new')
+
+            with open(log) as rfile:
+                uploads = [line for line in rfile if line.startswith('tar')]
+            self.assertEqual(len(uploads), 2)
+            self.assertEqual(
+                len(os.listdir(os.path.join(temp_dir, 'store/blobs'))), 2)
+            self.assertEqual(
+                os.listdir(os.path.join(temp_dir, 'store/releases')),
+                [os.path.basename(os.readlink(dst))])
+
+
+class TestTimeout(unittest.TestCase):
+    def test_run_process(self):
+        self.assertEqual(
+            phase3.run_process(['echo', 'a'], 5, stdout=subprocess.PIPE),
+            b'a\n')
+        with self.assertRaises(subprocess.CalledProcessError):
+            phase3.run_process(['false'], 5)
+        start = time.monotonic()
+        with self.assertRaises(subprocess.TimeoutExpired):
+            phase3.run_process(['sh', '-c', 'sleep 10 & sleep 10'], 0.1)
+        self.assertLess(time.monotonic() - start, 5)
+
+    def test_step_timeout(self):
+        def handler(_, ctx):
+            ctx.run_cmd('sleep', '10')
+
+        ctx = phase3.Context(dry_run=False, timeout=0.1)
+        step = types.Step('sleep', attr.make_class('Mock', [])(), '/')
+        with mock.patch.dict(phase3.HANDLERS, sleep=handler):
+            with self.assertRaises(phase3.StepTimeout) as cm:
+                phase3.run_step(step, ctx)
+            self.assertEqual(
+                str(cm.exception), 'sleep step timed out after 0.1 seconds')
+            self.assertIsNone(ctx.deadline)
+
+            step.label = 'nap'
+            step.timeout = 0.2
+            with self.assertRaises(phase3.StepTimeout) as cm:
+                phase3.run_step(step, ctx)
+            self.assertEqual(
+                str(cm.exception),
+                'sleep (nap) step timed out after 0.2 seconds')
+
+
 class TestTempDir(fake_filesystem_unittest.TestCase):
     def setUp(self):
         self.setUpPyfakefs()
+        self.fs.add_real_file(phase2.SCHEMA_PATH)
+
+    def load(self, text):
+        self.fs.create_file('/a.trask', contents=text)
+        return phase2.Phase2.load(phase2.get_schema(), phase1.load('/a.trask'))
 
     def test_handle_create_temp_dir(self):
-        cls = attr.make_class('Mock', ['var'])
-        obj = cls('myVar')
+        cls = attr.make_class('Mock', ['var', 'dir', 'size'])
         ctx = phase3.Context()
-        phase3.handle_create_temp_dir(obj, ctx)
+        phase3.handle_create_temp_dir(cls('myVar', None, None), ctx)
         path = ctx.variables['myVar']
         self.assertTrue(os.path.exists(path))
-        self.assertEqual(ctx.temp_dirs[0].name, path)
+        self.assertEqual(ctx.temp_dirs, [path])
+
+        self.fs.create_dir('/dev/shm')
+        phase3.handle_create_temp_dir(cls('shm', '/dev/shm', '1K'), ctx)
+        path = ctx.variables['shm']
+        self.assertEqual(os.path.dirname(path), '/dev/shm')
+        self.assertEqual(ctx.temp_dir_limits, {path: 1024})
+
+        self.fs.set_disk_usage(4096)
+        with self.assertRaises(phase3.TempDirFull):
+            phase3.handle_create_temp_dir(cls('big', None, '1M'), ctx)
+
+    def test_temp_dir_log(self):
+        cls = attr.make_class('Mock', ['var', 'dir', 'size'])
+        ctx = phase3.Context()
+        ctx.log = mock.Mock()
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            phase3.handle_create_temp_dir(cls('a', None, None), ctx)
+            phase3.remove_temp_dir(ctx.variables['a'], ctx)
+        self.assertEqual(out.getvalue(), '')
+        self.assertEqual(ctx.log.message.call_args_list, [
+            mock.call('$ mkdir ' + ctx.variables['a']),
+            mock.call('$ rm -r {} (0.0 B)'.format(ctx.variables['a'])),
+        ])
+
+    def test_remove_temp_dir_once(self):
+        cls = attr.make_class('Mock', ['var', 'dir', 'size'])
+        session = phase3.Session()
+        ctx = phase3.Context(session=session)
+        ctx.log = mock.Mock()
+        phase3.handle_create_temp_dir(cls('a', None, '1K'), ctx)
+        path = ctx.variables['a']
+        self.assertEqual(session.temp_dir_limits, {path: 1024})
+        phase3.remove_temp_dir(path, ctx)
+        phase3.remove_temp_dir(path, ctx)
+        self.assertEqual(session.temp_dirs, [])
+        self.assertEqual(session.temp_dir_limits, {})
+        self.assertEqual(list(session.temp_dir_sizes), [path])
+        self.assertEqual(ctx.log.message.call_count, 2)
+        self.assertFalse(session.lock.locked())
+
+    def test_cleanup(self):
+        steps = self.load("""
+                create-temp-dir { var 'a' size '1K' }
+                create-temp-dir { var 'b' }
+                copy { src ['/src'] dst a }
+                copy { src ['/src'] dst b }
+                ssh { user 'me' host 'h' commands ['true'] }
+                export { vars ['b'] }
+            """)
+        self.fs.create_file('/src', contents='x' * 512)
+        session = phase3.Session(dry_run=False)
+        ctx = phase3.Context(dry_run=False, session=session)
+        cleanup = phase3.TempDirCleanup(steps)
+        self.assertEqual(cleanup.last_uses, {id(steps[2]): {'a'}})
+        with mock.patch('builtins.print'):
+            for step in steps[:3]:
+                phase3.run_step(step, ctx)
+                cleanup.step_done(step, ctx)
+            self.assertFalse(os.path.exists(ctx.variables['a']))
+            self.assertEqual(ctx.temp_dirs, [ctx.variables['b']])
+            self.assertEqual(session.temp_dir_sizes,
+                             {ctx.variables['a']: 512})
+
+            phase3.run_step(steps[3], ctx)
+            self.fs.create_file(
+                os.path.join(ctx.variables['b'], 'big'), contents='x' * 2048)
+            cleanup.step_done(steps[3], ctx)
+            self.assertTrue(os.path.exists(ctx.variables['b']))
+            session.close()
+        self.assertEqual(
+            session.temp_dir_summary(),
+            '2 temporary directories used 3.0 KiB, the largest 2.5 KiB')
+
+    def test_size_limit(self):
+        steps = self.load("""
+                create-temp-dir { var 'a' size '1K' }
+                copy { src ['/src'] dst a }
+                copy { src ['/src'] dst a }
+            """)
+        self.fs.create_file('/src', contents='x' * 2048)
+        with mock.patch('builtins.print'):
+            with self.assertRaises(phase3.TempDirFull):
+                phase3.run(steps, phase3.Context(dry_run=False))
 
 
 class TestCopy(fake_filesystem_unittest.TestCase):
     def setUp(self):
         self.setUpPyfakefs()
-        self.cls = attr.make_class('Mock', ['src', 'dst'])
+        self.cls = attr.make_class(
+            'Mock', {
+                'src': attr.ib(),
+                'dst': attr.ib(),
+                'include': attr.ib(default=None),
+                'exclude': attr.ib(default=None)
+            })
 
     def test_copy_file(self):
         self.fs.create_file('/srcFile')
@@ -369,3 +908,165 @@ class TestCopy(fake_filesystem_unittest.TestCase):
         phase3.handle_copy(obj, ctx)
 
         self.assertFalse(os.path.exists('/dstDir/srcDir/'))
+
+    def test_copy_dir_unchanged(self):
+        self.fs.create_file('/srcDir/a', contents='a')
+        self.fs.create_file('/srcDir/sub/b', contents='b')
+        self.fs.create_file('/dstDir/srcDir/a', contents='a')
+
+        obj = self.cls(['/srcDir'], '/dstDir')
+        ctx = phase3.Context(dry_run=False)
+        with mock.patch('shutil.copy2') as copy2:
+            phase3.handle_copy(obj, ctx)
+        copy2.assert_called_once_with('/srcDir/sub/b', '/dstDir/srcDir/sub/b')
+        # The index is saved once at the end of the run, not per step
+        self.assertFalse(os.path.exists(ctx.hash_index.path))
+        ctx.hash_index.save()
+        self.assertTrue(os.path.exists(ctx.hash_index.path))
+
+    def test_session_prunes_temp_dirs(self):
+        self.fs.create_file('/srcDir/a', contents='a')
+        session = phase3.Session(dry_run=False)
+        ctx = phase3.Context(dry_run=False, session=session)
+        phase3.handle_create_temp_dir(
+            attr.make_class('Mock', ['var', 'dir', 'size'])('tmp', None,
+                                                            None), ctx)
+        temp_dir = ctx.variables['tmp']
+        phase3.handle_copy(self.cls(['/srcDir'], temp_dir), ctx)
+        phase3.handle_copy(self.cls(['/srcDir'], temp_dir), ctx)
+        self.assertIn(os.path.join(temp_dir, 'srcDir/a'),
+                      session.hash_index.entries)
+        session.close()
+        self.assertEqual(sorted(session.hash_index.entries), ['/srcDir/a'])
+
+    def test_copy_dir_filtered(self):
+        self.fs.create_file('/srcDir/keep.txt')
+        self.fs.create_file('/srcDir/skip.o')
+        self.fs.create_file('/srcDir/build/keep.txt')
+
+        obj = self.cls(['/srcDir'], '/dstDir', include=['*.txt'],
+                       exclude=['build'])
+        ctx = phase3.Context(dry_run=False)
+        phase3.handle_copy(obj, ctx)
+        self.assertEqual(os.listdir('/dstDir/srcDir'), ['keep.txt'])
+
+
+class TestBatchSsh(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.temp_dir = temp_dir.name
+        self.ctx = phase3.Context(dry_run=False)
+        self.scripts = []
+
+        def ssh_cmd(_ctx, _identity, _target, command):
+            # Run the remote command locally instead of over ssh
+            if 'trask_go' in command:
+                self.scripts.append(command)
+            return ['sh', '-c', command]
+
+        patcher = mock.patch.object(phase3, 'ssh_cmd', ssh_cmd)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def load(text):
+        return phase2.Phase2.load(phase2.get_schema(), phase1.parse_text(text))
+
+    def run_steps(self, steps):
+        """Run |steps|, returning what they and their commands print.
+
+        Commands that aren't batched write straight to file descriptor
+        1, so that is redirected to a file along with sys.stdout.
+        """
+        with tempfile.TemporaryFile() as out:
+            saved = os.dup(1)
+            os.dup2(out.fileno(), 1)
+            try:
+                with open(1, 'w', buffering=1, closefd=False) as stdout, \
+                        contextlib.redirect_stdout(stdout):
+                    phase3.run(steps, self.ctx)
+            finally:
+                os.dup2(saved, 1)
+                os.close(saved)
+            out.seek(0)
+            return out.read().decode()
+
+    def test_ssh_script(self):
+        script = phase3.ssh_script('M', [['echo a', 'echo b'], ['echo c']])
+        # status is read-only in zsh
+        self.assertNotRegex(script, r'(^|\W)status=')
+        # Only the steps that were started run
+        proc = subprocess.run(['sh', '-c', script],
+                              input=b'\n',
+                              stdout=subprocess.PIPE)
+        self.assertEqual(proc.returncode, 0)
+        self.assertEqual(proc.stdout, b'M start 0\na\nb\n\nM end 0 0\n')
+
+    def test_batch(self):
+        output = self.run_steps(
+            self.load("""
+                ssh { user 'me' host 'h1' commands ['cd /' 'echo one'] }
+                ssh { user 'me' host 'h1' commands ['printf two'] }
+                ssh { user 'me' host 'h2' commands ['echo three'] }
+            """))
+        # The third step has another host, so it runs on its own, with
+        # its output going straight to stdout
+        self.assertEqual(len(self.scripts), 1)
+        self.assertEqual(
+            output, 'sh -c cd / && echo one\none\n'
+            'sh -c printf two\ntwo'
+            'sh -c echo three\nthree\n')
+        self.assertEqual(self.ctx.ssh_batches, {})
+
+    def test_batch_timing(self):
+        durations = []
+        self.ctx.hooks.on(events.STEP_END,
+                          lambda seconds, **_: durations.append(seconds))
+        self.run_steps(
+            self.load("""
+                ssh { user 'me' host 'h1' commands ['true'] }
+                ssh { user 'me' host 'h1' commands ['sleep 0.3'] }
+            """))
+        self.assertLess(durations[0], 0.3)
+        self.assertGreaterEqual(durations[1], 0.3)
+
+    def test_batch_failure(self):
+        path = os.path.join(self.temp_dir, 'ran')
+        steps = self.load("""
+            ssh { user 'me' host 'h1' commands ['echo one'] }
+            ssh { user 'me' host 'h1' commands ['echo two >&2' 'false'] }
+            ssh { user 'me' host 'h1' commands ['touch %s'] }
+        """ % path)
+        out = io.StringIO()
+        with self.assertRaises(subprocess.CalledProcessError) as cm:
+            with contextlib.redirect_stdout(out):
+                phase3.run(steps, self.ctx)
+        self.assertEqual(cm.exception.returncode, 1)
+        self.assertIn('false\ntwo\n', out.getvalue())
+        self.assertFalse(os.path.exists(path))
+
+    def test_session_lost(self):
+        """Check that a step the session started isn't run again."""
+        path = os.path.join(self.temp_dir, 'runs')
+        steps = self.load("""
+            ssh { user 'me' host 'h1' commands ['echo >> %s' 'kill -9 $$'] }
+            ssh { user 'me' host 'h1' commands ['true'] }
+        """ % path)
+        with self.assertRaises(subprocess.CalledProcessError):
+            self.run_steps(steps)
+        with open(path) as rfile:
+            self.assertEqual(rfile.read(), '\n')
+
+    def test_session_not_reached(self):
+        batch = phase3.SshBatch(['true'], 'M', 2)
+        self.assertFalse(batch.start_step(0, self.ctx))
+        self.assertFalse(batch.start_step(1, self.ctx))
+
+    def test_no_batch(self):
+        steps = self.load("""
+            ssh { user 'me' host 'h1' commands ['true'] }
+            ssh { user 'me' host 'h1' commands ['true'] timeout '60' }
+        """)
+        self.run_steps(steps)
+        self.assertEqual(self.scripts, [])
@@ -0,0 +1,70 @@
+# pylint: disable=missing-docstring
+
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import trask
+from trask import phase2, plan, types
+
+SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
+SAMPLE1 = os.path.join(SCRIPT_DIR, 'sample1.trask')
+
+
+class TestPlan(unittest.TestCase):
+    def test_round_trip(self):
+        steps = trask.load(SAMPLE1)
+        self.assertEqual(plan.loads(plan.dumps(steps)), steps)
+
+    def test_var_and_call(self):
+        schema = phase2.get_model().parse('foo { a: path; b: string; }')
+        steps = phase2.Phase2.load(
+            schema, [
+                types.Step('foo', {
+                    'a': types.Var('x'),
+                    'b': types.Call('env', ['KEY']),
+                    'label': 'myLabel',
+                    'worker': 'docker'
+                }, '/dir')
+            ], {'x': types.Kind.Path},
+            fold=False)
+        result = plan.loads(plan.dumps(steps))
+        self.assertEqual(result, steps)
+        self.assertEqual(result[0].label, 'myLabel')
+        self.assertEqual(result[0].worker, 'docker')
+        self.assertEqual(result[0].recipe.a,
+                         types.Value(types.Var('x'), is_path=True))
+
+    def test_exports(self):
+        steps = phase2.Phase2.load(
+            phase2.get_schema(),
+            [types.Step('export', {'vars': ['x']}, '/dir')],
+            {'x': types.Kind.Path})
+        variables = {}
+        plan.loads(plan.dumps(steps, {'x': types.Kind.Path}), variables)
+        self.assertEqual(variables, {'x': types.Kind.Path})
+
+    def test_stale(self):
+        data = plan.dumps([])
+        with mock.patch('trask.plan.schema_hash', return_value=b'0' * 32):
+            with self.assertRaises(plan.StalePlan):
+                plan.loads(data)
+
+    def test_not_a_plan(self):
+        with self.assertRaises(plan.PlanError):
+            plan.loads(b'set {}')
+
+    def test_run_without_parser(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'sample1.plan')
+            trask.compile_plan(SAMPLE1, path)
+            self.assertTrue(plan.is_plan(path))
+            self.assertFalse(plan.is_plan(SAMPLE1))
+            code = ('import sys, trask; trask.run({!r}, dry_run=True); '
+                    'print("tatsu" in sys.modules)').format(path)
+            output = subprocess.check_output([sys.executable, '-c', code],
+                                             cwd=os.path.dirname(SCRIPT_DIR))
+        self.assertTrue(output.decode().endswith('False\n'))
@@ -0,0 +1,42 @@
+# pylint: disable=missing-docstring
+
+import io
+import os
+import pstats
+import tempfile
+import unittest
+
+import trask
+from trask import profiling
+
+SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
+
+
+class TestProfiler(unittest.TestCase):
+    def test_run_files(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            profiler = profiling.Profiler(temp_dir, top=3)
+            trask.run_files([os.path.join(SCRIPT_DIR, 'sample1.trask')],
+                            dry_run=True,
+                            profiler=profiler)
+            out = io.StringIO()
+            profiler.write(out)
+
+            for phase in ('phase1', 'phase2', 'phase3'):
+                self.assertIn(phase + ': ', out.getvalue())
+                stats = pstats.Stats(
+                    os.path.join(temp_dir, phase + '.pstats'))
+                self.assertGreater(stats.total_calls, 0)
+                with open(os.path.join(temp_dir,
+                                       phase + '-alloc.txt')) as rfile:
+                    lines = rfile.read().splitlines()
+                self.assertTrue(lines[0].startswith('peak: '))
+                self.assertLessEqual(len(lines), 6)
+
+    def test_phase_accumulates(self):
+        profiler = profiling.Profiler(None)
+        for _ in range(2):
+            with profiler.phase('a'):
+                pass
+        self.assertEqual(list(profiler.profiles), ['a'])
+        self.assertGreater(profiler.seconds['a'], 0)
@@ -0,0 +1,132 @@
+# pylint: disable=missing-docstring
+
+import contextlib
+import io
+import os
+import socket
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from trask import phase1, phase2, phase3, remote
+
+TEXT = """
+ssh { user 'me' host 'h1' commands ['true'] worker 'deploy' }
+copy { src ['missing'] dst 'out' worker 'build' }
+ssh { user 'me' host 'h2' commands ['true'] }
+"""
+
+
+class TestRemote(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.temp_dir = temp_dir.name
+        self.path = os.path.join(self.temp_dir, 'a.trask')
+        with open(self.path, 'w') as wfile:
+            wfile.write(TEXT)
+        self.coordinator = remote.Coordinator(
+            'unix:' + os.path.join(self.temp_dir, 'sock'), 'secret', wait=0.5)
+        self.addCleanup(self.coordinator.close)
+
+    def load(self):
+        # Steps are modified when they run, so load them for each run
+        return phase2.Phase2.load(phase2.get_schema(), phase1.load(self.path))
+
+    def start_worker(self, name, capabilities):
+        worker = remote.Worker(self.coordinator.address, 'secret',
+                               capabilities, name)
+        threading.Thread(
+            target=worker.serve, args=(worker.connect(), ),
+            daemon=True).start()
+
+    def run_steps(self, steps, dry_run):
+        session = phase3.Session(dry_run, coordinator=self.coordinator)
+        ctx = phase3.Context(dry_run, session)
+        out = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(out):
+                for step in steps:
+                    phase3.run_step(step, ctx)
+        finally:
+            session.close()
+        return out.getvalue()
+
+    def test_parse_address(self):
+        self.assertEqual(
+            remote.parse_address('unix:/run/trask.sock'),
+            (socket.AF_UNIX, '/run/trask.sock'))
+        self.assertEqual(
+            remote.parse_address('ci:7000'), (socket.AF_INET, ('ci', 7000)))
+        self.assertEqual(
+            remote.parse_address(':7000'),
+            (socket.AF_INET, ('localhost', 7000)))
+        self.assertEqual(
+            remote.parse_address(':7000', default_host=''),
+            (socket.AF_INET, ('', 7000)))
+        with self.assertRaises(ValueError):
+            remote.parse_address('ci')
+
+    def test_coordinator_all_interfaces(self):
+        coordinator = remote.Coordinator(':0', 'secret')
+        self.addCleanup(coordinator.close)
+        self.assertEqual(coordinator.server.getsockname()[0], '0.0.0.0')
+
+    def test_encode(self):
+        steps = self.load()
+        ctx = phase3.Context()
+        ctx.step = steps[1]
+        recipe = phase3.resolve_step(steps[1], ctx).recipe
+        self.assertEqual(remote.decode(remote.encode(recipe)), recipe)
+
+    def test_local_only(self):
+        with self.assertRaises(phase2.InvalidKey):
+            phase2.Phase2.load(
+                phase2.get_schema(),
+                phase1.parse_text("create-temp-dir { worker 'a' var 'x' }"))
+
+    def test_run(self):
+        self.start_worker('deployer', ['deploy'])
+        self.start_worker('builder', ['build', 'docker'])
+        output = self.run_steps(self.load(), dry_run=True)
+        self.assertIn('me@h1 true', output)
+        self.assertIn('me@h2 true', output)
+
+        with self.assertRaises(remote.RemoteStepError) as cm:
+            self.run_steps(self.load()[1:2], dry_run=False)
+        self.assertIn('copy step failed on builder: FileNotFoundError',
+                      str(cm.exception))
+
+    def test_worker_token(self):
+        worker = remote.Worker(self.coordinator.address, 'wrong', ['deploy'])
+        with self.assertRaises(remote.AuthenticationError):
+            worker.serve(worker.connect())
+        with self.assertRaises(remote.NoWorker):
+            self.run_steps(self.load()[:1], dry_run=True)
+
+    def test_coordinator_token(self):
+        """Check that a worker ignores a coordinator without the token."""
+        ours, theirs = socket.socketpair()
+        fake = remote.Connection(theirs)
+        fake.send(type='challenge', nonce='n')
+        fake.send(type='welcome', proof='forged')
+        fake.send(type='run', id=1)
+        worker = remote.Worker('unix:/unused', 'secret')
+        with mock.patch.object(worker, 'run_step') as run_step:
+            with self.assertRaises(remote.AuthenticationError):
+                worker.serve(remote.Connection(ours))
+        run_step.assert_not_called()
+        fake.close()
+
+    def test_get_token(self):
+        with mock.patch.dict(os.environ, {remote.TOKEN_ENV: 'secret'}):
+            self.assertEqual(remote.get_token(), 'secret')
+        with mock.patch.dict(os.environ, {remote.TOKEN_ENV: ''}):
+            with self.assertRaises(remote.AuthenticationError):
+                remote.get_token()
+
+    def test_no_worker(self):
+        self.start_worker('deployer', ['deploy'])
+        with self.assertRaises(remote.NoWorker):
+            self.run_steps(self.load()[1:2], dry_run=True)
@@ -0,0 +1,97 @@
+# pylint: disable=missing-docstring
+
+import os
+import threading
+import time
+import unittest
+from unittest import mock
+
+from pyfakefs import fake_filesystem_unittest
+
+from trask import scheduler
+
+
+class TestLimits(fake_filesystem_unittest.TestCase):
+    def setUp(self):
+        self.setUpPyfakefs()
+
+    def test_parse_limit(self):
+        self.assertEqual(scheduler.parse_limit('cpu=4'), ('cpu', 4))
+        for text in ('cpu', 'cpu=', '=4', 'cpu=0', 'cpu=x'):
+            with self.assertRaises(ValueError):
+                scheduler.parse_limit(text)
+
+    @mock.patch.dict(os.environ, {'XDG_CONFIG_HOME': '/config'})
+    def test_load_limits(self):
+        self.assertEqual(scheduler.load_limits(), scheduler.DEFAULT_LIMITS)
+        self.fs.create_file(
+            '/config/trask/limits.json', contents='{"docker": 1, "gpu": 2}')
+        limits = scheduler.load_limits(overrides=[('gpu', 3)])
+        self.assertEqual(limits['docker'], 1)
+        self.assertEqual(limits['gpu'], 3)
+        self.assertEqual(limits['network'],
+                         scheduler.DEFAULT_LIMITS['network'])
+
+
+class TestRunTasks(unittest.TestCase):
+    def test_order(self):
+        order = []
+
+        def task(name, deps=(), cost=1):
+            return scheduler.Task(
+                name, lambda: order.append(name), list(deps), cost=cost)
+
+        first = task('first')
+        short = task('short', [first])
+        long_ = task('long', [first], cost=5)
+        last = task('last', [short, long_])
+        tasks = [first, short, long_, last]
+        self.assertEqual(
+            scheduler.priorities(tasks),
+            {first: 7, short: 2, long_: 6, last: 1})
+        scheduler.run_tasks(tasks, {}, max_workers=1)
+        self.assertEqual(order, ['first', 'long', 'short', 'last'])
+
+    def test_critical_path(self):
+        first = scheduler.Task('first', None, cost=1)
+        short = scheduler.Task('short', None, [first], cost=2)
+        long_ = scheduler.Task('long', None, [first], cost=5)
+        other = scheduler.Task('other', None, cost=4)
+        self.assertEqual(
+            scheduler.critical_path([first, short, long_, other]),
+            [first, long_])
+
+    def test_limits(self):
+        lock = threading.Lock()
+        running = {'docker': 0, 'host:a': 0}
+        peak = dict(running)
+
+        def use(names):
+            def func():
+                with lock:
+                    for name in names:
+                        running[name] += 1
+                        peak[name] = max(peak[name], running[name])
+                time.sleep(0.01)
+                with lock:
+                    for name in names:
+                        running[name] -= 1
+
+            return scheduler.Task('task', func, resources=lambda: names)
+
+        tasks = [use(['docker']) for _ in range(4)]
+        tasks += [use(['host:a']) for _ in range(4)]
+        scheduler.run_tasks(tasks, {'docker': 1, 'host': 2})
+        self.assertEqual(peak, {'docker': 1, 'host:a': 2})
+
+    def test_error(self):
+        ran = []
+
+        def fail():
+            raise ValueError('fail')
+
+        first = scheduler.Task('first', fail)
+        second = scheduler.Task('second', lambda: ran.append(1), [first])
+        with self.assertRaises(ValueError):
+            scheduler.run_tasks([first, second], {})
+        self.assertEqual(ran, [])
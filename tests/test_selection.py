@@ -0,0 +1,86 @@
+# pylint: disable=missing-docstring
+
+import unittest
+
+from trask import phase1, phase2, selection, types
+
+TEXT = """
+set { user 'me' host 'h' }
+create-temp-dir { var 'tmp' }
+docker-build { from 'amazonlinux:2' label 'build' }
+copy { src ['a'] dst tmp }
+ssh { user user host host commands ['true'] label 'deploy' }
+ssh { user 'root' host 'h' commands ['true'] }
+"""
+
+
+class TestSelect(unittest.TestCase):
+    def setUp(self):
+        self.steps = phase2.Phase2.load(phase2.get_schema(),
+                                        phase1.parse_text(TEXT))
+
+    def select(self, **kwargs):
+        return selection.select(self.steps, **kwargs)
+
+    def test_label(self):
+        self.assertEqual(self.steps[2].label, 'build')
+        self.assertNotIn('label', self.steps[2].recipe.__slots__)
+
+    def test_all(self):
+        self.assertEqual(self.select(), [0, 1, 2, 3, 4, 5])
+
+    def test_only(self):
+        self.assertEqual(self.select(only=['build']), [2])
+        self.assertEqual(self.select(only=['deploy']), [0, 4])
+        self.assertEqual(self.select(only=['4']), [1, 3])
+        self.assertEqual(self.select(only=['ssh']), [0, 4, 5])
+        self.assertEqual(self.select(only=['build', '6']), [2, 5])
+
+    def test_range(self):
+        self.assertEqual(self.select(from_='build'), [0, 1, 2, 3, 4, 5])
+        self.assertEqual(self.select(from_='build', until='4'), [1, 2, 3])
+        self.assertEqual(self.select(from_='5'), [0, 4, 5])
+        self.assertEqual(self.select(until='3'), [0, 1, 2])
+        self.assertEqual(self.select(from_='3', only=['ssh']), [0, 4, 5])
+
+    def test_no_match(self):
+        with self.assertRaises(selection.SelectionError):
+            self.select(only=['nothing'])
+        with self.assertRaises(selection.SelectionError):
+            self.select(from_='deploy', until='build')
+        with self.assertRaises(selection.SelectionError):
+            self.select(only=['build'], from_='deploy')
+
+
+class TestSelectFiles(unittest.TestCase):
+    def setUp(self):
+        first = phase2.Phase2.load(
+            phase2.get_schema(),
+            phase1.parse_text("set { user 'me' other 'x' } "
+                              "export { vars ['other'] } "
+                              "export { vars ['user'] }"))
+        variables = {'user': types.Kind.String, 'other': types.Kind.String}
+        second = phase2.Phase2.load(
+            phase2.get_schema(),
+            phase1.parse_text(
+                "docker-build { from 'amazonlinux:2' } "
+                "ssh { user user host 'h' commands ['true'] }"), variables)
+        self.files = [first, second]
+
+    def select(self, **kwargs):
+        return selection.select_files(self.files, **kwargs)
+
+    def test_only(self):
+        # The export and the step setting the variable are kept
+        self.assertEqual(self.select(only=['ssh']), [[0, 2], [1]])
+        self.assertEqual(self.select(only=['docker-build']), [[], [0]])
+        with self.assertRaises(selection.SelectionError):
+            self.select(only=['copy'])
+
+    def test_range(self):
+        self.assertEqual(self.select(from_='3'), [[0, 2], [0, 1]])
+        self.assertEqual(self.select(until='ssh'), [[0, 1, 2], [0, 1]])
+        self.assertEqual(self.select(from_='docker-build', until='2'),
+                         [[0, 2], [0, 1]])
+        with self.assertRaises(selection.SelectionError):
+            self.select(from_='4')
@@ -0,0 +1,44 @@
+# pylint: disable=missing-docstring
+
+import os
+import tarfile
+import tempfile
+import unittest
+
+from trask import ship
+from tests import helpers
+
+
+class TestShip(unittest.TestCase):
+    def test_parse_layers(self):
+        self.assertEqual(
+            ship.parse_layers('a,b\n\nc\n'), {('a', ), ('a', 'b'), ('c', )})
+
+    def test_list_layers_command(self):
+        self.assertIn('sudo docker image inspect',
+                      ship.list_layers_command(['sudo']))
+
+    def test_skippable_files(self):
+        manifest = [{'Config': 'c', 'Layers': ['x', 'y', 'z']}]
+        configs = {'c': {'rootfs': {'diff_ids': ['a', 'b', 'c']}}}
+        chains = ship.parse_layers('a,b\nb,c')
+        self.assertEqual(
+            ship.skippable_files(manifest, configs, chains), {'x', 'y'})
+        # A layer with the same diff ID on a different base cannot be
+        # skipped
+        chains = ship.parse_layers('b,c')
+        self.assertEqual(ship.skippable_files(manifest, configs, chains), set())
+
+    def test_filter_image(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            src = os.path.join(temp_dir, 'src.tar')
+            dst = os.path.join(temp_dir, 'dst.tar')
+            helpers.write_image(src, [('a', 'a/layer.tar'),
+                                      ('b', 'b/layer.tar')])
+            with open(dst, 'wb') as wfile:
+                self.assertEqual(
+                    ship.filter_image(src, wfile, {('a', )}), 1)
+            with tarfile.open(dst) as tar:
+                self.assertEqual(
+                    sorted(tar.getnames()),
+                    ['b/layer.tar', 'config.json', 'manifest.json'])
@@ -0,0 +1,62 @@
+# pylint: disable=missing-docstring
+
+import hashlib
+
+from pyfakefs import fake_filesystem_unittest
+
+from trask import store
+
+
+def sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class TestStore(fake_filesystem_unittest.TestCase):
+    def setUp(self):
+        self.setUpPyfakefs()
+
+    def test_build_manifest(self):
+        self.fs.create_file('/src/b/c', contents='c', st_mode=0o100755)
+        self.fs.create_file('/src/a', contents='a', st_mode=0o100644)
+        manifest = store.build_manifest('/src')
+        self.assertEqual(manifest, [
+            store.Entry('a', '/src/a', sha256(b'a'), 0o644),
+            store.Entry('b/c', '/src/b/c', sha256(b'c'), 0o755)
+        ])
+        self.assertEqual(manifest[1].blob, sha256(b'c') + '-755')
+
+    def test_build_manifest_file(self):
+        self.fs.create_file('/src/a', contents='a', st_mode=0o100644)
+        manifest = store.build_manifest('/src/a')
+        self.assertEqual([entry.path for entry in manifest], ['a'])
+
+    def test_release_id(self):
+        entry1 = store.Entry('a', '/a', 'x', 0o644)
+        entry2 = store.Entry('a', '/b', 'x', 0o644)
+        entry3 = store.Entry('a', '/a', 'y', 0o644)
+        self.assertEqual(
+            store.release_id([entry1]), store.release_id([entry2]))
+        self.assertNotEqual(
+            store.release_id([entry1]), store.release_id([entry3]))
+
+    def test_missing_entries(self):
+        entry1 = store.Entry('a', '/a', 'x', 0o644)
+        entry2 = store.Entry('b', '/b', 'x', 0o644)
+        entry3 = store.Entry('c', '/c', 'y', 0o644)
+        manifest = [entry1, entry2, entry3]
+        self.assertEqual(
+            store.missing_entries(manifest, ''), [entry1, entry3])
+        self.assertEqual(
+            store.missing_entries(manifest, 'x-644\n'), [entry3])
+
+    def test_assemble_script(self):
+        entry = store.Entry('dir/a b', '/a', 'x', 0o644)
+        script = store.assemble_script('/store', [entry], 'app')
+        self.assertIn("ln /store/blobs/x-644 \"$tmp\"/'dir/a b'", script)
+        self.assertIn('mv -T "$link" app', script)
+        self.assertIn(store.ref_path('/store', 'app'), script)
+
+    def test_gc_script(self):
+        script = store.gc_script('/my store')
+        self.assertIn("cd '/my store'", script)
+        self.assertIn('-links 1 -cmin +60', script)
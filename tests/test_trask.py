@@ -1,33 +1,265 @@
 # pylint: disable=missing-docstring
 
+import io
 import os
+import tempfile
 import unittest
+from unittest import mock
 
 from pyfakefs import fake_filesystem_unittest
 
 import trask
-from trask import functions
+from trask import (checkpoint, functions, hashindex, history, phase2, phase3,
+                   selection, types)
 
 
-class TestFunctions(unittest.TestCase):
+class TestFunctions(fake_filesystem_unittest.TestCase):
+    def setUp(self):
+        self.setUpPyfakefs()
+        self.fs.add_real_file(phase2.SCHEMA_PATH)
+        self.ctx = functions.StaticContext('/dir')
+
     def test_get_from_env(self):
         os.environ['MY_TEST_VAR'] = 'my-test-value'
         self.assertEqual(
-            functions.get_from_env(('MY_TEST_VAR', )), 'my-test-value')
+            functions.get_from_env(('MY_TEST_VAR', ), self.ctx),
+            'my-test-value')
+
+    def test_files(self):
+        self.fs.create_file('/dir/a.txt', contents='abc')
+        self.fs.create_file('/dir/sub/b.txt')
+        self.assertEqual(functions.read_file(['a.txt'], self.ctx), 'abc')
+        self.assertEqual(
+            functions.glob_paths(['**/*.txt'], self.ctx),
+            ['/dir/a.txt', '/dir/sub/b.txt'])
+        with mock.patch('trask.hashindex.hash_file',
+                        wraps=hashindex.hash_file) as hash_file:
+            index = hashindex.HashIndex()
+            self.ctx.get_hash_index = lambda: index
+            digest = functions.sha256_file(['a.txt'], self.ctx)
+            self.assertEqual(functions.sha256_file(['a.txt'], self.ctx),
+                             digest)
+            hash_file.assert_called_once_with('/dir/a.txt')
+        self.assertEqual(len(digest), 64)
+
+    @mock.patch.dict(os.environ, {'MY_TEST_VAR': 'x'})
+    def test_fold(self):
+        self.fs.create_file(
+            '/a.trask',
+            contents="set { a env('MY_TEST_VAR') b read('c') }")
+        steps = trask.load('/a.trask')
+        self.assertEqual(steps[0].recipe.a, types.Value('x'))
+        self.assertIsInstance(steps[0].recipe.b.data, types.Call)
+        steps = trask.load('/a.trask', fold=False)
+        self.assertIsInstance(steps[0].recipe.a.data, types.Call)
+
+    def test_memo(self):
+        ctx = phase3.Context()
+        call = types.Call('env', ['MY_TEST_VAR'])
+        with mock.patch.dict(os.environ, {'MY_TEST_VAR': 'x'}):
+            self.assertEqual(ctx.call(call), 'x')
+        with mock.patch.dict(os.environ, {'MY_TEST_VAR': 'y'}):
+            self.assertEqual(ctx.call(call), 'x')
+            self.assertEqual(phase3.Context().call(call), 'y')
 
 
 class TestInit(fake_filesystem_unittest.TestCase):
     def setUp(self):
         self.setUpPyfakefs()
+        self.fs.add_real_file(phase2.SCHEMA_PATH)
 
     def test_run(self):
         self.fs.create_file('/myFile.trask')
         trask.run('/myFile.trask', dry_run=True)
 
+    def test_convert(self):
+        self.fs.create_file('/a.trask', contents="include { file 'b' }")
+        trask.convert('/a.trask', '/a.trask.json')
+        trask.convert('/a.trask.json', '/c.trask')
+        with open('/c.trask') as rfile:
+            self.assertEqual(rfile.read(), "include {\n  file 'b'\n}\n")
+
     def test_parse_args(self):
         args = trask.parse_args(['/myFile.trask'])
         self.assertEqual(args.dry_run, False)
+        self.assertEqual(args.parallel, False)
+        self.assertEqual(args.paths, ['/myFile.trask'])
+        args = trask.parse_args(['run', '-p', '/a.trask', '/b.trask'])
+        self.assertEqual(args.parallel, True)
+        self.assertEqual(args.paths, ['/a.trask', '/b.trask'])
+        args = trask.parse_args(
+            ['--only', 'a', '--only', '3', '--from', 'b', '/a.trask'])
+        self.assertEqual(args.only, ['a', '3'])
+        self.assertEqual(args.from_, 'b')
+        self.assertEqual(args.until, None)
+        self.assertEqual(args.plugin, None)
+        args = trask.parse_args(['--plugin', 'a', '--plugin', 'b', '/a.trask'])
+        self.assertEqual(args.plugin, ['a', 'b'])
+        args = trask.parse_args(
+            ['-p', '--limit', 'docker=1', '--limit', 'host=2', '/a.trask'])
+        self.assertEqual(args.limit, [('docker', 1), ('host', 2)])
+        self.assertTrue(trask.parse_args(['-n', '--plan', '/a.trask']).plan)
+        with mock.patch('sys.stderr'), self.assertRaises(SystemExit):
+            trask.parse_args(['--plan', '/a.trask'])
+
+    def test_parse_args_worker(self):
+        args = trask.parse_args(
+            ['worker', '-c', 'docker', '-c', 'gpu', 'ci:7000'])
+        self.assertEqual(args.command, 'worker')
+        self.assertEqual(args.capability, ['docker', 'gpu'])
+        self.assertEqual(args.address, 'ci:7000')
+        args = trask.parse_args(
+            ['--coordinator', 'unix:/run/trask.sock', '/a.trask'])
+        self.assertEqual(args.coordinator, 'unix:/run/trask.sock')
+        with mock.patch('sys.stderr'), self.assertRaises(SystemExit):
+            trask.parse_args(['--coordinator', 'ci', '/a.trask'])
+
+    def test_parse_args_compile(self):
+        args = trask.parse_args(['compile', '-o', '/out', '/myFile.trask'])
+        self.assertEqual(args.command, 'compile')
+        self.assertEqual(args.output, '/out')
         self.assertEqual(args.path, '/myFile.trask')
+        args = trask.parse_args(['run', '-n', '/myFile.trask'])
+        self.assertEqual(args.command, 'run')
+        self.assertEqual(args.dry_run, True)
+
+
+class TestRunFiles(fake_filesystem_unittest.TestCase):
+    def setUp(self):
+        self.setUpPyfakefs()
+        self.fs.add_real_file(phase2.SCHEMA_PATH)
+        self.fs.create_file(
+            '/a.trask',
+            contents="set { x 'a' y 'b' } export { vars ['x'] }")
+        self.fs.create_file(
+            '/b.trask', contents="ssh { user x host 'h' commands ['true'] }")
+        self.fs.create_file(
+            '/c.trask', contents="ssh { user y host 'h' commands ['true'] }")
+        self.fs.create_file('/d.trask', contents="export { vars ['x'] }")
+
+    def test_exports(self):
+        trask.run_files(['/a.trask', '/b.trask'], dry_run=True)
+        trask.run_files(['/a.trask', '/b.trask'], dry_run=True, parallel=True)
+
+    @mock.patch.dict(os.environ, {'XDG_CACHE_HOME': '/cache'})
+    def test_timing(self):
+        timing = history.History()
+        trask.run_files(['/a.trask'], dry_run=True, timing=timing)
+        self.assertIsNone(timing.estimate('/a.trask:set:1'))
+        trask.run_files(['/a.trask'], dry_run=False, timing=timing)
+        self.assertIsNotNone(timing.estimate('/a.trask:set:1'))
+        self.assertIsNotNone(timing.estimate('/a.trask:export:1'))
+
+    def test_estimate(self):
+        timing = history.History()
+        timing.record('/a.trask:set:1', 1)
+        timing.record('/b.trask:ssh:1', 30)
+        timing.record('/e.trask:ssh:1', 60)
+        timing.save()
+        self.fs.create_file(
+            '/e.trask',
+            contents="ssh { user 'me' host 'h' commands ['true'] }")
+        out = io.StringIO()
+        trask.estimate(['/a.trask', '/b.trask', '/e.trask'], timing, out=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[0].split(), ['/a.trask', '1', 'set', '1.0s'])
+        self.assertEqual(lines[1].split(), ['/a.trask', '2', 'export', '?'])
+        self.assertEqual(lines[4:], [
+            'serial: 1m 31s', 'parallel: 1m 00s', 'critical path:',
+            '  /e.trask 1 ssh',
+            '1 steps have no history'
+        ])
+
+    def test_parallel_closes_ssh_batches(self):
+        with mock.patch('trask.phase3.close_ssh_batches') as close, \
+                mock.patch.dict(phase3.HANDLERS,
+                                ssh=mock.Mock(side_effect=OSError)):
+            with self.assertRaises(OSError):
+                trask.run_files(['/a.trask', '/b.trask'],
+                                dry_run=True,
+                                parallel=True)
+        self.assertEqual(close.call_count, 2)
+
+    def test_select_across_files(self):
+        trask.run_files(['/a.trask', '/b.trask'], dry_run=True, only=['ssh'])
+        files, numbers, _ = trask.load_files(['/a.trask', '/b.trask'],
+                                             only=['ssh'])
+        self.assertEqual(numbers, [[1, 2], [1]])
+        self.assertEqual(files[0][1], ['x'])
+        with self.assertRaises(selection.SelectionError):
+            trask.run_files(['/a.trask', '/b.trask'],
+                            dry_run=True,
+                            only=['copy'])
+
+    def test_plan_exports(self):
+        trask.compile_plan('/a.trask', '/a.plan')
+        trask.run_files(['/a.plan', '/b.trask'], dry_run=True)
+        with self.assertRaises(phase2.UnboundVariable):
+            trask.run_files(['/a.plan', '/c.trask'], dry_run=True)
+
+    def test_scoped(self):
+        with self.assertRaises(phase2.UnboundVariable):
+            trask.run_files(['/a.trask', '/c.trask'], dry_run=True)
+        with self.assertRaises(phase2.UnboundVariable):
+            trask.run_files(['/d.trask'], dry_run=True)
+
+    def test_file_dependencies(self):
+        steps = {
+            name: trask.load(
+                '/{}.trask'.format(name), variables={'x': types.Kind.String})
+            for name in 'abd'
+        }
+        files = [(steps['a'], ['x']), (steps['d'], ['x']), (steps['b'], [])]
+        self.assertEqual(trask.file_dependencies(files), [[], [0], [0, 1]])
+        self.assertEqual(
+            trask.file_dependencies(files[2:] + files[:1]), [[], []])
+
+
+class TestResume(fake_filesystem_unittest.TestCase):
+    def setUp(self):
+        self.setUpPyfakefs()
+        self.fs.add_real_file(phase2.SCHEMA_PATH)
+        self.fs.create_file(
+            '/a.trask',
+            contents="create-temp-dir { var 'tmp' } "
+            "copy { src ['b'] dst tmp }")
+
+    @mock.patch.dict(os.environ, {'XDG_CACHE_HOME': '/cache'})
+    def test_resume(self):
+        with self.assertRaises(FileNotFoundError):
+            trask.run('/a.trask', dry_run=False)
+        checkpoint_path = checkpoint.default_path('/a.trask')
+        self.assertTrue(os.path.exists(checkpoint_path))
+        temp_dir = checkpoint.Checkpoint.load(checkpoint_path).temp_dirs[0]
+        self.assertTrue(os.path.isdir(temp_dir))
+
+        self.fs.create_file('/b', contents='b')
+        with mock.patch('tempfile.mkdtemp') as mkdtemp:
+            trask.run('/a.trask', dry_run=False, resume=True)
+            mkdtemp.assert_not_called()
+        self.assertFalse(os.path.exists(checkpoint_path))
+        self.assertFalse(os.path.exists(temp_dir))
+
+    @mock.patch.dict(os.environ, {'XDG_CACHE_HOME': '/cache'})
+    def test_run_without_resume(self):
+        """Check that a new run deletes the directories of a failed one."""
+        with self.assertRaises(FileNotFoundError):
+            trask.run('/a.trask', dry_run=False)
+        checkpoint_path = checkpoint.default_path('/a.trask')
+        temp_dir = checkpoint.Checkpoint.load(checkpoint_path).temp_dirs[0]
+
+        with self.assertRaises(FileNotFoundError):
+            trask.run('/a.trask', dry_run=False)
+        self.assertFalse(os.path.exists(temp_dir))
+        self.assertNotEqual(
+            checkpoint.Checkpoint.load(checkpoint_path).temp_dirs,
+            [temp_dir])
+
+    def test_selection_failure(self):
+        """Check that a failed run without a checkpoint keeps nothing."""
+        with self.assertRaises(FileNotFoundError):
+            trask.run('/a.trask', dry_run=False, only=['1', '2'])
+        self.assertEqual(os.listdir(tempfile.gettempdir()), [])
 
 
 class TestDryRun(unittest.TestCase):
@@ -0,0 +1,95 @@
+# pylint: disable=missing-docstring
+
+import os
+import unittest
+from unittest import mock
+
+from pyfakefs import fake_filesystem_unittest
+
+from trask import walk
+
+
+class TestMatcher(unittest.TestCase):
+    def test_compile_pattern(self):
+        regex = walk.compile_pattern('a/*.txt')
+        self.assertTrue(regex.match('a/b.txt'))
+        self.assertFalse(regex.match('a/b/c.txt'))
+        self.assertFalse(regex.match('b/a/b.txt'))
+
+    def test_any_depth(self):
+        regex = walk.compile_pattern('*.o')
+        self.assertTrue(regex.match('x.o'))
+        self.assertTrue(regex.match('a/b/x.o'))
+        self.assertFalse(regex.match('x.oo'))
+
+    def test_double_star(self):
+        regex = walk.compile_pattern('a/**/b')
+        self.assertTrue(regex.match('a/b'))
+        self.assertTrue(regex.match('a/x/y/b'))
+        self.assertTrue(walk.compile_pattern('a/**').match('a/x/y'))
+
+    def test_char_class(self):
+        regex = walk.compile_pattern('[!a]?')
+        self.assertTrue(regex.match('bc'))
+        self.assertFalse(regex.match('ac'))
+
+    def test_matches(self):
+        matcher = walk.Matcher(['src/*'], ['*.pyc'])
+        self.assertTrue(matcher.matches('src/a.py'))
+        self.assertFalse(matcher.matches('src/a.pyc'))
+        self.assertFalse(matcher.matches('other/a.py'))
+        self.assertTrue(walk.Matcher().matches('anything'))
+
+    def test_should_descend(self):
+        matcher = walk.Matcher(['target/release/app'], ['.git'])
+        self.assertTrue(matcher.should_descend('target'))
+        self.assertTrue(matcher.should_descend('target/release'))
+        self.assertFalse(matcher.should_descend('target/debug'))
+        self.assertFalse(matcher.should_descend('target/release/other'))
+        self.assertFalse(matcher.should_descend('.git'))
+        self.assertFalse(walk.Matcher(exclude=['a/**']).should_descend('a'))
+
+    def test_include_dir(self):
+        for pattern in ('sub', 'sub/', 'a/sub'):
+            matcher = walk.Matcher([pattern])
+            self.assertTrue(matcher.should_descend('a'))
+            self.assertTrue(matcher.should_descend('a/sub'))
+            self.assertTrue(matcher.should_descend('a/sub/deep'))
+            self.assertTrue(matcher.matches('a/sub/deep/x'))
+            self.assertFalse(matcher.matches('a/subway/x'))
+
+
+class TestWalk(fake_filesystem_unittest.TestCase):
+    def setUp(self):
+        self.setUpPyfakefs()
+
+    def test_walk(self):
+        self.fs.create_file('/root/a.txt')
+        self.fs.create_file('/root/b.o')
+        self.fs.create_file('/root/sub/c.txt')
+        paths = sorted(rel for rel, _, _ in walk.walk('/root'))
+        self.assertEqual(paths, ['a.txt', 'b.o', 'sub/c.txt'])
+        paths = sorted(
+            rel for rel, _, _ in walk.walk('/root', exclude=['*.o', 'sub']))
+        self.assertEqual(paths, ['a.txt'])
+
+    def test_walk_include_dir(self):
+        self.fs.create_file('/root/sub/a.txt')
+        self.fs.create_file('/root/sub/deep/b.o')
+        self.fs.create_file('/root/other/c.txt')
+        for include in (['sub'], ['sub/']):
+            paths = sorted(rel for rel, _, _ in walk.walk(
+                '/root', include=include, exclude=['*.o']))
+            self.assertEqual(paths, ['sub/a.txt'])
+
+    def test_walk_prunes(self):
+        self.fs.create_file('/root/target/release/app')
+        self.fs.create_file('/root/target/debug/app')
+        self.fs.create_file('/root/target/release/deps/x')
+        with mock.patch('os.scandir', wraps=os.scandir) as scandir:
+            files = walk.walk('/root', include=['target/release/app'])
+        self.assertEqual([rel for rel, _, _ in files],
+                         ['target/release/app'])
+        listed = sorted(call[0][0] for call in scandir.call_args_list)
+        self.assertEqual(listed,
+                         ['/root', '/root/target', '/root/target/release'])
@@ -0,0 +1,84 @@
+# pylint: disable=missing-docstring
+
+from unittest import mock
+
+from pyfakefs import fake_filesystem_unittest
+
+from trask import phase2, phase3, watch
+
+TEXT = """
+set {{ name '{}' }}
+create-temp-dir {{ var 'tmp' }}
+copy {{ src ['src'] dst tmp }}
+ssh {{ user name host 'h' commands ['true'] }}
+"""
+
+
+class TestWatcher(fake_filesystem_unittest.TestCase):
+    def setUp(self):
+        self.setUpPyfakefs()
+        self.fs.add_real_file(phase2.SCHEMA_PATH)
+        self.fs.create_file('/w/a.trask', contents=TEXT.format('x'))
+        self.fs.create_file('/w/src', contents='a')
+        self.watcher = watch.Watcher('/w/a.trask')
+
+    def tearDown(self):
+        self.watcher.session.close()
+
+    def update(self, changed=()):
+        with mock.patch(
+                'trask.phase3.run_step', wraps=phase3.run_step) as run_step:
+            self.watcher.update(changed)
+        return [call[0][0].name for call in run_step.call_args_list]
+
+    def test_update(self):
+        self.assertEqual(self.update(),
+                         ['set', 'create-temp-dir', 'copy', 'ssh'])
+        self.assertEqual(self.watcher.watched_paths(),
+                         {'/w/a.trask', '/w/src'})
+        self.assertEqual(self.watcher.changed_paths(), set())
+
+        with open('/w/src', 'w') as wfile:
+            wfile.write('changed')
+        changed = self.watcher.changed_paths()
+        self.assertEqual(changed, {'/w/src'})
+        self.assertEqual(self.update(changed), ['copy'])
+
+        with open('/w/a.trask', 'w') as wfile:
+            wfile.write(TEXT.format('y'))
+        changed = self.watcher.changed_paths()
+        self.assertEqual(changed, {'/w/a.trask'})
+        self.assertEqual(self.update(changed), ['set', 'ssh'])
+        self.assertEqual(self.watcher.ctx.variables['name'], 'y')
+
+    def test_failed_steps_rerun(self):
+        with mock.patch('trask.phase3.handle_copy', side_effect=OSError):
+            with mock.patch.dict(phase3.HANDLERS, copy=phase3.handle_copy):
+                self.assertFalse(self.watcher.update())
+        self.assertEqual(self.watcher.pending, {2, 3})
+        self.assertEqual(self.update(), ['copy', 'ssh'])
+        self.assertEqual(self.watcher.pending, set())
+
+    def test_filtered_inputs(self):
+        self.fs.create_file('/w/dir/a.py', contents='a')
+        self.fs.create_file('/w/dir/a.log', contents='a')
+        with open('/w/a.trask', 'w') as wfile:
+            wfile.write("create-temp-dir { var 'tmp' }\n"
+                        "copy { src ['dir'] dst tmp exclude ['*.log'] }\n")
+        self.assertEqual(self.update(), ['create-temp-dir', 'copy'])
+
+        with open('/w/dir/a.log', 'w') as wfile:
+            wfile.write('changed')
+        self.assertEqual(self.watcher.changed_paths(), set())
+
+        with open('/w/dir/a.py', 'w') as wfile:
+            wfile.write('changed')
+        self.assertEqual(self.watcher.changed_paths(), {'/w/dir'})
+
+    def test_fingerprint(self):
+        self.fs.create_file('/w/dir/a.py', contents='a')
+        self.fs.create_file('/w/dir/b.log', contents='b')
+        self.assertEqual(
+            [entry[0] for entry in watch.fingerprint('/w/dir', ['*.py'])],
+            ['a.py'])
+        self.assertIsNone(watch.fingerprint('/w/missing'))
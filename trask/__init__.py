@@ -2,25 +2,484 @@
 # pylint: disable=missing-docstring
 
 import argparse
+import contextlib
+import sys
 
-from trask import phase1, phase2, phase3
+from trask import (checkpoint, history, phase1, phase2, phase3, plan,
+                   remote, scheduler, selection, types)
+from trask.builder import Builder
 
+Call = types.Call
+Var = types.Var
 
-def load(path):
-    root = phase1.load(path)
-    return phase2.Phase2.load(phase2.SCHEMA, root)
+COMMANDS = ('run', 'check', 'compile', 'convert', 'worker')
 
 
-def run(path, dry_run):
-    root = load(path)
-    ctx = phase3.Context(dry_run=dry_run)
-    phase3.run(root, ctx)
+def profile_phase(profiler, name):
+    """Profile phase |name| if |profiler| isn't None."""
+    if profiler is None:
+        return contextlib.suppress()
+    return profiler.phase(name)
+
+
+def load(path,
+         include_cache=None,
+         variables=None,
+         profiler=None,
+         fold=True):
+    """Load and validate |path|, which may be a trask file or a plan.
+
+    |variables| maps the names of variables bound before the file runs
+    to their kinds, the kinds of the variables the file binds are added
+    to it. |profiler| is a profiling.Profiler or None. |fold| is passed
+    on to phase2.Phase2.load.
+    """
+    if plan.is_plan(path):
+        with profile_phase(profiler, 'plan'):
+            return plan.load(path, variables)
+    with profile_phase(profiler, 'phase1'):
+        root = phase1.load(path, include_cache)
+    with profile_phase(profiler, 'phase2'):
+        return phase2.Phase2.load(phase2.get_schema(), root, variables, fold)
+
+
+def run(path, dry_run, **kwargs):
+    run_files([path], dry_run, **kwargs)
+
+
+def load_files(paths,
+               include_cache=None,
+               only=None,
+               from_=None,
+               until=None,
+               profiler=None):
+    """Load |paths| to run one after another, selecting their steps.
+
+    Each file is validated with the variables exported by the files
+    before it. The steps are then selected across all of the files, see
+    selection.select_files. Returns a (steps, exports) pair for each
+    file, and for each step the number it has in its file and its
+    history key.
+    """
+    kinds = {}
+    loaded = []
+    for path in paths:
+        variables = dict(kinds)
+        steps = load(path, include_cache, variables, profiler)
+        for name in plan.exported_names(steps):
+            kinds[name] = variables[name]
+        loaded.append(steps)
+    selected = selection.select_files(loaded, only, from_, until)
+    files = []
+    numbers = []
+    keys = []
+    for path, steps, indices in zip(paths, loaded, selected):
+        step_keys = history.step_keys(path, steps)
+        steps = [steps[index] for index in indices]
+        files.append((steps, plan.exported_names(steps)))
+        numbers.append([index + 1 for index in indices])
+        keys.append([step_keys[index] for index in indices])
+    return files, numbers, keys
+
+
+def file_dependencies(files):
+    """Get the files that each of the (steps, exports) pairs waits for.
+
+    Returns a list of indices into |files| for each file: the earlier
+    files that export a variable it uses, or one it exports too, so
+    that the last export still wins.
+    """
+    deps = []
+    for index, (steps, exports) in enumerate(files):
+        names = phase3.variable_names([step.recipe for step in steps])
+        names.update(exports)
+        deps.append([
+            other for other in range(index)
+            if names.intersection(files[other][1])
+        ])
+    return deps
+
+
+def file_tasks(steps, ctx_factory, progress, deps):
+    """Make scheduler tasks that run |steps| in order after |deps|.
+
+    The context is made by |ctx_factory| when the file starts, after
+    the files it depends on have exported their variables. Returns the
+    tasks, the last of which finishes the file.
+    """
+    state = {}
+
+    def start():
+        state['cleanup'] = phase3.TempDirCleanup(steps)
+        state['ctx'] = ctx = ctx_factory()
+        pending = phase3.pending_steps(steps, ctx, progress)
+        state['pending'] = {id(step): step_hash for step, step_hash in pending}
+        state['order'] = [step for step, _ in pending]
+        state['positions'] = {
+            id(step): index
+            for index, step in enumerate(state['order'])
+        }
+
+    def make_task(step, prev):
+
+        def func():
+            if id(step) in state['pending']:
+                phase3.batch_ssh(state['order'], state['positions'][id(step)],
+                                 state['ctx'])
+                phase3.run_step(step, state['ctx'])
+                state['cleanup'].step_done(step, state['ctx'])
+                if progress is not None:
+                    progress.record(state['pending'][id(step)], state['ctx'])
+
+        def resources():
+            if id(step) not in state['pending']:
+                return ()
+            return phase3.step_resources(step, state['ctx'])
+
+        return scheduler.Task(
+            step.label or step.name,
+            func,
+            deps=[prev],
+            resources=resources,
+            cost=phase3.COSTS[step.name])
+
+    tasks = [scheduler.Task('start', start, deps=deps, cost=0)]
+    for step in steps:
+        tasks.append(make_task(step, tasks[-1]))
+    return tasks
+
+
+def run_files(paths,
+              dry_run,
+              parallel=False,
+              resume=False,
+              only=None,
+              from_=None,
+              until=None,
+              timeout=None,
+              profiler=None,
+              hooks=None,
+              log_dir=None,
+              limits=None,
+              timing=None,
+              coordinator=None):
+    """Run trask files one after another in a single session.
+
+    The files share parsed includes, temporary directories, the hash
+    index and ssh connections. Each file starts with only the variables
+    exported by the files before it. If |parallel| is true, files that
+    don't depend on each other's exports run concurrently, with no more
+    steps at a time in each resource class than |limits| allows, see
+    scheduler.load_limits.
+
+    Unless |dry_run| is true a checkpoint is saved after each step. If
+    a step fails the temporary directories are kept, and with |resume|
+    the next run continues from the step that failed.
+
+    |only|, |from_| and |until| select the steps to run across all of
+    the files, see selection.select_files. Checkpoints are not used for
+    a selection.
+
+    |timeout| is the default for steps without a timeout of their own.
+
+    If |profiler| is given each phase is profiled with it, and files
+    run one at a time so that phase3 is profiled on a single thread.
+
+    |hooks| is an events.Hooks to send events about the run to. If
+    |log_dir| is given the output of each step's commands is written to
+    a file there instead of the terminal. Unless |dry_run| is true, the
+    durations of the steps that succeed are saved to |timing|, a
+    history.History. Steps with a worker key are run by the workers of
+    |coordinator|, a remote.Coordinator, if given.
+    """
+    selecting = (only, from_, until) != (None, None, None)
+    limits = limits or scheduler.DEFAULT_LIMITS
+    session = phase3.Session(
+        dry_run=dry_run,
+        hooks=hooks,
+        log_dir=log_dir,
+        coordinator=coordinator,
+        limits=limits)
+    files, _, keys = load_files(paths, session.include_cache, only, from_,
+                                until, profiler)
+    if timing is not None and not dry_run:
+        timing.register(
+            session.hooks, {
+                id(step): key
+                for (steps, _), file_keys in zip(files, keys)
+                for step, key in zip(steps, file_keys)
+            })
+    progress = []
+    for path in paths:
+        if dry_run or selecting:
+            progress.append(None)
+        elif resume:
+            progress.append(
+                checkpoint.Checkpoint.load(checkpoint.default_path(path)))
+        else:
+            # Without --resume, a failed run's checkpoint is never used
+            checkpoint_path = checkpoint.default_path(path)
+            checkpoint.Checkpoint.load(checkpoint_path).discard()
+            progress.append(checkpoint.Checkpoint(checkpoint_path))
+
+    contexts = []
+
+    def make_context():
+        ctx = phase3.Context(
+            dry_run=dry_run, session=session, timeout=timeout)
+        ctx.variables = dict(session.exports)
+        contexts.append(ctx)
+        return ctx
+
+    try:
+        if parallel and profiler is None:
+            tasks = []
+            ends = []
+            for index, deps in enumerate(file_dependencies(files)):
+                new_tasks = file_tasks(files[index][0], make_context,
+                                       progress[index],
+                                       [ends[dep] for dep in deps])
+                tasks += new_tasks
+                ends.append(new_tasks[-1])
+            try:
+                scheduler.run_tasks(tasks, limits)
+            finally:
+                # phase3.run closes the batches of the files it runs
+                for ctx in contexts:
+                    phase3.close_ssh_batches(ctx)
+        else:
+            for index in range(len(files)):
+                with profile_phase(profiler, 'phase3'):
+                    phase3.run(files[index][0], make_context(),
+                               progress[index])
+    except BaseException:
+        session.close(keep_temp_dirs={
+            temp_dir
+            for saved in progress if saved is not None
+            for temp_dir in saved.temp_dirs
+        })
+        raise
+    finally:
+        if timing is not None:
+            timing.save()
+    for saved in progress:
+        if saved is not None:
+            saved.remove()
+    session.close()
+
+
+def estimate(paths,
+             timing,
+             only=None,
+             from_=None,
+             until=None,
+             out=sys.stdout):
+    """Print how long running |paths| should take, based on |timing|.
+
+    Lists the expected duration of each step, the total if the files
+    run one after another and with --parallel, ignoring resource
+    limits, and the chain of steps that bounds the parallel time.
+    Steps that have never succeeded count as taking no time.
+    """
+    files, numbers, keys = load_files(paths, {}, only, from_, until)
+    tasks = []
+    ends = []
+    names = {}
+    unknown = 0
+    for index, deps in enumerate(file_dependencies(files)):
+        tasks.append(
+            scheduler.Task(paths[index], None, [ends[dep] for dep in deps],
+                           cost=0))
+        for step, number, key in zip(files[index][0], numbers[index],
+                                     keys[index]):
+            seconds = timing.estimate(key)
+            name = '{} {} {}'.format(paths[index], number, step.name)
+            if step.label is not None:
+                name += ' ({})'.format(step.label)
+            if seconds is None:
+                unknown += 1
+                duration = '?'
+            else:
+                duration = history.format_duration(seconds)
+            print('{:<60} {:>9}'.format(name, duration), file=out)
+            tasks.append(
+                scheduler.Task(name, None, [tasks[-1]], cost=seconds or 0))
+            names[tasks[-1]] = name
+        ends.append(tasks[-1])
+
+    chain = [task for task in scheduler.critical_path(tasks) if task in names]
+    print('serial: ' + history.format_duration(
+        sum(task.cost for task in tasks)), file=out)
+    print('parallel: ' + history.format_duration(
+        sum(task.cost for task in chain)), file=out)
+    print('critical path:', file=out)
+    for task in chain:
+        print('  ' + task.name, file=out)
+    if unknown:
+        print('{} steps have no history'.format(unknown), file=out)
+
+
+def compile_plan(path, output):
+    """Validate |path| and write the steps to |output| as a plan.
+
+    Calls aren't folded, the plan may run in another environment.
+    """
+    variables = {}
+    steps = load(path, variables=variables, fold=False)
+    plan.dump(steps, output, variables)
+
+
+def convert(path, output):
+    """Convert between trask text and JSON, based on |output|'s name.
+
+    Includes are left as include steps.
+    """
+    steps = phase1.parse(path)
+    if phase1.is_json_path(output):
+        text = phase1.format_json(steps)
+    else:
+        text = phase1.format_text(steps)
+    with open(output, 'w') as wfile:
+        wfile.write(text)
+
+
+def timeout_arg(text):
+    try:
+        return phase2.parse_timeout(text, [])
+    except phase2.SchemaError:
+        raise argparse.ArgumentTypeError('invalid timeout: ' + text)
+
+
+def limit_arg(text):
+    try:
+        return scheduler.parse_limit(text)
+    except ValueError as err:
+        raise argparse.ArgumentTypeError(str(err))
+
+
+def address_arg(text):
+    try:
+        remote.parse_address(text)
+    except ValueError as err:
+        raise argparse.ArgumentTypeError(str(err))
+    return text
 
 
 def parse_args(args=None):
-    """Parse command-line arguments."""
+    """Parse command-line arguments.
+
+    The command defaults to "run" so that `trask <path>` still works.
+    """
+    if args is None:
+        args = sys.argv[1:]
+    if not args or args[0] not in COMMANDS:
+        args = ['run'] + list(args)
+
     parser = argparse.ArgumentParser(
         prog='trask', description='run a trask file')
-    parser.add_argument('-n', '--dry-run', action='store_true')
-    parser.add_argument('path')
-    return parser.parse_args(args)
+    subparsers = parser.add_subparsers(dest='command')
+
+    run_parser = subparsers.add_parser(
+        'run', help='run trask files or compiled plans in one session')
+    run_parser.add_argument('-n', '--dry-run', action='store_true')
+    run_parser.add_argument(
+        '-r',
+        '--resume',
+        action='store_true',
+        help='continue from the step that failed in the last run')
+    run_parser.add_argument(
+        '-p',
+        '--parallel',
+        action='store_true',
+        help='run files that don\'t use each other\'s exports concurrently')
+    run_parser.add_argument(
+        '-t',
+        '--timeout',
+        type=timeout_arg,
+        help='timeout for steps without one, e.g. 90, 30s, 5m or 1h')
+    run_parser.add_argument(
+        '--plan',
+        action='store_true',
+        help='with --dry-run, show how long each step took in past runs '
+        'and the critical path instead of running')
+    run_parser.add_argument(
+        '--limit',
+        action='append',
+        type=limit_arg,
+        metavar='CLASS=N',
+        help='steps that may use a resource class at once with --parallel, '
+        'e.g. docker=1 (repeatable)')
+    run_parser.add_argument(
+        '--coordinator',
+        type=address_arg,
+        metavar='ADDRESS',
+        help='send steps with a worker key to workers that connect to '
+        'ADDRESS, HOST:PORT or unix:PATH')
+    run_parser.add_argument(
+        '--profile',
+        metavar='DIR',
+        help='write cProfile and tracemalloc reports for each phase to DIR')
+    run_parser.add_argument(
+        '--metrics',
+        metavar='FILE',
+        help='write Prometheus textfile collector metrics to FILE')
+    run_parser.add_argument(
+        '--plugin',
+        action='append',
+        metavar='NAME',
+        help='load this trask.hooks entry point (repeatable)')
+    run_parser.add_argument(
+        '--log-dir',
+        metavar='DIR',
+        help='write the output of each step to a file in DIR')
+    run_parser.add_argument(
+        '-w',
+        '--watch',
+        action='store_true',
+        help='keep running the steps affected by changes to the file')
+    run_parser.add_argument(
+        '--only',
+        action='append',
+        metavar='STEP',
+        help='run only this step, by number, label or name (repeatable)')
+    run_parser.add_argument(
+        '--from', dest='from_', metavar='STEP', help='skip earlier steps')
+    run_parser.add_argument(
+        '--until', metavar='STEP', help='skip later steps')
+    run_parser.add_argument('paths', nargs='+')
+
+    check_parser = subparsers.add_parser(
+        'check', help='validate trask files and directories of them')
+    check_parser.add_argument(
+        '-j', '--jobs', type=int, help='number of worker processes')
+    check_parser.add_argument('paths', nargs='+')
+
+    compile_parser = subparsers.add_parser(
+        'compile', help='validate a trask file and write it as a plan')
+    compile_parser.add_argument('-o', '--output', required=True)
+    compile_parser.add_argument('path')
+
+    convert_parser = subparsers.add_parser(
+        'convert', help='convert between trask text and JSON (.json)')
+    convert_parser.add_argument('path')
+    convert_parser.add_argument('output')
+
+    worker_parser = subparsers.add_parser(
+        'worker', help='run steps sent by a trask run --coordinator')
+    worker_parser.add_argument(
+        '-c',
+        '--capability',
+        action='append',
+        default=[],
+        help='run steps whose worker key is CAPABILITY (repeatable)')
+    worker_parser.add_argument(
+        '--name', help='name shown in errors, defaults to the hostname')
+    worker_parser.add_argument(
+        'address', type=address_arg, help='HOST:PORT or unix:PATH')
+
+    parsed = parser.parse_args(args)
+    if parsed.command == 'run' and parsed.watch and len(parsed.paths) != 1:
+        parser.error('--watch takes a single path')
+    if parsed.command == 'run' and parsed.plan and not parsed.dry_run:
+        parser.error('--plan requires --dry-run')
+    return parsed
@@ -1,11 +1,83 @@
 # pylint: disable=missing-docstring
 
+import sys
+
 import trask
+from trask import (check, events, history, metrics, profiling, remote,
+                   scheduler, selection, watch)
+
+
+def get_token():
+    try:
+        return remote.get_token()
+    except remote.AuthenticationError as err:
+        sys.exit(str(err))
 
 
 def main():
     args = trask.parse_args()
-    trask.run(args.path, args.dry_run)
+    if args.command == 'check':
+        sys.exit(check.check(args.paths, args.jobs))
+    elif args.command == 'compile':
+        trask.compile_plan(args.path, args.output)
+    elif args.command == 'convert':
+        trask.convert(args.path, args.output)
+    elif args.command == 'worker':
+        remote.Worker(args.address, get_token(), args.capability,
+                      args.name).run_forever()
+    elif args.watch:
+        watch.Watcher(args.paths[0], args.dry_run, args.timeout).watch()
+    elif args.plan:
+        trask.estimate(
+            args.paths,
+            history.History(history.default_path()),
+            only=args.only,
+            from_=args.from_,
+            until=args.until)
+    else:
+        profiler = None
+        if args.profile is not None:
+            profiler = profiling.Profiler(args.profile)
+        hooks = events.Hooks()
+        if args.plugin:
+            events.load_plugins(hooks, args.plugin)
+        exporter = None
+        if args.metrics is not None:
+            exporter = metrics.PrometheusExporter(args.metrics)
+            exporter.register(hooks)
+        timing = history.History(history.default_path())
+        coordinator = None
+        if args.coordinator is not None:
+            coordinator = remote.Coordinator(args.coordinator, get_token())
+        success = False
+        try:
+            trask.run_files(
+                args.paths,
+                args.dry_run,
+                args.parallel,
+                resume=args.resume,
+                only=args.only,
+                from_=args.from_,
+                until=args.until,
+                timeout=args.timeout,
+                profiler=profiler,
+                hooks=hooks,
+                log_dir=args.log_dir,
+                limits=scheduler.load_limits(overrides=args.limit or ()),
+                timing=timing,
+                coordinator=coordinator)
+            success = True
+        finally:
+            if profiler is not None:
+                profiler.write()
+            if exporter is not None:
+                exporter.write(success)
+            timing.close()
+            if coordinator is not None:
+                coordinator.close()
 
 
-main()
+try:
+    main()
+except selection.SelectionError as err:
+    sys.exit('trask: error: {}'.format(err))
@@ -0,0 +1,76 @@
+# TODO: remove this
+# pylint: disable=missing-docstring
+
+import collections
+import os
+
+from trask import phase1, phase2, phase3, plan, types
+
+
+def key_name(name):
+    """Convert a Python identifier to a trask key, e.g. from_ -> from."""
+    return name.rstrip('_').replace('_', '-')
+
+
+def convert(val):
+    """Convert Python values to the form produced by phase1."""
+    if isinstance(val, collections.abc.Mapping):
+        return collections.OrderedDict(
+            (key_name(key), convert(elem)) for key, elem in val.items())
+    elif isinstance(val, (list, tuple)):
+        return [convert(elem) for elem in val]
+    return val
+
+
+class Builder:
+    """Build steps in Python, without writing and parsing a trask file.
+
+    Recipes are methods named after the recipe with dashes replaced by
+    underscores, and keyword arguments follow the same rule with a
+    trailing underscore allowed for Python keywords:
+
+        trask.Builder().docker_build(tag='x', from_='amazonlinux:2')
+
+    Variable names passed to set() are used as is. Relative paths are
+    resolved against |path|, which defaults to the current directory.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.getcwd()
+        self.steps = []
+
+    def add(self, name, recipe):
+        """Add a step by recipe name, with |recipe| used as is."""
+        self.steps.append(types.Step(name, recipe, self.path))
+        return self
+
+    def include(self, file):
+        self.steps += phase1.load(os.path.join(self.path, file))
+        return self
+
+    def set(self, **variables):
+        return self.add('set', collections.OrderedDict(
+            (key, convert(val)) for key, val in variables.items()))
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        def add_step(**recipe):
+            return self.add(key_name(name), convert(recipe))
+
+        return add_step
+
+    def load(self, variables=None):
+        """Validate the steps, as Phase2.load does for a trask file."""
+        return phase2.Phase2.load(phase2.get_schema(), self.steps, variables)
+
+    def compile(self, output):
+        variables = {}
+        plan.dump(self.load(variables), output, variables)
+
+    def run(self, dry_run=True):
+        """Validate and run the steps, returning the phase3.Context."""
+        ctx = phase3.Context(dry_run=dry_run)
+        phase3.run(self.load(), ctx)
+        return ctx
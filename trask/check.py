@@ -0,0 +1,78 @@
+# TODO: remove this
+# pylint: disable=missing-docstring
+
+import concurrent.futures
+import os
+import sys
+
+from trask import phase1, phase2
+
+EXTENSIONS = ('.trask', '.trask.json')
+
+# Parsed files shared by all the checks run in one worker process
+WORKER_CACHE = {}
+
+
+def find_files(paths):
+    """Expand directories in |paths| to the trask files under them."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, _, filenames in os.walk(path):
+                files += [
+                    os.path.join(dirpath, filename)
+                    for filename in sorted(filenames)
+                    if filename.endswith(EXTENSIONS)
+                ]
+        else:
+            files.append(path)
+    return files
+
+
+def check_file(path, cache=None):
+    """Load and validate |path|, returning an error message or None."""
+    try:
+        phase2.Phase2.load(
+            phase2.get_schema(), phase1.load(path, cache), fold=False)
+    except Exception as err:  # pylint: disable=broad-except
+        return '{}: {}'.format(type(err).__name__, err)
+    return None
+
+
+def check_in_worker(path):
+    # The grammar and schema are built by the first check in each
+    # process and then cached, like WORKER_CACHE
+    return check_file(path, WORKER_CACHE)
+
+
+def check_files(files, jobs=None):
+    """Check |files| on a process pool, returning a list of errors.
+
+    If |jobs| is 1 the files are checked in this process.
+    """
+    if jobs == 1 or len(files) <= 1:
+        cache = {}
+        return [check_file(path, cache) for path in files]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        workers = jobs or os.cpu_count() or 1
+        chunksize = max(1, len(files) // (workers * 4))
+        return list(executor.map(check_in_worker, files, chunksize=chunksize))
+
+
+def check(paths, jobs=None, out=sys.stdout):
+    """Check all the trask files in |paths| and print a report.
+
+    Returns the exit code: 0 if every file is valid, 1 otherwise.
+    """
+    files = find_files(paths)
+    errors = check_files(files, jobs)
+    failed = 0
+    for path, error in zip(files, errors):
+        if error is None:
+            print('ok', path, file=out)
+        else:
+            failed += 1
+            print('FAIL', path, file=out)
+            print('  ' + error, file=out)
+    print('{} file(s) checked, {} failed'.format(len(files), failed), file=out)
+    return 1 if failed else 0
@@ -0,0 +1,108 @@
+# TODO: remove this
+# pylint: disable=missing-docstring
+
+import hashlib
+import json
+import marshal
+import os
+import shutil
+import tempfile
+
+from trask import plan
+
+VERSION = 1
+
+
+class StaleCheckpoint(ValueError):
+    pass
+
+
+def default_path(path):
+    """Where the checkpoint for trask file |path| is kept."""
+    cache_dir = os.environ.get('XDG_CACHE_HOME') or os.path.join(
+        os.path.expanduser('~'), '.cache')
+    name = hashlib.sha256(os.path.abspath(path).encode()).hexdigest()
+    return os.path.join(cache_dir, 'trask', 'checkpoints', name + '.json')
+
+
+def step_hash(step):
+    """Hash of a validated step, taken before the step is resolved."""
+    return hashlib.sha256(marshal.dumps(plan.encode_step(step))).hexdigest()
+
+
+class Checkpoint:
+    """The steps of one trask file that have already run.
+
+    Saved after every successful step along with the variables and the
+    file's temporary directories at that point, so that a failed run can
+    be resumed from the step that failed. The variables may hold
+    secrets, so only the user can read the file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.steps = []
+        self.variables = {}
+        self.temp_dirs = []
+
+    @classmethod
+    def load(cls, path):
+        """Load the checkpoint at |path|, or start an empty one."""
+        checkpoint = cls(path)
+        if os.path.exists(path):
+            with open(path) as rfile:
+                data = json.load(rfile)
+            if data.get('version') == VERSION:
+                checkpoint.steps = data['steps']
+                checkpoint.variables = data['variables']
+                checkpoint.temp_dirs = data['temp_dirs']
+        return checkpoint
+
+    def restore(self, hashes, ctx):
+        """Restore the state saved in the checkpoint into |ctx|.
+
+        |hashes| are the step hashes of the file being run. Returns the
+        index of the first step that hasn't run yet.
+        """
+        if hashes[:len(self.steps)] != self.steps:
+            raise StaleCheckpoint('file changed since the checkpoint')
+        for temp_dir in self.temp_dirs:
+            if not os.path.isdir(temp_dir):
+                raise StaleCheckpoint('missing directory: ' + temp_dir)
+            if temp_dir not in ctx.temp_dirs:
+                ctx.temp_dirs.append(temp_dir)
+            if temp_dir not in ctx.file_temp_dirs:
+                ctx.file_temp_dirs.append(temp_dir)
+        ctx.variables.update(self.variables)
+        return len(self.steps)
+
+    def record(self, step, ctx):
+        """Record that the step with hash |step| succeeded."""
+        self.steps.append(step)
+        self.variables = dict(ctx.variables)
+        self.temp_dirs = list(ctx.file_temp_dirs)
+        self.save()
+
+    def save(self):
+        dirname = os.path.dirname(self.path)
+        os.makedirs(dirname, mode=0o700, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+                'w', dir=dirname, delete=False) as wfile:
+            os.chmod(wfile.name, 0o600)
+            json.dump({
+                'version': VERSION,
+                'steps': self.steps,
+                'variables': self.variables,
+                'temp_dirs': self.temp_dirs
+            }, wfile)
+        os.replace(wfile.name, self.path)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def discard(self):
+        """Remove the checkpoint and the temporary directories it kept."""
+        for temp_dir in self.temp_dirs:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+        self.remove()
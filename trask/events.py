@@ -0,0 +1,70 @@
+# TODO: remove this
+# pylint: disable=missing-docstring
+
+# Entry point group for plugins. Each entry point is a callable that
+# takes a Hooks and registers its listeners on it, and is loaded when a
+# run asks for it by name.
+ENTRY_POINT_GROUP = 'trask.hooks'
+
+# Events and the keyword arguments their listeners are called with
+STEP_START = 'step_start'  # step
+STEP_END = 'step_end'  # step, seconds, error (None on success)
+COMMAND_START = 'command_start'  # cmd
+COMMAND_END = 'command_end'  # cmd, exit_code (or 'timeout'/'error'), seconds
+CACHE_HIT = 'cache_hit'  # cache ('copy' or 'store'), count
+CACHE_MISS = 'cache_miss'  # cache, count
+BYTES_COPIED = 'bytes_copied'  # size
+BYTES_UPLOADED = 'bytes_uploaded'  # host, size
+
+EVENTS = (STEP_START, STEP_END, COMMAND_START, COMMAND_END, CACHE_HIT,
+          CACHE_MISS, BYTES_COPIED, BYTES_UPLOADED)
+
+
+class Hooks:
+    """Listeners for events during a run.
+
+    A Hooks is false when nothing is registered, so callers check it
+    before building an event:
+
+        if ctx.hooks:
+            ctx.hooks.emit(events.STEP_START, step=step)
+
+    Events may be emitted from several threads at once.
+    """
+
+    def __init__(self):
+        self.listeners = {}
+
+    def __bool__(self):
+        return bool(self.listeners)
+
+    def on(self, event, listener):
+        if event not in EVENTS:
+            raise ValueError('unknown event: ' + event)
+        self.listeners.setdefault(event, []).append(listener)
+
+    def emit(self, event, **fields):
+        for listener in self.listeners.get(event, ()):
+            listener(**fields)
+
+
+def entry_points():
+    try:
+        import importlib.metadata as metadata
+    except ImportError:
+        # Before Python 3.8
+        import pkg_resources
+        return list(pkg_resources.iter_entry_points(ENTRY_POINT_GROUP))
+    points = metadata.entry_points()
+    if hasattr(points, 'select'):
+        return points.select(group=ENTRY_POINT_GROUP)
+    return points.get(ENTRY_POINT_GROUP, [])
+
+
+def load_plugins(hooks, names):
+    """Let the plugins called |names| register their listeners on |hooks|."""
+    points = {entry_point.name: entry_point for entry_point in entry_points()}
+    for name in names:
+        if name not in points:
+            raise ValueError('unknown plugin: ' + name)
+        points[name].load()(hooks)
@@ -1,11 +1,13 @@
 # TODO: remove this
 # pylint: disable=missing-docstring
 
+import glob
 import os
+import subprocess
 
 import attr
 
-from trask import types
+from trask import hashindex, types
 
 
 @attr.s
@@ -15,18 +17,77 @@ class Param:
 
 @attr.s
 class Function:
+    """A function that trask files can call.
+
+    |impl| is called with the list of arguments and a context that has
+    repath() and get_hash_index(). A |pure| function gives the same
+    result for the same arguments and directory for a whole run, so its
+    results are memoized, and calls with constant arguments are folded
+    into constants when the file is validated.
+    """
     params = attr.ib()
     return_type = attr.ib()
     impl = attr.ib()
+    pure = attr.ib(default=False)
+
+
+class StaticContext:
+    """Enough of a context to call pure functions during validation."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def repath(self, path):
+        return os.path.abspath(os.path.join(self.path, path))
 
+    def get_hash_index(self):
+        return hashindex.HashIndex()
 
-def get_from_env(args):
+
+def get_from_env(args, _):
     key = args[0]
     return os.environ[key]
 
 
+def git_rev(_, ctx):
+    return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                   cwd=ctx.repath('.')).decode().strip()
+
+
+def read_file(args, ctx):
+    with open(ctx.repath(args[0])) as rfile:
+        return rfile.read()
+
+
+def sha256_file(args, ctx):
+    """Hash a file, reusing the digest if its stat hasn't changed."""
+    return ctx.get_hash_index().digest(ctx.repath(args[0]))
+
+
+def glob_paths(args, ctx):
+    return sorted(glob.glob(ctx.repath(args[0]), recursive=True))
+
+
+FUNCTIONS = {
+    'env':
+    Function((Param(types.Kind.String), ),
+             types.Kind.String,
+             get_from_env,
+             pure=True),
+    'git-rev':
+    Function((), types.Kind.String, git_rev, pure=True),
+    'glob':
+    Function((Param(types.Kind.Path), ), types.Kind.Array, glob_paths),
+    'read':
+    Function((Param(types.Kind.Path), ), types.Kind.String, read_file),
+    'sha256':
+    Function((Param(types.Kind.Path), ), types.Kind.String, sha256_file),
+}
+
+
 def get_functions():
-    return {
-        'env':
-        Function((Param(types.Kind.String), ), types.Kind.String, get_from_env)
-    }
+    return FUNCTIONS
+
+
+def is_constant(args):
+    return all(isinstance(arg, (bool, str)) for arg in args)
@@ -0,0 +1,156 @@
+# TODO: remove this
+# pylint: disable=missing-docstring
+
+import concurrent.futures
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+import attr
+
+from trask import walk
+
+CHUNK_SIZE = 1024 * 1024
+
+# Files at least this big are hashed on the thread pool, smaller ones
+# are cheaper to hash inline
+LARGE_FILE_SIZE = 4 * CHUNK_SIZE
+
+VERSION = 1
+
+
+def default_path():
+    cache_dir = os.environ.get('XDG_CACHE_HOME') or os.path.join(
+        os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_dir, 'trask', 'hashindex.json')
+
+
+def hash_file(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as rfile:
+        for chunk in iter(lambda: rfile.read(CHUNK_SIZE), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def stat_key(stat_result):
+    return [stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino]
+
+
+@attr.s(frozen=True)
+class File:
+    path = attr.ib()
+    full_path = attr.ib()
+    stat = attr.ib(cmp=False, repr=False)
+    digest = attr.ib()
+
+
+class HashIndex:
+    """Content hashes of files, cached by (path, size, mtime, inode).
+
+    If |path| is None the index is kept in memory only.
+    """
+
+    def __init__(self, path=None, max_workers=None):
+        self.path = path
+        self.max_workers = max_workers
+        self.entries = {}
+        self.dirty = False
+        self.lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            with open(path) as rfile:
+                data = json.load(rfile)
+            if data.get('version') == VERSION:
+                self.entries = data['entries']
+
+    def lookup(self, full_path, stat_result):
+        entry = self.entries.get(full_path)
+        if entry is not None and entry[:3] == stat_key(stat_result):
+            return entry[3]
+        return None
+
+    def update(self, full_path, stat_result, digest):
+        with self.lock:
+            self.entries[full_path] = stat_key(stat_result) + [digest]
+            self.dirty = True
+
+    def digest(self, full_path):
+        """Get the digest of one file, hashing it only if it changed."""
+        full_path = os.path.abspath(full_path)
+        stat_result = os.stat(full_path)
+        digest = self.lookup(full_path, stat_result)
+        if digest is None:
+            digest = hash_file(full_path)
+            self.update(full_path, stat_result, digest)
+        return digest
+
+    def digests(self, files):
+        """Get a File for each (relative path, full path, stat) in |files|.
+
+        Only files whose stat changed since they were last indexed are
+        read, large ones in parallel.
+        """
+        result = {}
+        large = []
+        for rel_path, full_path, stat_result in files:
+            full_path = os.path.abspath(full_path)
+            digest = self.lookup(full_path, stat_result)
+            if digest is None:
+                if stat_result.st_size >= LARGE_FILE_SIZE:
+                    large.append((rel_path, full_path, stat_result))
+                    continue
+                digest = hash_file(full_path)
+                self.update(full_path, stat_result, digest)
+            result[rel_path] = File(rel_path, full_path, stat_result, digest)
+        if large:
+            with concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.max_workers) as executor:
+                digests = executor.map(hash_file,
+                                       [full_path for _, full_path, _ in large])
+                for (rel_path, full_path, stat_result), digest in zip(
+                        large, digests):
+                    self.update(full_path, stat_result, digest)
+                    result[rel_path] = File(rel_path, full_path, stat_result,
+                                            digest)
+        return [result[rel_path] for rel_path in sorted(result)]
+
+    def scan(self, root, include=None, exclude=None):
+        """Get a File for each matching file under |root|, sorted by path."""
+        return self.digests(walk.walk(root, include, exclude))
+
+    def prune(self, dirs):
+        """Forget the files under |dirs|, directories that were deleted.
+
+        Only the paths are compared, nothing is read from disk.
+        """
+        prefixes = tuple(os.path.join(path, '') for path in dirs)
+        if not prefixes:
+            return
+        with self.lock:
+            removed = [
+                full_path for full_path in self.entries
+                if full_path.startswith(prefixes)
+            ]
+            for full_path in removed:
+                del self.entries[full_path]
+            if removed:
+                self.dirty = True
+
+    def save(self):
+        """Write the index if it changed, atomically.
+
+        Saving rewrites the whole file, so do it once per session.
+        """
+        if self.path is None:
+            return
+        if not self.dirty:
+            return
+        dirname = os.path.dirname(self.path)
+        os.makedirs(dirname, exist_ok=True)
+        with self.lock, tempfile.NamedTemporaryFile(
+                'w', dir=dirname, delete=False) as wfile:
+            json.dump({'version': VERSION, 'entries': self.entries}, wfile)
+            self.dirty = False
+        os.replace(wfile.name, self.path)
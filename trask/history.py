@@ -0,0 +1,105 @@
+# TODO: remove this
+# pylint: disable=missing-docstring
+
+import os
+import sqlite3
+import statistics
+import threading
+
+from trask import events
+
+# Durations kept per step, the estimate is their median
+KEEP = 10
+
+
+def default_path():
+    cache_dir = os.environ.get('XDG_CACHE_HOME') or os.path.join(
+        os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_dir, 'trask', 'history.sqlite')
+
+
+def step_keys(path, steps):
+    """Get a key identifying each of |steps| in file |path| across runs.
+
+    Steps are identified by their label or name and how many steps
+    before them in the file have the same one, so editing a step's
+    recipe keeps its history.
+    """
+    path = os.path.abspath(path)
+    counts = {}
+    keys = []
+    for step in steps:
+        name = step.label or step.name
+        counts[name] = counts.get(name, 0) + 1
+        keys.append('{}:{}:{}'.format(path, name, counts[name]))
+    return keys
+
+
+def format_duration(seconds):
+    if seconds < 60:
+        return '{:.1f}s'.format(seconds)
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    if minutes < 60:
+        return '{}m {:02d}s'.format(minutes, seconds)
+    hours, minutes = divmod(minutes, 60)
+    return '{}h {:02d}m'.format(hours, minutes)
+
+
+class History:
+    """Durations of the steps that succeeded in past runs.
+
+    Stored in an SQLite database at |path|, or in memory if |path| is
+    None. Durations are recorded from any thread and written by save().
+    """
+
+    def __init__(self, path=None):
+        if path is None:
+            path = ':memory:'
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS durations '
+                        '(step TEXT NOT NULL, seconds REAL NOT NULL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS durations_step '
+                        'ON durations (step)')
+        self.pending = []
+        self.lock = threading.Lock()
+
+    def record(self, key, seconds):
+        with self.lock:
+            self.pending.append((key, seconds))
+
+    def register(self, hooks, keys):
+        """Record the steps that succeed, |keys| mapping id(step) to keys."""
+
+        def on_step_end(step, seconds, error):
+            if error is None and id(step) in keys:
+                self.record(keys[id(step)], seconds)
+
+        hooks.on(events.STEP_END, on_step_end)
+
+    def save(self):
+        """Write the recorded durations, keeping the last KEEP per step."""
+        with self.lock:
+            pending = self.pending
+            self.pending = []
+        with self.db:
+            self.db.executemany('INSERT INTO durations VALUES (?, ?)',
+                                pending)
+            for key in {key for key, _ in pending}:
+                self.db.execute(
+                    'DELETE FROM durations WHERE step = ? AND rowid NOT IN '
+                    '(SELECT rowid FROM durations WHERE step = ? '
+                    'ORDER BY rowid DESC LIMIT ?)', (key, key, KEEP))
+
+    def estimate(self, key):
+        """Get the expected duration of a step, or None if never run."""
+        rows = self.db.execute(
+            'SELECT seconds FROM durations WHERE step = ?', (key, ))
+        durations = [row[0] for row in rows]
+        if not durations:
+            return None
+        return statistics.median(durations)
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,193 @@
+# TODO: remove this
+# pylint: disable=missing-docstring
+
+import collections
+import contextlib
+import os
+import queue
+import re
+import shutil
+import sys
+import threading
+import time
+
+# Lines of each step's output kept in memory to show if it fails
+TAIL_LINES = 20
+
+# Longest line read at once, longer lines are split
+MAX_LINE = 64 * 1024
+
+# Chunks waiting for the writer, readers block when it falls behind
+QUEUE_SIZE = 1024
+
+# Seconds between redraws of the status line
+STATUS_INTERVAL = 0.1
+
+# Longest label kept in a log file name
+MAX_SLUG = 64
+
+
+def slugify(text):
+    """Make |text| safe to use in a file name.
+
+    Runs of anything but letters, digits, '-' and '_' become a single
+    '-', so the result can't contain a path separator or '..'.
+    """
+    slug = re.sub(r'[^A-Za-z0-9_-]+', '-', text).strip('-')
+    return slug[:MAX_SLUG] or 'step'
+
+
+class StepLog:
+    """Output of the commands run by one step.
+
+    Everything goes to a file, written by the LogCapture's writer
+    thread, and only the last |tail_lines| lines are kept in memory.
+    """
+
+    def __init__(self, capture, name, path, tail_lines=TAIL_LINES):
+        self.capture = capture
+        self.name = name
+        self.path = path
+        self.tail = collections.deque(maxlen=tail_lines)
+        self.file = open(path, 'wb')
+
+    def write(self, data):
+        self.tail.append(data)
+        self.capture.queue.put((self, data))
+        self.capture.status.update(self)
+
+    def message(self, text):
+        self.write((text + '\n').encode())
+
+    def last_line(self):
+        if not self.tail:
+            return ''
+        return self.tail[-1].decode(errors='replace').strip()
+
+    def follow(self, pipe, output=None):
+        """Start a thread copying |pipe| to the log, or to |output|."""
+
+        def read():
+            for data in iter(lambda: pipe.readline(MAX_LINE), b''):
+                if output is None:
+                    self.write(data)
+                else:
+                    output.append(data)
+
+        thread = threading.Thread(target=read, daemon=True)
+        thread.start()
+        return thread
+
+    def close(self):
+        self.capture.queue.put((self, None))
+
+
+class Status:
+    """A line on a terminal showing the last output of each running step.
+
+    When |stream| isn't a terminal only finished steps are reported.
+    """
+
+    def __init__(self, stream=sys.stderr):
+        self.stream = stream
+        self.is_tty = stream.isatty()
+        self.running = []
+        self.lock = threading.Lock()
+        self.drawn = 0
+
+    def render(self):
+        width = shutil.get_terminal_size().columns - 1
+        text = ' | '.join('[{}] {}'.format(log.name, log.last_line())
+                          for log in self.running)
+        self.stream.write('\r' + text[:width] + '\x1b[K')
+        self.stream.flush()
+        self.drawn = time.monotonic()
+
+    def start(self, log):
+        with self.lock:
+            self.running.append(log)
+            if self.is_tty:
+                self.render()
+
+    def update(self, log):
+        if not self.is_tty or time.monotonic() - self.drawn < STATUS_INTERVAL:
+            return
+        with self.lock:
+            if log in self.running:
+                self.render()
+
+    def finish(self, log, error):
+        with self.lock:
+            self.running.remove(log)
+            if self.is_tty:
+                self.stream.write('\r\x1b[K')
+            if error is None:
+                self.stream.write('[{}] done, log: {}\n'.format(
+                    log.name, log.path))
+            else:
+                self.stream.write('[{}] failed: {}, log: {}\n'.format(
+                    log.name, error, log.path))
+                for data in log.tail:
+                    self.stream.write(
+                        '  ' + data.decode(errors='replace').rstrip() + '\n')
+            if self.is_tty and self.running:
+                self.render()
+            self.stream.flush()
+
+
+class LogCapture:
+    """Send the output of each step's commands to a file in |log_dir|.
+
+    Files are named after the order steps start in and their labels or
+    names, e.g. 003-ssh.log. Labels are slugified, so the files always
+    stay in |log_dir|.
+    """
+
+    def __init__(self, log_dir, status=None, tail_lines=TAIL_LINES):
+        self.log_dir = log_dir
+        self.status = Status() if status is None else status
+        self.tail_lines = tail_lines
+        self.queue = queue.Queue(QUEUE_SIZE)
+        self.count = 0
+        self.lock = threading.Lock()
+        os.makedirs(log_dir, exist_ok=True)
+        self.writer = threading.Thread(target=self.write_loop, daemon=True)
+        self.writer.start()
+
+    def write_loop(self):
+        while True:
+            log, data = self.queue.get()
+            if log is None:
+                return
+            if data is None:
+                log.file.close()
+            else:
+                log.file.write(data)
+
+    def open_step(self, step):
+        with self.lock:
+            self.count += 1
+            number = self.count
+        name = step.label or step.name
+        path = os.path.join(self.log_dir, '{:03d}-{}.log'.format(
+            number, slugify(name)))
+        return StepLog(self, name, path, self.tail_lines)
+
+    @contextlib.contextmanager
+    def capture(self, step):
+        log = self.open_step(step)
+        self.status.start(log)
+        try:
+            yield log
+        except BaseException as err:
+            self.status.finish(log, err)
+            raise
+        else:
+            self.status.finish(log, None)
+        finally:
+            log.close()
+
+    def close(self):
+        """Wait for the writer to finish writing the logs."""
+        self.queue.put((None, None))
+        self.writer.join()
@@ -0,0 +1,124 @@
+# TODO: remove this
+# pylint: disable=missing-docstring
+
+import collections
+import os
+import tempfile
+import threading
+import time
+
+from trask import events
+
+# Name, type and help text of each metric, in the order written
+METRICS = (
+    ('trask_run_success', 'gauge', 'Whether the last run succeeded.'),
+    ('trask_run_duration_seconds', 'gauge', 'Duration of the last run.'),
+    ('trask_last_run_timestamp_seconds', 'gauge',
+     'Unix time the last run finished.'),
+    ('trask_steps_total', 'counter', 'Steps run, by result.'),
+    ('trask_step_duration_seconds_total', 'counter', 'Time spent in steps.'),
+    ('trask_commands_total', 'counter', 'Commands run, by exit code.'),
+    ('trask_command_duration_seconds_total', 'counter',
+     'Time spent in commands.'),
+    ('trask_cache_hits_total', 'counter',
+     'Files that were already up to date.'),
+    ('trask_cache_misses_total', 'counter', 'Files that were transferred.'),
+    ('trask_copied_bytes_total', 'counter', 'Bytes copied locally.'),
+    ('trask_uploaded_bytes_total', 'counter', 'Bytes uploaded to hosts.'),
+)
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace(
+        '"', '\\"')
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(key, escape(val))
+                          for key, val in labels) + '}'
+
+
+class PrometheusExporter:
+    """Metrics for the Prometheus node exporter's textfile collector.
+
+    The values cover one run of trask and are written to |path| by
+    write(), replacing the previous run's file atomically.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.start = time.time()
+        self.lock = threading.Lock()
+        # (metric name, sorted label pairs) -> value
+        self.values = collections.OrderedDict()
+
+    def add(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def register(self, hooks):
+        hooks.on(events.STEP_END, self.on_step_end)
+        hooks.on(events.COMMAND_END, self.on_command_end)
+        hooks.on(events.CACHE_HIT, self.on_cache_hit)
+        hooks.on(events.CACHE_MISS, self.on_cache_miss)
+        hooks.on(events.BYTES_COPIED, self.on_bytes_copied)
+        hooks.on(events.BYTES_UPLOADED, self.on_bytes_uploaded)
+
+    def on_step_end(self, step, seconds, error):
+        labels = {'step': step.name, 'label': step.label or ''}
+        result = 'success' if error is None else 'failure'
+        self.add('trask_steps_total', 1, result=result, **labels)
+        self.add('trask_step_duration_seconds_total', seconds, **labels)
+
+    def on_command_end(self, cmd, exit_code, seconds):
+        command = os.path.basename(cmd[0])
+        self.add('trask_commands_total', 1, command=command,
+                 exit_code=str(exit_code))
+        self.add(
+            'trask_command_duration_seconds_total', seconds, command=command)
+
+    def on_cache_hit(self, cache, count):
+        self.add('trask_cache_hits_total', count, cache=cache)
+
+    def on_cache_miss(self, cache, count):
+        self.add('trask_cache_misses_total', count, cache=cache)
+
+    def on_bytes_copied(self, size):
+        self.add('trask_copied_bytes_total', size)
+
+    def on_bytes_uploaded(self, host, size):
+        self.add('trask_uploaded_bytes_total', size, host=host)
+
+    def format(self, success):
+        now = time.time()
+        values = collections.OrderedDict(self.values)
+        values[('trask_run_success', ())] = int(success)
+        values[('trask_run_duration_seconds', ())] = now - self.start
+        values[('trask_last_run_timestamp_seconds', ())] = now
+        lines = []
+        for name, kind, text in METRICS:
+            samples = [(labels, value)
+                       for (key, labels), value in values.items()
+                       if key == name]
+            if not samples:
+                continue
+            lines += [
+                '# HELP {} {}'.format(name, text),
+                '# TYPE {} {}'.format(name, kind)
+            ]
+            for labels, value in sorted(samples):
+                lines.append('{}{} {}'.format(name, format_labels(labels),
+                                              repr(float(value))))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, success):
+        """Write the metrics, |success| being whether the run succeeded."""
+        dirname = os.path.dirname(os.path.abspath(self.path))
+        with tempfile.NamedTemporaryFile(
+                'w', dir=dirname, suffix='.tmp', delete=False) as wfile:
+            wfile.write(self.format(success))
+        os.chmod(wfile.name, 0o644)
+        os.replace(wfile.name, self.path)
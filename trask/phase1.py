@@ -2,10 +2,10 @@
 # pylint: disable=missing-docstring
 
 import collections
+import functools
+import json
 import os
 
-import tatsu
-
 from trask import types
 
 GRAMMAR = '''
@@ -49,29 +49,149 @@ class Semantics:
         return types.Call(ast['func'], ast['args'])
 
 
-MODEL = tatsu.compile(GRAMMAR, semantics=Semantics())
+@functools.lru_cache(maxsize=None)
+def get_model():
+    """Compile the grammar on first use."""
+    import tatsu
+    return tatsu.compile(GRAMMAR, semantics=Semantics())
+
+
+class JsonFormatError(ValueError):
+    pass
+
+
+def json_object(pairs):
+    """Decode a JSON object, which may encode a variable or call."""
+    dct = collections.OrderedDict(pairs)
+    if '$var' in dct:
+        if len(dct) != 1:
+            raise JsonFormatError('unexpected keys with $var')
+        return types.Var(dct['$var'])
+    elif '$call' in dct:
+        if set(dct) - {'$call', 'args'}:
+            raise JsonFormatError('unexpected keys with $call')
+        return types.Call(dct['$call'], dct.get('args', []))
+    return dct
+
+
+def parse_json(text):
+    """Parse the JSON form of a trask file.
+
+    The top level is a list of single-key objects mapping the step name
+    to its recipe. {"$var": name} is a variable and {"$call": name,
+    "args": [...]} is a function call.
+    """
+    steps = []
+    for obj in json.loads(text, object_pairs_hook=json_object):
+        if not isinstance(obj, collections.abc.Mapping) or len(obj) != 1:
+            raise JsonFormatError('each step must be an object with one key')
+        for name, recipe in obj.items():
+            steps.append(types.Step(name, recipe, None))
+    return steps
+
+
+def parse_text(text):
+    return get_model().parse(text)
+
 
+def is_json_path(path):
+    return path.endswith('.json')
 
-def expand_includes(step, path):
+
+def parse(path, cache=None):
+    """Parse |path| without expanding includes.
+
+    If |cache| is a dict, parsed files are kept in it by path and reused.
+    """
+    if cache is not None:
+        key = os.path.abspath(path)
+        if key not in cache:
+            cache[key] = parse(path)
+        return cache[key]
+    with open(path) as rfile:
+        text = rfile.read()
+    if is_json_path(path):
+        return parse_json(text)
+    return parse_text(text)
+
+
+def expand_includes(step, path, cache=None):
     if step.name == 'include' and 'file' in step.recipe:
         rel_path = step.recipe['file']
         if isinstance(rel_path, types.Var):
             raise TypeError('include path cannot be a variable')
         dirname = os.path.dirname(path)
         new_path = os.path.abspath(os.path.join(dirname, rel_path))
-        return load(new_path)
+        return load(new_path, cache)
     else:
         step.path = os.path.dirname(path)
         return [step]
 
 
-def load(path):
-    """Load |path| and recursively expand any includes."""
-    with open(path) as rfile:
-        steps = MODEL.parse(rfile.read())
+def load(path, cache=None):
+    """Load |path| and recursively expand any includes.
+
+    Files ending in .json are read as JSON, anything else as trask text.
+    """
+    steps = parse(path, cache)
 
     new_steps = []
     for step in steps:
-        new_steps += expand_includes(step, path)
+        new_steps += expand_includes(step, path, cache)
 
     return new_steps
+
+
+def to_json(val):
+    if isinstance(val, types.Var):
+        return {'$var': val.name}
+    elif isinstance(val, types.Call):
+        return {'$call': val.name, 'args': [to_json(arg) for arg in val.args]}
+    elif isinstance(val, collections.abc.Mapping):
+        return collections.OrderedDict(
+            (key, to_json(elem)) for key, elem in val.items())
+    elif isinstance(val, (list, tuple)):
+        return [to_json(elem) for elem in val]
+    return val
+
+
+def format_json(steps):
+    """Format unvalidated steps as JSON."""
+    return json.dumps(
+        [{
+            step.name: to_json(step.recipe)
+        } for step in steps], indent=2) + '\n'
+
+
+def format_value(val, indent):
+    if isinstance(val, bool):
+        return 'true' if val else 'false'
+    elif isinstance(val, str):
+        if "'" in val:
+            raise ValueError('strings cannot contain quotes: ' + val)
+        return "'" + val + "'"
+    elif isinstance(val, types.Var):
+        return val.name
+    elif isinstance(val, types.Call):
+        return '{}({})'.format(
+            val.name, ' '.join(format_value(arg, indent) for arg in val.args))
+    elif isinstance(val, collections.abc.Mapping):
+        if not val:
+            return '{}'
+        inner = indent + '  '
+        lines = [
+            inner + key + ' ' + format_value(elem, inner)
+            for key, elem in val.items()
+        ]
+        return '{\n' + '\n'.join(lines) + '\n' + indent + '}'
+    elif isinstance(val, (list, tuple)):
+        return '[ ' + ' '.join(format_value(elem, indent)
+                               for elem in val) + ' ]'
+    raise TypeError('invalid value type')
+
+
+def format_text(steps):
+    """Format unvalidated steps as a trask file."""
+    return '\n'.join(
+        step.name + ' ' + format_value(step.recipe, '') + '\n'
+        for step in steps)
@@ -2,11 +2,11 @@
 # pylint: disable=missing-docstring
 
 import collections
+import functools
 import keyword
 import os
 
 import attr
-import tatsu
 
 from trask import functions, types
 
@@ -44,6 +44,20 @@ def make_keys_safe(dct):
     return result
 
 
+# Recipe classes by field names, shared so that each recipe object
+# doesn't get a class of its own
+RECIPE_CLASSES = {}
+
+
+def make_recipe_class(keys):
+    keys = tuple(keys)
+    cls = RECIPE_CLASSES.get(keys)
+    if cls is None:
+        cls = attr.make_class('SchemaClass', list(keys), slots=True)
+        RECIPE_CLASSES[keys] = cls
+    return cls
+
+
 class SchemaError(ValueError):
     pass
 
@@ -72,6 +86,60 @@ class InvalidFunction(SchemaError):
     pass
 
 
+class InvalidTimeout(SchemaError):
+    pass
+
+
+class InvalidSize(SchemaError):
+    pass
+
+
+# Steps that set variables, which can't run on a worker
+LOCAL_ONLY = ('create-temp-dir', 'export', 'set')
+
+# Suffixes allowed on timeouts, as multiples of a second
+TIMEOUT_UNITS = {'s': 1, 'm': 60, 'h': 60 * 60}
+
+
+def parse_timeout(val, path):
+    """Get a timeout in seconds from a number or a string like '5m'."""
+    if isinstance(val, bool):
+        raise TypeMismatch(path)
+    if isinstance(val, (int, float)):
+        seconds = val
+    elif isinstance(val, str):
+        unit = TIMEOUT_UNITS.get(val[-1:])
+        number = val[:-1] if unit else val
+        try:
+            seconds = float(number) * (unit or 1)
+        except ValueError:
+            raise InvalidTimeout(path)
+    else:
+        raise TypeMismatch(path)
+    if seconds <= 0:
+        raise InvalidTimeout(path)
+    return seconds
+
+
+# Suffixes allowed on sizes, as multiples of a byte
+SIZE_UNITS = {'K': 1024, 'M': 1024**2, 'G': 1024**3, 'T': 1024**4}
+
+
+def parse_size(val, path):
+    """Get a size in bytes from a string like '512M' or '2G'."""
+    if not isinstance(val, str):
+        raise TypeMismatch(path)
+    unit = SIZE_UNITS.get(val[-1:].upper())
+    number = val[:-1] if unit else val
+    try:
+        size = int(float(number) * (unit or 1))
+    except ValueError:
+        raise InvalidSize(path)
+    if size <= 0:
+        raise InvalidSize(path)
+    return size
+
+
 def does_substition_match(type1, type2):
     path_types = (types.Kind.String, types.Kind.Path)
     return ((type1 == type2) or (type1 in path_types and type2 in path_types)
@@ -83,35 +151,46 @@ class Phase2:
     step = attr.ib()
     variables = attr.ib()
     functions = attr.ib()
+    values = attr.ib()
+    fold = attr.ib()
 
     def __init__(self):
         self.step = None
         self.variables = {}
         self.functions = functions.get_functions()
+        self.values = {}
+        self.fold = True
+
+    def make_value(self, data, is_path=False):
+        """Get a Value, sharing one instance per distinct string or bool."""
+        key = (type(data), data, is_path)
+        value = self.values.get(key)
+        if value is None:
+            value = types.Value(data, is_path)
+            self.values[key] = value
+        return value
 
     def load_any(self, _, val, path):
-        # pylint: disable=no-self-use
         if val is None:
             raise TypeMismatch(path)
+        if isinstance(val, (bool, str)):
+            return self.make_value(val)
         return types.Value(val)
 
     def load_bool(self, _, val, path):
-        # pylint: disable=no-self-use
         if not isinstance(val, bool):
             raise TypeMismatch(path)
-        return types.Value(val)
+        return self.make_value(val)
 
     def load_string(self, _, val, path):
-        # pylint: disable=no-self-use
         if not isinstance(val, str):
             raise TypeMismatch(path)
-        return types.Value(val)
+        return self.make_value(val)
 
     def load_path(self, _, val, path):
-        # pylint: disable=no-self-use
         if not isinstance(val, str):
             raise TypeMismatch(path)
-        return types.Value(val, is_path=True)
+        return self.make_value(val, is_path=True)
 
     def load_array(self, schema, val, path):
         if not isinstance(val, list):
@@ -124,23 +203,56 @@ class Phase2:
 
     def load_step(self, schema, val, path):
         self.step = val
-        fields = self.load_one(schema.fields[Key(val.name)], val.recipe,
-                               path + [val.name])
+        recipe = val.recipe
+        label = None
+        timeout = None
+        worker = None
+        step_schema = schema.fields[Key(val.name)]
+        # Any step can have a label, used to select steps to run, a
+        # timeout, and the capability a worker needs to run it, except
+        # for steps like set where every key is a variable name
+        if (isinstance(recipe, collections.abc.Mapping)
+                and not step_schema.wildcard_key()):
+            if 'label' in recipe:
+                label = recipe['label']
+                if not isinstance(label, str):
+                    raise TypeMismatch(path + [val.name, 'label'])
+            if 'timeout' in recipe:
+                timeout = parse_timeout(recipe['timeout'],
+                                        path + [val.name, 'timeout'])
+            if 'worker' in recipe:
+                worker = recipe['worker']
+                if not isinstance(worker, str):
+                    raise TypeMismatch(path + [val.name, 'worker'])
+                if val.name in LOCAL_ONLY:
+                    raise InvalidKey(path + [val.name], 'worker')
+            recipe = collections.OrderedDict(
+                (key, elem) for key, elem in recipe.items()
+                if key not in ('label', 'timeout', 'worker'))
+        fields = self.load_one(step_schema, recipe, path + [val.name])
         # TODO, might be better to encode this in the schema somehow
         if val.name == 'create-temp-dir':
             self.variables[fields.var.data] = types.Kind.Path
+            if isinstance(fields.size.data, str):
+                parse_size(fields.size.data, path + [val.name, 'size'])
         elif val.name == 'set':
-            for key in val.recipe:
-                if isinstance(val.recipe[key], str):
+            for key in recipe:
+                if isinstance(recipe[key], str):
                     self.variables[key] = types.Kind.String
-                elif isinstance(val.recipe[key], bool):
+                elif isinstance(recipe[key], bool):
                     self.variables[key] = types.Kind.Bool
-                elif isinstance(val.recipe[key], types.Call):
-                    self.variables[key] = self.functions[val.recipe[key].
+                elif isinstance(recipe[key], types.Call):
+                    self.variables[key] = self.functions[recipe[key].
                                                          name].return_type
                 else:
                     raise SchemaError('invalid variable type')
-        return types.Step(val.name, fields, val.path)
+        elif val.name == 'export':
+            for name in fields.vars:
+                if not isinstance(name.data, str):
+                    raise TypeMismatch(path + [val.name, 'vars'])
+                if name.data not in self.variables:
+                    raise UnboundVariable(path + [val.name])
+        return types.Step(val.name, fields, val.path, label, timeout, worker)
 
     def load_object(self, schema, val, path):
         if isinstance(val, types.Step):
@@ -163,12 +275,12 @@ class Phase2:
                                                   val[key], subpath)
             for key in schema.fields:
                 if key.name not in temp_obj and key.name != '*':
-                    temp_obj[key.name] = types.Value(None)
+                    temp_obj[key.name] = self.make_value(None)
                 if key.is_required:
                     if key.name not in val:
                         raise MissingKey(path)
             temp_obj = make_keys_safe(temp_obj)
-            cls = attr.make_class('SchemaClass', list(temp_obj.keys()))
+            cls = make_recipe_class(temp_obj.keys())
             return cls(**temp_obj)
 
     def load_one(self, schema, val, path):
@@ -190,6 +302,10 @@ class Phase2:
 
                 raise TypeMismatch(path)
 
+            if self.fold:
+                folded = self.fold_call(val, is_path)
+                if folded is not None:
+                    return folded
             return types.Value(types.Call(val.name, val.args), is_path)
         else:
             result = {
@@ -207,11 +323,33 @@ class Phase2:
 
             return result
 
+    def fold_call(self, call, is_path):
+        """Get the result of a pure call with constant arguments.
+
+        Returns None if the call can't be folded or fails, leaving any
+        error to be raised when the step runs.
+        """
+        func = self.functions[call.name]
+        if not func.pure or not functions.is_constant(call.args):
+            return None
+        try:
+            result = func.impl(call.args,
+                               functions.StaticContext(self.step.path))
+        except Exception:  # pylint: disable=broad-except
+            return None
+        return self.make_value(result, is_path)
+
     @classmethod
-    def load(cls, schema, val, variables=None):
+    def load(cls, schema, val, variables=None, fold=True):
+        """Validate |val| against |schema|.
+
+        If |fold| is true, pure calls with constant arguments are
+        replaced with their results.
+        """
         loader = cls()
         if variables is not None:
             loader.variables = variables
+        loader.fold = fold
         return loader.load_one(schema, val, [])
 
 
@@ -276,8 +414,19 @@ class Semantics:
             return inner
 
 
-MODEL = tatsu.compile(GRAMMAR, semantics=Semantics())
-
 SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
-with open(os.path.join(SCRIPT_DIR, 'schema')) as rfile:
-    SCHEMA = MODEL.parse(rfile.read())
+SCHEMA_PATH = os.path.join(SCRIPT_DIR, 'schema')
+
+
+@functools.lru_cache(maxsize=None)
+def get_model():
+    """Compile the grammar on first use."""
+    import tatsu
+    return tatsu.compile(GRAMMAR, semantics=Semantics())
+
+
+@functools.lru_cache(maxsize=None)
+def get_schema():
+    """Parse the schema on first use."""
+    with open(SCHEMA_PATH) as rfile:
+        return get_model().parse(rfile.read())
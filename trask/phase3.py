@@ -1,23 +1,276 @@
 # TODO: remove this
 # pylint: disable=missing-docstring
 
+import concurrent.futures
+import contextlib
 import os
+import shlex
 import shutil
+import signal
 import subprocess
+import sys
+import tarfile
 import tempfile
+import threading
+import time
+import uuid
 
 import attr
 
-from trask import functions, phase2, types
+from trask import (checkpoint, events, functions, hashindex, logs, phase2,
+                   scheduler, ship, store, types, walk)
+
+
+# Seconds between asking a timed out process group to stop and killing it
+KILL_GRACE = 5
+
+
+class StepTimeout(Exception):
+    pass
+
+
+class TempDirFull(Exception):
+    pass
+
+
+def format_size(size):
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if size < 1024 or unit == 'GiB':
+            break
+        size /= 1024
+    return '{:.1f} {}'.format(size, unit)
+
+
+def tree_size(path):
+    """Get the total size of the files under |path|."""
+    size = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                size += os.lstat(os.path.join(dirpath, name)).st_size
+            except FileNotFoundError:
+                pass
+    return size
+
+
+def kill_process_group(proc):
+    """Stop |proc| and everything it started, which share its group."""
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        try:
+            os.killpg(proc.pid, sig)
+        except ProcessLookupError:
+            return
+        try:
+            proc.wait(KILL_GRACE)
+            return
+        except subprocess.TimeoutExpired:
+            pass
+
+
+def run_process(cmd, timeout=None, log=None, **kwargs):
+    """Run |cmd|, raising CalledProcessError if it fails.
+
+    With a |timeout| the command gets a process group of its own, which
+    is killed if the timeout expires. Returns the output, if captured.
+    If |log| is a logs.StepLog, stderr and any stdout that isn't
+    captured or redirected go to it.
+    """
+    if log is not None:
+        return run_logged(cmd, timeout, log, **kwargs)
+    if timeout is None:
+        with subprocess.Popen(cmd, **kwargs) as proc:
+            output, _ = proc.communicate()
+    else:
+        with subprocess.Popen(cmd, start_new_session=True, **kwargs) as proc:
+            try:
+                output, _ = proc.communicate(timeout=timeout)
+            except BaseException:
+                kill_process_group(proc)
+                raise
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd, output)
+    return output
+
+
+def run_logged(cmd, timeout, log, stdout=None, **kwargs):
+    capture = stdout == subprocess.PIPE
+    if stdout is None:
+        stdout = subprocess.PIPE
+    output = []
+    with subprocess.Popen(
+            cmd,
+            stdout=stdout,
+            stderr=subprocess.PIPE,
+            start_new_session=timeout is not None,
+            **kwargs) as proc:
+        readers = [log.follow(proc.stderr)]
+        if proc.stdout is not None:
+            readers.append(
+                log.follow(proc.stdout, output if capture else None))
+        try:
+            proc.wait(timeout)
+        except BaseException:
+            if timeout is not None:
+                kill_process_group(proc)
+            raise
+        finally:
+            for reader in readers:
+                reader.join()
+    output = b''.join(output) if capture else None
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd, output)
+    return output
+
+
+class Session:
+    """State shared by trask files run together.
+
+    Files in a session share parsed includes, temporary directories,
+    the hash index and ssh connections. Variables are per file except
+    for those exported with the export recipe. Steps with a worker key
+    are sent to |coordinator|'s workers, if given. |limits| are the
+    scheduler slot limits, which also bound how many hosts a step
+    transfers to at once.
+    """
+
+    def __init__(self,
+                 dry_run=True,
+                 hooks=None,
+                 log_dir=None,
+                 coordinator=None,
+                 limits=None):
+        self.dry_run = dry_run
+        self.limits = scheduler.DEFAULT_LIMITS if limits is None else limits
+        self.coordinator = coordinator
+        self.hooks = events.Hooks() if hooks is None else hooks
+        self.logs = None if log_dir is None else logs.LogCapture(log_dir)
+        self.include_cache = {}
+        self.temp_dirs = []
+        # Size limits of temporary directories, and the sizes of those
+        # already deleted
+        self.temp_dir_limits = {}
+        self.temp_dir_sizes = {}
+        self.exports = {}
+        self.memo = {}
+        self.hash_index = None
+        self.ssh_control_dir = None
+        self.lock = threading.Lock()
+
+    def get_hash_index(self):
+        with self.lock:
+            if self.hash_index is None:
+                self.hash_index = hashindex.HashIndex(
+                    hashindex.default_path())
+            return self.hash_index
+
+    def ssh_options(self):
+        """Options that make ssh and scp share one connection per host."""
+        with self.lock:
+            if self.ssh_control_dir is None:
+                self.ssh_control_dir = tempfile.mkdtemp(prefix='trask-ssh-')
+        return [
+            '-o', 'ControlMaster=auto', '-o',
+            'ControlPath=' + os.path.join(self.ssh_control_dir, '%C'), '-o',
+            'ControlPersist=60'
+        ]
+
+    def close(self, keep_temp_dirs=()):
+        """Stop ssh connections, delete temp dirs and save the hash index.
+
+        The directories in |keep_temp_dirs| are kept, so that a
+        checkpointed run can be resumed.
+        """
+        if self.logs is not None:
+            self.logs.close()
+            self.logs = None
+        if self.ssh_control_dir is not None:
+            for name in os.listdir(self.ssh_control_dir):
+                path = os.path.join(self.ssh_control_dir, name)
+                subprocess.call(
+                    ['ssh', '-o', 'ControlPath=' + path, '-O', 'exit', name],
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL)
+            shutil.rmtree(self.ssh_control_dir, ignore_errors=True)
+            self.ssh_control_dir = None
+        for temp_dir in self.temp_dirs:
+            if temp_dir not in keep_temp_dirs:
+                self.temp_dir_sizes[temp_dir] = tree_size(temp_dir)
+                shutil.rmtree(temp_dir, ignore_errors=True)
+        if self.temp_dir_sizes:
+            print(self.temp_dir_summary())
+        del self.temp_dirs[:]
+        if self.hash_index is not None:
+            self.hash_index.prune(self.temp_dir_sizes)
+            self.hash_index.save()
+
+    def temp_dir_summary(self):
+        sizes = self.temp_dir_sizes.values()
+        return ('{} temporary directories used {}, the largest {}'.format(
+            len(sizes), format_size(sum(sizes)), format_size(max(sizes))))
 
 
 class Context:
-    def __init__(self, dry_run=True):
+    def __init__(self, dry_run=True, session=None, timeout=None):
         self.variables = {}
         self.funcs = functions.get_functions()
+        # Results of pure function calls
+        self.memo = {} if session is None else session.memo
         self.dry_run = dry_run
         self.step = None
-        self.temp_dirs = []
+        self.session = session
+        self.coordinator = None if session is None else session.coordinator
+        self.hooks = events.Hooks() if session is None else session.hooks
+        self.logs = None if session is None else session.logs
+        self.limits = (scheduler.DEFAULT_LIMITS
+                       if session is None else session.limits)
+        # Log of the running step, if output is being captured
+        self.log = None
+        # Timeout for steps without one of their own, and when the
+        # current step has to finish by
+        self.timeout = timeout
+        self.deadline = None
+        self.temp_dirs = [] if session is None else session.temp_dirs
+        # The temporary directories created by this file's steps
+        self.file_temp_dirs = []
+        # (SshBatch, index) of the ssh steps batch_ssh planned to run
+        # in one session, by id of the recipe
+        self.ssh_batches = {}
+        self.temp_dir_limits = {} if session is None else (
+            session.temp_dir_limits)
+        self.temp_dir_sizes = {} if session is None else (
+            session.temp_dir_sizes)
+        self.hash_index = None
+
+    def get_hash_index(self):
+        """Get the persistent hash index, loading it on first use."""
+        if self.hash_index is None:
+            if self.session is not None:
+                self.hash_index = self.session.get_hash_index()
+            else:
+                self.hash_index = hashindex.HashIndex(
+                    hashindex.default_path())
+        return self.hash_index
+
+    def ssh_options(self):
+        if self.session is None:
+            return []
+        return self.session.ssh_options()
+
+    def export(self, name):
+        """Make variable |name| visible to later files in the session."""
+        if self.session is not None:
+            with self.session.lock:
+                self.session.exports[name] = self.variables[name]
+
+    def transfer_limit(self):
+        """How many hosts a step may transfer to at once."""
+        return self.limits.get('network')
+
+    def session_lock(self):
+        """Hold this while changing state shared with other files."""
+        if self.session is None:
+            return contextlib.suppress()
+        return self.session.lock
 
     def repath(self, path):
         return os.path.abspath(os.path.join(self.step.path, path))
@@ -26,12 +279,126 @@ class Context:
         return self.variables[var.name]
 
     def call(self, call):
-        return self.funcs[call.name].impl(call.args)
+        func = self.funcs[call.name]
+        if not func.pure or not functions.is_constant(call.args):
+            return func.impl(call.args, self)
+        key = (call.name, tuple(call.args),
+               None if self.step is None else self.step.path)
+        if key not in self.memo:
+            self.memo[key] = func.impl(call.args, self)
+        return self.memo[key]
+
+    def remaining(self):
+        """Seconds left before the current step times out, or None."""
+        if self.deadline is None:
+            return None
+        return max(self.deadline - time.monotonic(), 0)
 
-    def run_cmd(self, *cmd):
-        print(' '.join(cmd))
+    def run_cmd(self, *cmd, stdin=None, stdout=None):
+        """Run |cmd|, optionally redirecting its stdin or stdout to files."""
+        line = ' '.join(cmd)
+        if stdin is not None:
+            line += ' < ' + stdin
+        if stdout is not None:
+            line += ' > ' + stdout
+        self.print_cmd(line)
         if not self.dry_run:
-            subprocess.check_call(cmd)
+            with open_or_none(stdin, 'rb') as rfile, \
+                    open_or_none(stdout, 'wb') as wfile:
+                self.run_process(cmd, stdin=rfile, stdout=wfile)
+
+    def pipe_cmd(self, *cmd, feed):
+        """Run |cmd| with the input that |feed| writes to a binary file.
+
+        |feed| is called on another thread while |cmd| runs, so the
+        input is streamed rather than written to disk first.
+        """
+        self.print_cmd(' '.join(cmd))
+        if self.dry_run:
+            return
+        read_fd, write_fd = os.pipe()
+        errors = []
+
+        def write():
+            try:
+                with open(write_fd, 'wb') as wfile:
+                    feed(wfile)
+            except BrokenPipeError:
+                # |cmd| stopped reading, its exit status says why
+                pass
+            except Exception as err:  # pylint: disable=broad-except
+                errors.append(err)
+
+        thread = threading.Thread(target=write)
+        thread.start()
+        try:
+            with open(read_fd, 'rb') as rfile:
+                self.run_process(cmd, stdin=rfile)
+        finally:
+            thread.join()
+        if errors:
+            raise errors[0]
+
+    def check_output(self, *cmd):
+        """Run |cmd| and return its output, or an empty string if dry."""
+        self.print_cmd(' '.join(cmd))
+        if self.dry_run:
+            return ''
+        return self.run_process(cmd, stdout=subprocess.PIPE).decode()
+
+    def print_cmd(self, line):
+        if self.log is None:
+            print(line)
+        else:
+            self.log.message('$ ' + line)
+
+    def print_message(self, line):
+        """Show a status line that is not a command."""
+        self.write_output((line + '\n').encode())
+
+    def write_output(self, data):
+        """Show output that was captured rather than passed through."""
+        if self.log is None:
+            sys.stdout.write(data.decode(errors='replace'))
+            sys.stdout.flush()
+        else:
+            self.log.write(data)
+
+    def run_process(self, cmd, **kwargs):
+        def run():
+            return run_process(cmd, self.remaining(), self.log, **kwargs)
+
+        return self.observe_command(cmd, run)
+
+    def observe_command(self, cmd, func):
+        """Call |func|, which runs |cmd|, emitting the command events."""
+        if not self.hooks:
+            return func()
+        self.hooks.emit(events.COMMAND_START, cmd=cmd)
+        start = time.perf_counter()
+        exit_code = 'error'
+        try:
+            output = func()
+            exit_code = 0
+            return output
+        except subprocess.CalledProcessError as err:
+            exit_code = err.returncode
+            raise
+        except subprocess.TimeoutExpired:
+            exit_code = 'timeout'
+            raise
+        finally:
+            self.hooks.emit(
+                events.COMMAND_END,
+                cmd=cmd,
+                exit_code=exit_code,
+                seconds=time.perf_counter() - start)
+
+
+def open_or_none(path, mode):
+    if path is None:
+        return contextlib.suppress()
+    return open(path, mode)
 
 
 def docker_install_rust(recipe):
@@ -109,6 +476,12 @@ def handle_docker_build(recipe, ctx):
 def handle_docker_run(recipe, ctx):
     cmd = ['docker', 'run']
     cmd = ['sudo'] + cmd  # TODO
+    name = None
+    if ctx.deadline is not None:
+        # Killing the client doesn't stop the container, so name it to
+        # remove it if the step times out
+        name = 'trask-' + uuid.uuid4().hex
+        cmd += ['--name', name]
     if recipe.init is True:
         cmd.append('--init')
     for volume in recipe.volumes:
@@ -117,16 +490,86 @@ def handle_docker_run(recipe, ctx):
         cmd += ['--volume', '{}:{}:z'.format(host, container)]
     cmd.append(recipe.image)
     cmd += ['sh', '-c', ' && '.join(recipe.commands)]
-    ctx.run_cmd(*cmd)
+    try:
+        ctx.run_cmd(*cmd)
+    except (subprocess.TimeoutExpired, KeyboardInterrupt):
+        if name is not None:
+            remove = ['sudo', 'docker', 'rm', '--force', name]
+            ctx.print_cmd(' '.join(remove))
+            subprocess.call(remove, stdout=subprocess.DEVNULL)
+        raise
 
 
 def handle_create_temp_dir(recipe, ctx):
-    var = recipe.var
-    temp_dir = tempfile.TemporaryDirectory()
-    # TODO, clean these up explicitly
-    ctx.temp_dirs.append(temp_dir)
-    ctx.variables[var] = temp_dir.name
-    print('mkdir', temp_dir.name)
+    size = None
+    if recipe.size is not None:
+        size = phase2.parse_size(recipe.size, ['create-temp-dir', 'size'])
+        parent = recipe.dir or tempfile.gettempdir()
+        free = shutil.disk_usage(parent).free
+        if free < size:
+            raise TempDirFull('{} has {} free, {} needed'.format(
+                parent, format_size(free), format_size(size)))
+    temp_dir = tempfile.mkdtemp(prefix='trask-', dir=recipe.dir)
+    with ctx.session_lock():
+        ctx.temp_dirs.append(temp_dir)
+        if size is not None:
+            ctx.temp_dir_limits[temp_dir] = size
+    ctx.file_temp_dirs.append(temp_dir)
+    ctx.variables[recipe.var] = temp_dir
+    ctx.print_cmd('mkdir ' + temp_dir)
+
+
+def remove_temp_dir(temp_dir, ctx):
+    """Delete |temp_dir| now rather than when the session closes."""
+    with ctx.session_lock():
+        if temp_dir not in ctx.temp_dirs:
+            return
+        ctx.temp_dirs.remove(temp_dir)
+        ctx.temp_dir_limits.pop(temp_dir, None)
+    if temp_dir in ctx.file_temp_dirs:
+        ctx.file_temp_dirs.remove(temp_dir)
+    size = tree_size(temp_dir)
+    with ctx.session_lock():
+        ctx.temp_dir_sizes[temp_dir] = size
+    ctx.print_cmd('rm -r {} ({})'.format(temp_dir, format_size(size)))
+    shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def is_same_file(src, dst, index):
+    if not os.path.isfile(dst):
+        return False
+    if os.path.getsize(src) != os.path.getsize(dst):
+        return False
+    return index.digest(src) == index.digest(dst)
+
+
+def copy_tree(src, dst, index, include=None, exclude=None):
+    """Copy the matching files under |src| into |dst|.
+
+    Files whose destination already has the same contents are skipped.
+    Returns the number of files copied and skipped, and the number of
+    bytes copied.
+    """
+    copied = skipped = size = 0
+    os.makedirs(dst, exist_ok=True)
+    for rel_path, full_path, stat_result in walk.walk(src, include, exclude):
+        target = os.path.join(dst, *rel_path.split('/'))
+        if is_same_file(full_path, target, index):
+            skipped += 1
+        else:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copy2(full_path, target)
+            copied += 1
+            size += stat_result.st_size
+    return copied, skipped, size
+
+
+def emit_cache_stats(ctx, cache, hits, misses, size=None):
+    """Report files skipped as unchanged and files transferred."""
+    ctx.hooks.emit(events.CACHE_HIT, cache=cache, count=hits)
+    ctx.hooks.emit(events.CACHE_MISS, cache=cache, count=misses)
+    if size is not None:
+        ctx.hooks.emit(events.BYTES_COPIED, size=size)
 
 
 def handle_copy(recipe, ctx):
@@ -134,24 +577,246 @@ def handle_copy(recipe, ctx):
     for src in recipe.src:
         if os.path.isdir(src):
             newdir = os.path.join(dst, os.path.basename(src))
-            print('copy', src, newdir)
+            ctx.print_cmd(' '.join(['copy', src, newdir]))
             if not ctx.dry_run:
-                shutil.copytree(src, newdir)
+                index = ctx.get_hash_index()
+                copied, skipped, size = copy_tree(
+                    src, newdir, index, recipe.include, recipe.exclude)
+                ctx.print_message('{} file(s) copied, {} unchanged'.format(
+                    copied, skipped))
+                if ctx.hooks:
+                    emit_cache_stats(ctx, 'copy', skipped, copied, size)
         else:
-            print('copy', src, dst)
+            ctx.print_cmd(' '.join(['copy', src, dst]))
             if not ctx.dry_run:
-                shutil.copy2(src, dst)
+                target = os.path.join(dst, os.path.basename(src))
+                if is_same_file(src, target, ctx.get_hash_index()):
+                    if ctx.hooks:
+                        emit_cache_stats(ctx, 'copy', 1, 0)
+                else:
+                    shutil.copy2(src, dst)
+                    if ctx.hooks:
+                        emit_cache_stats(ctx, 'copy', 0, 1,
+                                         os.path.getsize(src))
 
 
-def handle_upload(recipe, ctx):
-    target = '{}@{}'.format(recipe.user, recipe.host)
+def ssh_target(user, host):
+    return '{}@{}'.format(user, host)
+
+
+def ssh_args(ctx, identity):
+    """Options for ssh and scp: connection sharing and the identity file."""
+    args = ctx.ssh_options()
+    if identity is not None:
+        args += ['-i', identity]
+    return args
+
 
+def ssh_cmd(ctx, identity, target, *command):
+    return ['ssh'] + ssh_args(ctx, identity) + [target] + list(command)
+
+
+def upload_to_store(recipe, ctx, target, manifest):
+    output = ctx.check_output(*ssh_cmd(ctx, recipe.identity, target,
+                                       store.list_blobs_command(recipe.store)))
+    missing = store.missing_entries(manifest, output)
+    ctx.print_message('uploading {} of {} blob(s)'.format(
+        len(missing), len(manifest)))
+    if ctx.hooks:
+        emit_cache_stats(ctx, 'store', len(manifest) - len(missing),
+                         len(missing))
+    with tempfile.TemporaryDirectory() as temp_dir:
+        if missing:
+            blobs_tar = os.path.join(temp_dir, 'blobs.tar')
+            store.write_blob_archive(missing, blobs_tar)
+            if ctx.hooks and not ctx.dry_run:
+                ctx.hooks.emit(
+                    events.BYTES_UPLOADED,
+                    host=target,
+                    size=os.path.getsize(blobs_tar))
+            ctx.run_cmd(
+                *ssh_cmd(ctx, recipe.identity, target, 'tar', '-C',
+                         shlex.quote(store.blobs_dir(recipe.store)), '-xf',
+                         '-'),
+                stdin=blobs_tar)
+        script_path = os.path.join(temp_dir, 'assemble.sh')
+        with open(script_path, 'w') as wfile:
+            wfile.write(
+                store.assemble_script(recipe.store, manifest, recipe.dst))
+            wfile.write(store.gc_script(recipe.store))
+        ctx.run_cmd(*ssh_cmd(ctx, recipe.identity, target, 'sh', '-s'),
+                    stdin=script_path)
+
+
+def upload_hosts(recipe):
+    hosts = []
+    if recipe.host is not None:
+        hosts.append(recipe.host)
+    hosts += recipe.hosts or []
+    if not hosts:
+        raise ValueError('upload requires host or hosts')
+    return hosts
+
+
+def relay_rounds(hosts):
+    """Plan a relay tree for sending to |hosts|.
+
+    Returns a list of rounds, each a list of (source, dest) pairs where
+    a source of None is the local machine. Every machine that has the
+    upload sends it on to one new host per round, so the number of
+    holders doubles each round. Remote holders are used first to spare
+    the local uplink.
+    """
+    holders = [None]
+    remaining = list(hosts)
+    rounds = []
+    while remaining:
+        pairs = []
+        for holder in holders[1:] + holders[:1]:
+            if not remaining:
+                break
+            pairs.append((holder, remaining.pop(0)))
+        holders += [dest for _, dest in pairs]
+        rounds.append(pairs)
+    return rounds
+
+
+def remove_dst(recipe, ctx, target):
     if recipe.replace is True:
-        ctx.run_cmd('ssh', '-i', recipe.identity, target, 'rm', '-fr',
-                    recipe.dst)
+        ctx.run_cmd(*ssh_cmd(ctx, recipe.identity, target, 'rm', '-fr',
+                             recipe.dst))
+
+
+def upload_filtered(recipe, ctx, target, dst):
+    """Upload the matching files under src to |dst| as a tar.
+
+    Like scp -r, the files go into a directory named after src if |dst|
+    is an existing directory, and into |dst| itself otherwise.
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        tar_path = os.path.join(temp_dir, 'upload.tar')
+        if not ctx.dry_run:
+            with tarfile.open(tar_path, 'w') as tar:
+                for rel_path, full_path, _ in walk.walk(
+                        recipe.src, recipe.include, recipe.exclude):
+                    tar.add(full_path, arcname=rel_path)
+        name = shlex.quote(os.path.basename(os.path.normpath(recipe.src)))
+        dst = shlex.quote(dst)
+        ctx.run_cmd(
+            *ssh_cmd(ctx, recipe.identity, target,
+                     'if [ -d {dst} ]; then dir={dst}/{name}; '
+                     'else dir={dst}; fi && '
+                     'mkdir -p "$dir" && tar -C "$dir" -xf -'.format(
+                         dst=dst, name=name)),
+            stdin=tar_path)
+
+
+def upload_size(recipe):
+    """Get the number of bytes that an upload of |recipe.src| sends."""
+    if os.path.isdir(recipe.src):
+        return sum(stat_result.st_size for _, _, stat_result in walk.walk(
+            recipe.src, recipe.include, recipe.exclude))
+    return os.path.getsize(recipe.src)
+
+
+def is_filtered(recipe):
+    has_filters = recipe.include is not None or recipe.exclude is not None
+    return has_filters and os.path.isdir(recipe.src)
+
+
+def upload_direct(recipe, ctx, host, dst=None):
+    """Upload src to |host|, at |dst| instead of the recipe's if given."""
+    target = ssh_target(recipe.user, host)
+    if dst is None:
+        dst = recipe.dst
+        remove_dst(recipe, ctx, target)
+    if is_filtered(recipe):
+        upload_filtered(recipe, ctx, target, dst)
+    else:
+        ctx.run_cmd('scp', *ssh_args(ctx, recipe.identity), '-r', recipe.src,
+                    '{}:{}'.format(target, dst))
+    if ctx.hooks and not ctx.dry_run:
+        ctx.hooks.emit(
+            events.BYTES_UPLOADED, host=target, size=upload_size(recipe))
 
-    ctx.run_cmd('scp', '-i', recipe.identity, '-r', recipe.src, '{}:{}'.format(
-        target, recipe.dst))
+
+def relay_path(recipe, stage):
+    """Get where the upload is kept under the staging directory."""
+    name = os.path.basename(os.path.normpath(recipe.src))
+    return '{}/{}'.format(stage, name)
+
+
+def upload_relay(recipe, ctx, source, dest, stage):
+    """Have |source| copy the staged upload on to |dest|.
+
+    The hop runs on |source| with agent forwarding, so the key must be
+    loaded in ssh-agent and |source| must be able to reach |dest|.
+    """
+    target = ssh_target(recipe.user, dest)
+    if source is None:
+        ctx.run_cmd(*ssh_cmd(ctx, recipe.identity, target, 'mkdir', stage))
+        upload_direct(recipe, ctx, dest, relay_path(recipe, stage))
+        return
+    ctx.run_cmd('ssh', '-A', *ssh_args(ctx, recipe.identity),
+                ssh_target(recipe.user, source), 'scp', '-r', stage,
+                '{}:{}'.format(target, stage))
+
+
+def install_relayed(recipe, ctx, host, stage):
+    """Move the staged upload on |host| to dst like a direct upload."""
+    target = ssh_target(recipe.user, host)
+    remove_dst(recipe, ctx, target)
+    # The staged copy is laid out the same with or without filters, and
+    # cp -r puts it where scp -r would
+    ctx.run_cmd(*ssh_cmd(
+        ctx, recipe.identity, target,
+        'cp -r {src} {dst} && rm -fr {stage}'.format(
+            src=shlex.quote(relay_path(recipe, stage)),
+            dst=shlex.quote(recipe.dst),
+            stage=shlex.quote(stage))))
+
+
+def for_each_concurrently(func, items, limit=None):
+    """Call |func| with the arguments in each of |items| concurrently.
+
+    No more than |limit| calls run at a time, if given.
+    """
+    max_workers = len(items) if limit is None else min(len(items), limit)
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(max_workers, 1)) as executor:
+        futures = [executor.submit(func, *args) for args in items]
+        for future in futures:
+            future.result()
+
+
+def handle_upload(recipe, ctx):
+    hosts = upload_hosts(recipe)
+
+    if recipe.store is not None:
+        if ctx.dry_run and not os.path.exists(recipe.src):
+            manifest = []
+        else:
+            index = ctx.get_hash_index()
+            manifest = store.build_manifest(recipe.src, index,
+                                            recipe.include, recipe.exclude)
+        for_each_concurrently(upload_to_store,
+                              [(recipe, ctx, ssh_target(recipe.user, host),
+                                manifest) for host in hosts],
+                              ctx.transfer_limit())
+    elif len(hosts) == 1:
+        upload_direct(recipe, ctx, hosts[0])
+    else:
+        # Relay a copy in a new directory rather than dst, which may
+        # hold other files, then install it on each host
+        stage = '.trask-upload-' + uuid.uuid4().hex
+        for pairs in relay_rounds(hosts):
+            for_each_concurrently(
+                upload_relay,
+                [(recipe, ctx, source, dest, stage) for source, dest in pairs],
+                ctx.transfer_limit())
+        for_each_concurrently(install_relayed,
+                              [(recipe, ctx, host, stage) for host in hosts],
+                              ctx.transfer_limit())
 
 
 def handle_set(recipe, ctx):
@@ -160,10 +825,258 @@ def handle_set(recipe, ctx):
         ctx.variables[key] = val
 
 
+def handle_export(recipe, ctx):
+    for name in recipe.vars:
+        ctx.export(name)
+
+
 def handle_ssh(recipe, ctx):
-    target = '{}@{}'.format(recipe.user, recipe.host)
+    target = ssh_target(recipe.user, recipe.host)
     command = ' && '.join(recipe.commands)
-    ctx.run_cmd('ssh', '-i', recipe.identity, target, command)
+    cmd = ssh_cmd(ctx, recipe.identity, target, command)
+    batch, index = ctx.ssh_batches.pop(id(recipe), (None, None))
+    if batch is None:
+        ctx.run_cmd(*cmd)
+        return
+    ctx.print_cmd(' '.join(cmd))
+    if batch.start_step(index, ctx):
+        ctx.observe_command(cmd, lambda: batch.finish_step(cmd, ctx))
+    else:
+        # The session ended before this step, run it on its own
+        ctx.run_process(cmd)
+
+
+def can_batch_ssh(step, ctx):
+    # Timeouts and workers apply to single steps
+    return (step.name == 'ssh' and step.timeout is None
+            and ctx.timeout is None
+            and (step.worker is None or ctx.coordinator is None))
+
+
+def resolve_ssh(step, ctx):
+    """Get the target and commands of an ssh step without modifying it."""
+    ctx.step = step
+    recipe = step.recipe
+    target = tuple(
+        resolve_value(val, ctx)
+        for val in (recipe.user, recipe.host, recipe.identity))
+    return target, [resolve_value(val, ctx) for val in recipe.commands]
+
+
+def ssh_script(marker, commands):
+    """Make a script that runs each list in |commands| like an ssh step.
+
+    Before each step the script waits for a line on stdin, so a step
+    only starts on the host once it starts locally, and the script
+    exits if stdin is closed. Each step runs in a subshell, so that one
+    step's cd doesn't affect the next, with stdin from /dev/null. Its
+    output is framed by lines starting with |marker|, the last one
+    giving its exit status, and the script stops at the first step that
+    fails. The script runs in the login shell like a single ssh step,
+    so it avoids names that are special in some shells, e.g. status in
+    zsh.
+    """
+    lines = []
+    for index, step_commands in enumerate(commands):
+        lines += [
+            'read -r trask_go || exit 0',
+            "echo '{} start {}'".format(marker, index), '(',
+            ' && '.join(step_commands), ') </dev/null 2>&1',
+            'trask_status=$?',
+            "printf '\\n{} end {} %d\\n' $trask_status".format(
+                marker, index), '[ $trask_status -eq 0 ] || exit $trask_status'
+        ]
+    return '\n'.join(lines)
+
+
+class SshBatch:
+    """A session running consecutive ssh steps with the same target.
+
+    |cmd| runs ssh_script for |size| steps. The session starts with the
+    first step, and each step's output is copied to that step's output
+    as it arrives, so the steps are timed and logged like single ones.
+    """
+
+    def __init__(self, cmd, marker, size):
+        self.cmd = cmd
+        self.marker = marker.encode()
+        self.size = size
+        self.proc = None
+        self.next_index = 0
+        self.done = False
+        # Last line read, held back in case the step ends after it
+        self.pending = None
+
+    def read_line(self):
+        return self.proc.stdout.readline(logs.MAX_LINE)
+
+    def marker_line(self, line):
+        if line.startswith(self.marker + b' '):
+            return line.split()[1:]
+        return None
+
+    def flush(self, ctx, strip=False):
+        if self.pending is not None:
+            ctx.write_output(self.pending[:-1] if strip else self.pending)
+            self.pending = None
+
+    def start_step(self, index, ctx):
+        """Start step |index|, returning False if the session can't run it.
+
+        Output before the step's start marker, e.g. ssh warnings, goes
+        to the step.
+        """
+        if self.done or index != self.next_index:
+            return False
+        try:
+            if self.proc is None:
+                self.proc = subprocess.Popen(
+                    self.cmd,
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT)
+            try:
+                self.proc.stdin.write(b'\n')
+                self.proc.stdin.flush()
+            except BrokenPipeError:
+                pass
+            for line in iter(self.read_line, b''):
+                words = self.marker_line(line)
+                if words is not None and words[0] == b'start':
+                    self.flush(ctx)
+                    return True
+                self.flush(ctx)
+                self.pending = line
+        except BaseException:
+            self.close(kill=True)
+            raise
+        self.flush(ctx)
+        self.close()
+        return False
+
+    def finish_step(self, cmd, ctx):
+        """Copy the started step's output, raising if it fails.
+
+        |cmd| is the ssh command the step would run on its own. If the
+        session ends before the step does, the step fails rather than
+        running again, since its commands may have had effects.
+        """
+        status = None
+        try:
+            for line in iter(self.read_line, b''):
+                words = self.marker_line(line)
+                if words is not None and words[0] == b'end':
+                    # Drop the newline the script adds before the marker
+                    self.flush(ctx, strip=True)
+                    status = int(words[2])
+                    break
+                self.flush(ctx)
+                self.pending = line
+        except BaseException:
+            self.close(kill=True)
+            raise
+        if status is None:
+            self.flush(ctx)
+            self.close()
+            # ssh exits with 255 when the connection fails
+            status = self.proc.returncode or 255
+        else:
+            self.next_index += 1
+            if status != 0 or self.next_index == self.size:
+                self.close()
+        if status != 0:
+            raise subprocess.CalledProcessError(status, cmd)
+
+    def close(self, kill=False):
+        """End the session, letting the script exit before its next step."""
+        if self.done:
+            return
+        self.done = True
+        if self.proc is None:
+            return
+        if kill:
+            self.proc.kill()
+        try:
+            self.proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        self.proc.wait()
+        self.proc.stdout.close()
+
+
+def batch_ssh(steps, start, ctx):
+    """Plan to run the ssh steps from |start| on that share a target at once.
+
+    Consecutive ssh steps with the same user, host and identity run as
+    one script in a single ssh session, instead of a connection and
+    shell each, see SshBatch. Steps the session doesn't reach, e.g.
+    because ssh couldn't connect, run on their own.
+    """
+    if (ctx.dry_run or not can_batch_ssh(steps[start], ctx)
+            or id(steps[start].recipe) in ctx.ssh_batches):
+        return
+    target = None
+    batch = []
+    for step in steps[start:]:
+        if not can_batch_ssh(step, ctx):
+            break
+        try:
+            step_target, commands = resolve_ssh(step, ctx)
+        except Exception:  # pylint: disable=broad-except
+            # Let the step raise the error when it runs
+            break
+        if target is not None and step_target != target:
+            break
+        target = step_target
+        batch.append((step, commands))
+    if len(batch) < 2:
+        return
+
+    user, host, identity = target
+    marker = 'trask-' + uuid.uuid4().hex
+    cmd = ssh_cmd(ctx, identity, ssh_target(user, host),
+                  ssh_script(marker, [commands for _, commands in batch]))
+    session = SshBatch(cmd, marker, len(batch))
+    for index, (step, _) in enumerate(batch):
+        ctx.ssh_batches[id(step.recipe)] = (session, index)
+
+
+def close_ssh_batches(ctx):
+    for batch, _ in ctx.ssh_batches.values():
+        batch.close()
+    ctx.ssh_batches.clear()
+
+
+def ship_to_host(recipe, ctx, host, image_tar):
+    target = ssh_target(recipe.user, host)
+    sudo = ['sudo'] if recipe.sudo is True else []
+    output = ctx.check_output(*ssh_cmd(ctx, recipe.identity, target,
+                                       ship.list_layers_command(sudo)))
+    skip = set()
+    if not ctx.dry_run:
+        manifest, configs = ship.read_manifest(image_tar)
+        skip = ship.skippable_files(manifest, configs,
+                                    ship.parse_layers(output))
+        ctx.print_message('{}: skipping {} existing layer(s)'.format(
+            host, len(skip)))
+    ctx.pipe_cmd(
+        *ssh_cmd(ctx, recipe.identity, target, *(sudo + ['docker', 'load'])),
+        feed=lambda wfile: ship.write_image(image_tar, wfile, skip))
+
+
+def handle_docker_ship(recipe, ctx):
+    # The image is saved once since its manifest comes last in the
+    # archive, then streamed to each host without the layers it has
+    with tempfile.TemporaryDirectory() as temp_dir:
+        image_tar = os.path.join(temp_dir, 'image.tar')
+        sudo = ['sudo'] if recipe.sudo is True else []
+        ctx.run_cmd(*(sudo + ['docker', 'save', recipe.image]),
+                    stdout=image_tar)
+
+        for_each_concurrently(
+            ship_to_host,
+            [(recipe, ctx, host, image_tar) for host in recipe.hosts],
+            ctx.transfer_limit())
 
 
 def resolve_value(val, ctx):
@@ -202,9 +1115,51 @@ def resolve(val, ctx):
         return val
 
 
+def variable_names(val):
+    """Get the names of the variables that |val| refers to."""
+    if isinstance(val, types.Value):
+        return variable_names(val.data)
+    elif isinstance(val, types.Var):
+        return {val.name}
+    elif isinstance(val, types.Call):
+        return variable_names(list(val.args))
+    elif isinstance(val, list):
+        return set().union(*(variable_names(elem) for elem in val))
+    elif attr.has(val.__class__):
+        return variable_names(
+            list(attr.asdict(val, recurse=False).values()))
+    return set()
+
+
 def resolve_step(step, ctx):
     recipe = resolve(step.recipe, ctx)
-    return types.Step(step.name, recipe, step.path)
+    return types.Step(step.name, recipe, step.path, step.label,
+                      step.timeout, step.worker)
+
+
+def step_hosts(step, ctx):
+    """Get the hosts that a step connects to, resolving variables."""
+    recipe = step.recipe
+    if step.name == 'ssh':
+        values = [recipe.host]
+    elif step.name == 'upload':
+        values = [recipe.host] + list(recipe.hosts or [])
+    elif step.name == 'docker-ship':
+        values = list(recipe.hosts)
+    else:
+        return []
+    return [resolve_value(val, ctx) for val in values if val is not None]
+
+
+def step_resources(step, ctx):
+    """Get the resource classes a step needs a slot in while it runs.
+
+    Called before the step runs, with the variables it uses bound.
+    """
+    if step.worker is not None and ctx.coordinator is not None:
+        return ()
+    return RESOURCE_CLASSES[step.name] + tuple(
+        'host:' + host for host in step_hosts(step, ctx))
 
 
 HANDLERS = {
@@ -212,14 +1167,184 @@ HANDLERS = {
     'create-temp-dir': handle_create_temp_dir,
     'docker-build': handle_docker_build,
     'docker-run': handle_docker_run,
+    'docker-ship': handle_docker_ship,
+    'export': handle_export,
     'set': handle_set,
     'ssh': handle_ssh,
     'upload': handle_upload,
 }
 
 
-def run(steps, ctx):
-    for step in steps:
-        rstep = resolve_step(step, ctx)
-        ctx.step = rstep
-        HANDLERS[rstep.name](rstep.recipe, ctx)
+# What each recipe uses most, for limiting how many run concurrently
+RESOURCE_CLASSES = {
+    'copy': ('cpu', ),
+    'create-temp-dir': (),
+    'docker-build': ('cpu', 'docker'),
+    'docker-run': ('cpu', 'docker'),
+    'docker-ship': ('docker', 'network'),
+    'export': (),
+    'set': (),
+    'ssh': ('network', ),
+    'upload': ('network', ),
+}
+
+# Rough relative durations, for finding the critical path
+COSTS = {
+    'copy': 2,
+    'create-temp-dir': 0,
+    'docker-build': 20,
+    'docker-run': 10,
+    'docker-ship': 10,
+    'export': 0,
+    'set': 0,
+    'ssh': 3,
+    'upload': 5,
+}
+
+
+def run_step(step, ctx):
+    if ctx.logs is None:
+        run_observed(step, ctx)
+        return
+    with ctx.logs.capture(step) as log:
+        ctx.log = log
+        try:
+            run_observed(step, ctx)
+        finally:
+            ctx.log = None
+
+
+def run_observed(step, ctx):
+    if not ctx.hooks:
+        run_handler(step, ctx)
+        return
+    ctx.hooks.emit(events.STEP_START, step=step)
+    start = time.perf_counter()
+    error = None
+    try:
+        run_handler(step, ctx)
+    except BaseException as err:
+        error = err
+        raise
+    finally:
+        ctx.hooks.emit(
+            events.STEP_END,
+            step=step,
+            seconds=time.perf_counter() - start,
+            error=error)
+
+
+def run_handler(step, ctx):
+    # Set the step first so that its paths are relative to its own file
+    ctx.step = step
+    rstep = resolve_step(step, ctx)
+    ctx.step = rstep
+    timeout = ctx.timeout if step.timeout is None else step.timeout
+    if step.worker is not None and ctx.coordinator is not None:
+        ctx.coordinator.run(rstep, ctx, timeout)
+    else:
+        call_handler(rstep, ctx, timeout)
+
+
+def call_handler(step, ctx, timeout=None):
+    """Run the handler of a resolved step, within |timeout| seconds."""
+    if timeout is not None:
+        ctx.deadline = time.monotonic() + timeout
+    try:
+        HANDLERS[step.name](step.recipe, ctx)
+    except subprocess.TimeoutExpired:
+        name = step.name if step.label is None else '{} ({})'.format(
+            step.name, step.label)
+        raise StepTimeout('{} step timed out after {:g} seconds'.format(
+            name, timeout)) from None
+    finally:
+        ctx.deadline = None
+
+
+class TempDirCleanup:
+    """Delete temporary directories once no later step uses them.
+
+    Directories with a size limit are checked after each step that
+    uses them. Directories whose variables are exported are left for
+    Session.close since later files may use them.
+
+    Make this before running |steps|, resolving them loses the names
+    of the variables they use.
+    """
+
+    def __init__(self, steps):
+        temp_vars = set()
+        exported = set()
+        # id(step) -> create-temp-dir variables the step uses
+        self.uses = {}
+        last_use = {}
+        for step in steps:
+            if step.name == 'create-temp-dir':
+                temp_vars.add(step.recipe.var.data)
+            elif step.name == 'export':
+                exported.update(name.data for name in step.recipe.vars)
+            names = variable_names(step.recipe) & temp_vars
+            if step.name == 'create-temp-dir':
+                names.add(step.recipe.var.data)
+            self.uses[id(step)] = names
+            for name in names:
+                last_use[name] = id(step)
+        # id(step) -> variables of the directories to delete after it
+        self.last_uses = {}
+        for name, step_id in last_use.items():
+            if name not in exported:
+                self.last_uses.setdefault(step_id, set()).add(name)
+
+    def step_done(self, step, ctx):
+        for name in self.uses.get(id(step), ()):
+            temp_dir = ctx.variables.get(name)
+            limit = ctx.temp_dir_limits.get(temp_dir)
+            if limit is not None:
+                size = tree_size(temp_dir)
+                if size > limit:
+                    raise TempDirFull('{} uses {}, over its {} limit'.format(
+                        temp_dir, format_size(size), format_size(limit)))
+        for name in self.last_uses.get(id(step), ()):
+            temp_dir = ctx.variables.get(name)
+            if temp_dir is not None:
+                remove_temp_dir(temp_dir, ctx)
+
+
+def pending_steps(steps, ctx, progress=None):
+    """Get (step, hash) pairs for the steps that still have to run.
+
+    |progress| is a checkpoint.Checkpoint or None. Steps already
+    recorded in it are skipped, except for exports which are run now
+    since they are cheap and needed by later files. The hash is None
+    without a checkpoint.
+    """
+    if progress is None:
+        return [(step, None) for step in steps]
+
+    # Hash before running, resolving modifies the steps
+    hashes = [checkpoint.step_hash(step) for step in steps]
+    start = progress.restore(hashes, ctx)
+    for step in steps[:start]:
+        if step.name == 'export':
+            run_step(step, ctx)
+    return list(zip(steps[start:], hashes[start:]))
+
+
+def run(steps, ctx, progress=None):
+    """Run |steps|, recording each one that succeeds in |progress|."""
+    cleanup = TempDirCleanup(steps)
+    pending = pending_steps(steps, ctx, progress)
+    order = [step for step, _ in pending]
+    try:
+        for index, (step, step_hash) in enumerate(pending):
+            batch_ssh(order, index, ctx)
+            run_step(step, ctx)
+            cleanup.step_done(step, ctx)
+            if progress is not None:
+                progress.record(step_hash, ctx)
+    finally:
+        close_ssh_batches(ctx)
+        # A session saves its own index when it closes
+        if ctx.session is None and ctx.hash_index is not None:
+            ctx.hash_index.prune(ctx.temp_dir_sizes)
+            ctx.hash_index.save()
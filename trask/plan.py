@@ -0,0 +1,157 @@
+# TODO: remove this
+# pylint: disable=missing-docstring
+
+import functools
+import hashlib
+import marshal
+
+import attr
+
+from trask import phase2, types
+
+MAGIC = b'TRASKPLAN'
+VERSION = 5
+
+# Tags for the encoded form
+VALUE = 0
+LIST = 1
+OBJECT = 2
+VAR = 3
+CALL = 4
+
+
+class PlanError(ValueError):
+    pass
+
+
+class StalePlan(PlanError):
+    pass
+
+
+@functools.lru_cache(maxsize=None)
+def schema_hash():
+    """Hash of the schema, plans built against another schema are stale."""
+    with open(phase2.SCHEMA_PATH, 'rb') as rfile:
+        return hashlib.sha256(rfile.read()).digest()
+
+
+def header():
+    return MAGIC + bytes([VERSION, marshal.version]) + schema_hash()
+
+
+def encode_data(data):
+    """Encode the contents of a Value or an unvalidated call argument."""
+    if isinstance(data, types.Var):
+        choices = None if data.choices is None else tuple(data.choices)
+        return (VAR, data.name, choices)
+    elif isinstance(data, types.Call):
+        return (CALL, data.name, tuple(encode_data(arg) for arg in data.args))
+    elif isinstance(data, list):
+        return (LIST, tuple(encode_data(elem) for elem in data))
+    return data
+
+
+def encode(val):
+    if isinstance(val, types.Value):
+        return (VALUE, encode_data(val.data), val.is_path)
+    elif isinstance(val, list):
+        return (LIST, tuple(encode(elem) for elem in val))
+    fields = attr.fields(val.__class__)
+    return (OBJECT, tuple(field.name for field in fields),
+            tuple(encode(getattr(val, field.name)) for field in fields))
+
+
+def encode_step(step):
+    return (step.name, step.path, step.label, step.timeout, step.worker,
+            encode(step.recipe))
+
+
+class Decoder:
+    def __init__(self):
+        self.values = {}
+
+    def decode_data(self, data):
+        if isinstance(data, tuple):
+            if data[0] == VAR:
+                choices = None if data[2] is None else list(data[2])
+                return types.Var(data[1], choices=choices)
+            elif data[0] == CALL:
+                return types.Call(data[1],
+                                  [self.decode_data(arg) for arg in data[2]])
+            elif data[0] == LIST:
+                return [self.decode_data(elem) for elem in data[1]]
+            raise PlanError('invalid data tag')
+        return data
+
+    def decode(self, val):
+        tag = val[0]
+        if tag == VALUE:
+            data, is_path = val[1], val[2]
+            if isinstance(data, tuple):
+                return types.Value(self.decode_data(data), is_path)
+            key = (type(data), data, is_path)
+            if key not in self.values:
+                self.values[key] = types.Value(data, is_path)
+            return self.values[key]
+        elif tag == LIST:
+            return [self.decode(elem) for elem in val[1]]
+        elif tag == OBJECT:
+            cls = phase2.make_recipe_class(val[1])
+            return cls(*(self.decode(field) for field in val[2]))
+        raise PlanError('invalid value tag')
+
+    def decode_step(self, step):
+        name, path, label, timeout, worker, recipe = step
+        return types.Step(name, self.decode(recipe), path, label, timeout,
+                          worker)
+
+
+def exported_names(steps):
+    return [
+        name.data for step in steps if step.name == 'export'
+        for name in step.recipe.vars
+    ]
+
+
+def dumps(steps, variables=None):
+    """Serialize validated steps from Phase2.load.
+
+    |variables| maps the variables the steps bind to their kinds, as
+    filled in by Phase2.load. The kinds of the exported ones are kept
+    so that later files in a session can be validated against them.
+    """
+    variables = variables or {}
+    exports = {
+        name: variables.get(name, types.Kind.Any)
+        for name in exported_names(steps)
+    }
+    return header() + marshal.dumps(
+        (tuple(encode_step(step) for step in steps), exports))
+
+
+def loads(data, variables=None):
+    """Deserialize a plan, adding the kinds of its exports to |variables|."""
+    if not data.startswith(MAGIC):
+        raise PlanError('not a trask plan')
+    if not data.startswith(header()):
+        raise StalePlan('plan was compiled by a different trask version')
+    steps, exports = marshal.loads(data[len(header()):])
+    if variables is not None:
+        variables.update(exports)
+    decoder = Decoder()
+    return [decoder.decode_step(step) for step in steps]
+
+
+def dump(steps, path, variables=None):
+    with open(path, 'wb') as wfile:
+        wfile.write(dumps(steps, variables))
+
+
+def load(path, variables=None):
+    with open(path, 'rb') as rfile:
+        return loads(rfile.read(), variables)
+
+
+def is_plan(path):
+    with open(path, 'rb') as rfile:
+        return rfile.read(len(MAGIC)) == MAGIC
@@ -0,0 +1,76 @@
+# TODO: remove this
+# pylint: disable=missing-docstring
+
+import contextlib
+import cProfile
+import os
+import sys
+import time
+import tracemalloc
+
+from trask import phase3
+
+# Number of allocation sites listed in each report
+TOP_ALLOCATIONS = 25
+
+
+class Profiler:
+    """Profile each phase of a run with cProfile and tracemalloc.
+
+    For each phase |output_dir| gets <phase>.pstats, readable with the
+    pstats module or snakeviz, and <phase>-alloc.txt listing the peak
+    memory and the lines that allocated the most memory still in use
+    at the end of the phase. If a phase is entered more than once, e.g.
+    once per file, the times and profiles add up and the allocations
+    are those of the last time.
+    """
+
+    def __init__(self, output_dir, top=TOP_ALLOCATIONS):
+        self.output_dir = output_dir
+        self.top = top
+        self.profiles = {}
+        self.seconds = {}
+        self.peaks = {}
+        self.snapshots = {}
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        profile = self.profiles.setdefault(name, cProfile.Profile())
+        tracemalloc.start()
+        start = time.perf_counter()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            self.seconds[name] = self.seconds.get(
+                name, 0) + time.perf_counter() - start
+            self.peaks[name] = max(
+                self.peaks.get(name, 0),
+                tracemalloc.get_traced_memory()[1])
+            self.snapshots[name] = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+
+    def allocation_report(self, name):
+        stats = self.snapshots[name].statistics('lineno')
+        lines = [
+            'peak: ' + phase3.format_size(self.peaks[name]),
+            'in use at the end: ' + phase3.format_size(
+                sum(stat.size for stat in stats)), ''
+        ]
+        lines += [str(stat) for stat in stats[:self.top]]
+        return '\n'.join(lines) + '\n'
+
+    def write(self, out=sys.stderr):
+        """Write the profiles and reports, and print a summary to |out|."""
+        os.makedirs(self.output_dir, exist_ok=True)
+        for name, profile in self.profiles.items():
+            base = os.path.join(self.output_dir, name)
+            profile.dump_stats(base + '.pstats')
+            with open(base + '-alloc.txt', 'w') as wfile:
+                wfile.write(self.allocation_report(name))
+            peak = phase3.format_size(self.peaks[name])
+            print(
+                '{}: {:.3f}s, peak {}'.format(name, self.seconds[name], peak),
+                file=out)
+        print('profiles written to ' + self.output_dir, file=out)
@@ -0,0 +1,396 @@
+# TODO: remove this
+# pylint: disable=missing-docstring
+
+import base64
+import hashlib
+import hmac
+import itertools
+import json
+import os
+import socket
+import threading
+import time
+
+import attr
+
+from trask import logs, phase2, phase3, types
+
+# Seconds a step waits for a worker with its capability to connect
+WORKER_WAIT = 30
+
+# Seconds between a worker's attempts to reach the coordinator
+RETRY_INTERVAL = 5
+
+# Environment variable holding the secret shared by a coordinator and
+# its workers
+TOKEN_ENV = 'TRASK_TOKEN'
+
+
+class NoWorker(Exception):
+    pass
+
+
+class RemoteStepError(Exception):
+    pass
+
+
+class AuthenticationError(Exception):
+    pass
+
+
+def get_token():
+    """Get the shared secret from the environment."""
+    token = os.environ.get(TOKEN_ENV)
+    if not token:
+        raise AuthenticationError(
+            '{} must be set to a secret shared with the coordinator '
+            'and workers'.format(TOKEN_ENV))
+    return token
+
+
+def make_nonce():
+    return base64.b64encode(os.urandom(16)).decode()
+
+
+def sign(token, role, nonce):
+    """Prove knowledge of |token| to the peer that sent |nonce|."""
+    message = '{}:{}'.format(role, nonce).encode()
+    return hmac.new(token.encode(), message, hashlib.sha256).hexdigest()
+
+
+def check_proof(token, role, nonce, message):
+    proof = message.get('proof') if message is not None else None
+    return isinstance(proof, str) and hmac.compare_digest(
+        proof, sign(token, role, nonce))
+
+
+def parse_address(address, default_host='localhost'):
+    """Get the socket family and address for unix:PATH or HOST:PORT.
+
+    |default_host| is used if HOST is empty. The coordinator passes ''
+    so that it listens on all interfaces.
+    """
+    if address.startswith('unix:'):
+        return socket.AF_UNIX, address[len('unix:'):]
+    host, sep, port = address.rpartition(':')
+    if not sep or not port.isdigit():
+        raise ValueError('invalid address: ' + address)
+    return socket.AF_INET, (host or default_host, int(port))
+
+
+def encode(val):
+    """Encode a resolved recipe as JSON-compatible data."""
+    if attr.has(type(val)):
+        return {
+            key: encode(elem)
+            for key, elem in attr.asdict(val, recurse=False).items()
+        }
+    elif isinstance(val, list):
+        return [encode(elem) for elem in val]
+    return val
+
+
+def decode(val):
+    if isinstance(val, dict):
+        fields = {key: decode(elem) for key, elem in val.items()}
+        return phase2.make_recipe_class(fields.keys())(**fields)
+    elif isinstance(val, list):
+        return [decode(elem) for elem in val]
+    return val
+
+
+class Connection:
+    """Newline-delimited JSON messages over a socket."""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.rfile = sock.makefile('rb')
+        self.lock = threading.Lock()
+
+    def send(self, **message):
+        data = (json.dumps(message) + '\n').encode()
+        with self.lock:
+            self.sock.sendall(data)
+
+    def messages(self):
+        """Yield messages until the other end closes the connection."""
+        try:
+            for line in self.rfile:
+                yield json.loads(line.decode())
+        except OSError:
+            return
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+class RemoteLog(logs.StepLog):
+    """Sends the output of a step run by a worker to the coordinator."""
+
+    # pylint: disable=super-init-not-called
+    def __init__(self, conn, job_id):
+        self.conn = conn
+        self.job_id = job_id
+
+    def write(self, data):
+        self.conn.send(
+            type='output',
+            id=self.job_id,
+            data=base64.b64encode(data).decode())
+
+    def close(self):
+        pass
+
+
+class Job:
+    def __init__(self, job_id, ctx):
+        self.job_id = job_id
+        self.ctx = ctx
+        self.error = None
+        self.done = threading.Event()
+
+    def output(self, data):
+        self.ctx.write_output(data)
+
+    def finish(self, error):
+        self.error = error
+        self.done.set()
+
+
+@attr.s(cmp=False)
+class RemoteWorker:
+    name = attr.ib()
+    capabilities = attr.ib()
+    conn = attr.ib()
+    job = attr.ib(default=None)
+
+
+class Coordinator:
+    """Sends steps to the workers that connect to |address|.
+
+    The coordinator and its workers prove to each other that they know
+    |token| before any step is sent, since steps carry resolved values
+    and run commands. The token itself is never sent. Each worker runs
+    one step at a time. A step goes to an idle worker
+    that has the capability named by the step's worker key, waiting
+    for one if they are all busy, or up to |wait| seconds for one to
+    connect if there are none.
+    """
+
+    def __init__(self, address, token, wait=WORKER_WAIT):
+        self.token = token
+        self.wait = wait
+        family, addr = parse_address(address, default_host='')
+        self.server = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_UNIX:
+            if os.path.exists(addr):
+                os.unlink(addr)
+        else:
+            self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR,
+                                   1)
+        self.server.bind(addr)
+        self.server.listen()
+        self.workers = []
+        self.job_ids = itertools.count(1)
+        self.cond = threading.Condition()
+        threading.Thread(target=self.accept_loop, daemon=True).start()
+
+    @property
+    def address(self):
+        addr = self.server.getsockname()
+        if self.server.family == socket.AF_UNIX:
+            return 'unix:' + addr
+        return '{}:{}'.format(*addr)
+
+    def accept_loop(self):
+        while True:
+            try:
+                sock, _ = self.server.accept()
+            except OSError:
+                return
+            threading.Thread(
+                target=self.serve, args=(Connection(sock), ),
+                daemon=True).start()
+
+    def serve(self, conn):
+        messages = conn.messages()
+        nonce = make_nonce()
+        try:
+            conn.send(type='challenge', nonce=nonce)
+        except OSError:
+            conn.close()
+            return
+        hello = next(messages, None)
+        if (hello is None or hello.get('type') != 'hello'
+                or not check_proof(self.token, 'worker', nonce, hello)):
+            conn.close()
+            return
+        try:
+            conn.send(
+                type='welcome',
+                proof=sign(self.token, 'coordinator', hello['nonce']))
+        except OSError:
+            conn.close()
+            return
+        worker = RemoteWorker(hello['name'], set(hello['capabilities']),
+                              conn)
+        with self.cond:
+            self.workers.append(worker)
+            self.cond.notify_all()
+        for message in messages:
+            job = worker.job
+            if job is None or message.get('id') != job.job_id:
+                continue
+            if message['type'] == 'output':
+                job.output(base64.b64decode(message['data']))
+            elif message['type'] == 'result':
+                with self.cond:
+                    worker.job = None
+                    self.cond.notify_all()
+                job.finish(message['error'])
+        with self.cond:
+            self.workers.remove(worker)
+            job = worker.job
+            self.cond.notify_all()
+        if job is not None:
+            job.finish('worker disconnected')
+
+    def acquire(self, capability, job):
+        """Give |job| to an idle worker with |capability|."""
+        deadline = time.monotonic() + self.wait
+        with self.cond:
+            while True:
+                capable = [
+                    worker for worker in self.workers
+                    if capability in worker.capabilities
+                ]
+                for worker in capable:
+                    if worker.job is None:
+                        worker.job = job
+                        return worker
+                remaining = deadline - time.monotonic()
+                if not capable and remaining <= 0:
+                    raise NoWorker('no worker can run ' + capability)
+                self.cond.wait(remaining if not capable else None)
+
+    def run(self, step, ctx, timeout=None):
+        """Run resolved |step| on a worker, raising if it fails there."""
+        job = Job(next(self.job_ids), ctx)
+        worker = self.acquire(step.worker, job)
+        try:
+            worker.conn.send(
+                type='run',
+                id=job.job_id,
+                name=step.name,
+                path=step.path,
+                label=step.label,
+                timeout=timeout,
+                dry_run=ctx.dry_run,
+                recipe=encode(step.recipe))
+        except OSError as err:
+            job.finish(str(err))
+        job.done.wait()
+        if job.error is not None:
+            raise RemoteStepError('{} step failed on {}: {}'.format(
+                step.name, worker.name, job.error))
+
+    def close(self):
+        self.server.close()
+        with self.cond:
+            workers = list(self.workers)
+        for worker in workers:
+            worker.conn.close()
+        if self.server.family == socket.AF_UNIX:
+            try:
+                os.unlink(self.server.getsockname())
+            except OSError:
+                pass
+
+
+class Worker:
+    """An agent that runs the steps a coordinator sends it.
+
+    Paths in the steps are the coordinator's, so a worker needs the
+    same files at the same paths, e.g. a shared checkout.
+    """
+
+    def __init__(self, address, token, capabilities=(), name=None):
+        self.address = address
+        self.token = token
+        self.capabilities = list(capabilities)
+        self.name = name or socket.gethostname()
+
+    def connect(self):
+        family, addr = parse_address(self.address)
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        try:
+            sock.connect(addr)
+        except OSError:
+            sock.close()
+            raise
+        return Connection(sock)
+
+    def serve(self, conn):
+        """Run steps from |conn| until the coordinator goes away.
+
+        Raises AuthenticationError if the coordinator doesn't know the
+        token.
+        """
+        messages = conn.messages()
+        challenge = next(messages, None)
+        if challenge is None or challenge.get('type') != 'challenge':
+            conn.close()
+            raise AuthenticationError('no challenge from coordinator')
+        nonce = make_nonce()
+        conn.send(
+            type='hello',
+            name=self.name,
+            capabilities=self.capabilities,
+            nonce=nonce,
+            proof=sign(self.token, 'worker', challenge['nonce']))
+        welcome = next(messages, None)
+        if not check_proof(self.token, 'coordinator', nonce, welcome):
+            conn.close()
+            raise AuthenticationError(
+                'coordinator at {} failed to authenticate'.format(
+                    self.address))
+        for message in messages:
+            if message['type'] == 'run':
+                self.run_step(conn, message)
+        conn.close()
+
+    def run_step(self, conn, message):
+        step = types.Step(message['name'], decode(message['recipe']),
+                          message['path'], message['label'])
+        ctx = phase3.Context(dry_run=message['dry_run'])
+        ctx.step = step
+        ctx.log = RemoteLog(conn, message['id'])
+        error = None
+        try:
+            phase3.call_handler(step, ctx, message['timeout'])
+        except Exception as err:  # pylint: disable=broad-except
+            error = '{}: {}'.format(type(err).__name__, err)
+        if ctx.hash_index is not None:
+            ctx.hash_index.save()
+        conn.send(type='result', id=message['id'], error=error)
+
+    def run_forever(self, interval=RETRY_INTERVAL):
+        """Serve coordinators as they come and go."""
+        while True:
+            try:
+                conn = self.connect()
+            except OSError:
+                time.sleep(interval)
+                continue
+            print('connected to ' + self.address)
+            try:
+                self.serve(conn)
+            except AuthenticationError as err:
+                print(err)
+                time.sleep(interval)
+                continue
+            print('disconnected from ' + self.address)
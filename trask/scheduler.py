@@ -0,0 +1,172 @@
+# TODO: remove this
+# pylint: disable=missing-docstring
+
+import collections
+import concurrent.futures
+import json
+import os
+
+import attr
+
+# Slots per resource class. "host" is the limit for each host, e.g.
+# to stay under sshd's MaxStartups.
+DEFAULT_LIMITS = {
+    'cpu': os.cpu_count() or 1,
+    'docker': 2,
+    'network': 8,
+    'host': 4,
+}
+
+
+def default_config_path():
+    config_dir = os.environ.get('XDG_CONFIG_HOME') or os.path.join(
+        os.path.expanduser('~'), '.config')
+    return os.path.join(config_dir, 'trask', 'limits.json')
+
+
+def parse_limit(text):
+    """Parse a limit like cpu=4 into a (class, slots) pair."""
+    name, sep, slots = text.partition('=')
+    if not sep or not name or not slots.isdigit() or int(slots) < 1:
+        raise ValueError('invalid limit: ' + text)
+    return name, int(slots)
+
+
+def load_limits(path=None, overrides=()):
+    """Get the slot limits.
+
+    The defaults are updated from the JSON object in |path|, which
+    defaults to ~/.config/trask/limits.json, and then by the (class,
+    slots) pairs in |overrides|.
+    """
+    limits = dict(DEFAULT_LIMITS)
+    path = path or default_config_path()
+    if os.path.exists(path):
+        with open(path) as rfile:
+            for name, slots in json.load(rfile).items():
+                limits.update([parse_limit('{}={}'.format(name, slots))])
+    limits.update(overrides)
+    return limits
+
+
+@attr.s(cmp=False)
+class Task:
+    """A function to run after the tasks in |deps|.
+
+    |resources| is called once the task is ready and returns the
+    resource classes it needs a slot in while it runs. |cost| is a
+    rough relative duration used to find the critical path.
+    """
+    name = attr.ib()
+    func = attr.ib()
+    deps = attr.ib(factory=list)
+    resources = attr.ib(default=None)
+    cost = attr.ib(default=1)
+
+
+class Slots:
+    def __init__(self, limits):
+        self.limits = limits
+        self.used = collections.Counter()
+
+    def limit(self, name):
+        if name.startswith('host:'):
+            return self.limits.get('host')
+        return self.limits.get(name)
+
+    def available(self, names):
+        for name in names:
+            limit = self.limit(name)
+            if limit is not None and self.used[name] >= limit:
+                return False
+        return True
+
+    def take(self, names):
+        self.used.update(names)
+
+    def release(self, names):
+        self.used.subtract(names)
+
+
+def get_dependents(tasks):
+    dependents = collections.defaultdict(list)
+    for task in tasks:
+        for dep in task.deps:
+            dependents[dep].append(task)
+    return dependents
+
+
+def priorities(tasks):
+    """Get the cost of the longest path from each task to the end."""
+    dependents = get_dependents(tasks)
+    result = {}
+    # Tasks come after their deps, so go backwards
+    for task in reversed(tasks):
+        result[task] = task.cost + max(
+            (result[dependent] for dependent in dependents[task]), default=0)
+    return result
+
+
+def critical_path(tasks):
+    """Get the chain of dependent tasks with the highest total cost."""
+    priority = priorities(tasks)
+    dependents = get_dependents(tasks)
+    path = []
+    candidates = [task for task in tasks if not task.deps]
+    while candidates:
+        task = max(candidates, key=priority.get)
+        path.append(task)
+        candidates = dependents[task]
+    return path
+
+
+def run_tasks(tasks, limits, max_workers=None):
+    """Run |tasks| on a thread pool as their deps finish.
+
+    |tasks| must come after their deps. Of the ready tasks, those on the
+    longest remaining path go first, and tasks whose resource classes
+    are full wait while others that fit run. After a task fails no more
+    are started; the first error is raised once the running ones end.
+    """
+    priority = priorities(tasks)
+    waiting = {task: len(task.deps) for task in tasks}
+    dependents = get_dependents(tasks)
+    slots = Slots(limits)
+    ready = []
+    running = {}
+    error = None
+
+    def make_ready(task):
+        names = task.resources() if task.resources else ()
+        ready.append((task, names))
+
+    for task in tasks:
+        if not task.deps:
+            make_ready(task)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+        while ready or running:
+            ready.sort(key=lambda item: priority[item[0]], reverse=True)
+            for task, names in list(ready):
+                if slots.available(names):
+                    slots.take(names)
+                    ready.remove((task, names))
+                    running[executor.submit(task.func)] = (task, names)
+            if not running:
+                break
+            finished, _ = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                task, names = running.pop(future)
+                slots.release(names)
+                if future.exception() is not None:
+                    error = error or future.exception()
+                    continue
+                for dependent in dependents[task]:
+                    waiting[dependent] -= 1
+                    if waiting[dependent] == 0 and error is None:
+                        make_ready(dependent)
+            if error is not None:
+                del ready[:]
+    if error is not None:
+        raise error
@@ -0,0 +1,121 @@
+# TODO: remove this
+# pylint: disable=missing-docstring
+
+import attr
+
+from trask import phase3, plan
+
+
+class SelectionError(ValueError):
+    pass
+
+
+def matches(step, number, selector):
+    """Check if |selector| is the step's number, label or name.
+
+    Steps are numbered from 1.
+    """
+    if selector.isdigit():
+        return int(selector) == number
+    return selector in (step.label, step.name)
+
+
+def location_matches(files, location, selector):
+    """Check if the step at |location| matches |selector|.
+
+    |location| is a (file index, step index) pair.
+    """
+    file_index, index = location
+    return matches(files[file_index][index], index + 1, selector)
+
+
+def find(files, locations, selector, start=0):
+    for position in range(start, len(locations)):
+        if location_matches(files, locations[position], selector):
+            return position
+    raise SelectionError('no step matches ' + selector)
+
+
+def defined_variables(step):
+    if step.name == 'set':
+        return {field.name for field in attr.fields(step.recipe.__class__)}
+    elif step.name == 'create-temp-dir':
+        return {step.recipe.var.data}
+    return set()
+
+
+def used_variables(step):
+    names = phase3.variable_names(step.recipe)
+    if step.name == 'export':
+        names.update(plan.exported_names([step]))
+    return names
+
+
+def find_definition(files, file_index, index, name):
+    """Find the step that binds |name| for the step at |index|.
+
+    Looks at the earlier steps of the file, then at the export steps of
+    the earlier files, the last of which wins. Returns a (file index,
+    step index) pair or None.
+    """
+    steps = files[file_index]
+    for dep in range(index - 1, -1, -1):
+        if name in defined_variables(steps[dep]):
+            return file_index, dep
+    for other in range(file_index - 1, -1, -1):
+        for dep in range(len(files[other]) - 1, -1, -1):
+            if name in plan.exported_names([files[other][dep]]):
+                return other, dep
+    return None
+
+
+def select_files(files, only=None, from_=None, until=None):
+    """Get the indices of the steps to run in each of |files|, in order.
+
+    |files| holds the steps of each file in the order they run, and the
+    selectors apply to all of them: |from_| and |until| limit the steps
+    to an inclusive range starting at the first match of |from_| and
+    ending at the next match of |until|, and |only| to the steps
+    matching any of its selectors. Steps that define variables used by
+    the selected steps are added, including the exports of earlier
+    files, along with the steps they in turn depend on.
+    """
+    locations = [(file_index, index)
+                 for file_index, steps in enumerate(files)
+                 for index in range(len(steps))]
+    start = 0 if from_ is None else find(files, locations, from_)
+    end = len(locations) - 1 if until is None else find(
+        files, locations, until, start)
+    selected = set()
+    for location in locations[start:end + 1]:
+        if only is None or any(
+                location_matches(files, location, selector)
+                for selector in only):
+            selected.add(location)
+    if only is not None:
+        for selector in only:
+            if not any(
+                    location_matches(files, location, selector)
+                    for location in selected):
+                raise SelectionError('no step matches ' + selector)
+
+    pending = list(selected)
+    while pending:
+        file_index, index = pending.pop()
+        for name in used_variables(files[file_index][index]):
+            dep = find_definition(files, file_index, index, name)
+            if dep is not None and dep not in selected:
+                selected.add(dep)
+                pending.append(dep)
+    return [
+        sorted(index for other, index in selected if other == file_index)
+        for file_index in range(len(files))
+    ]
+
+
+def select(steps, only=None, from_=None, until=None):
+    """Get the indices of the steps of one file to run, in order.
+
+    See select_files.
+    """
+    return select_files([steps], only, from_, until)[0]
@@ -0,0 +1,95 @@
+# TODO: remove this
+# pylint: disable=missing-docstring
+
+import json
+import shlex
+import tarfile
+
+# Prints one line per image, each line being the comma-separated diff
+# IDs of the image's layers
+INSPECT_FORMAT = '{{join .RootFS.Layers ","}}'
+
+
+def list_layers_command(sudo):
+    """Shell command that lists the layer chains of every remote image."""
+    docker = ' '.join(sudo + ['docker'])
+    return ('{docker} image ls -q --no-trunc | sort -u | '
+            'xargs -r {docker} image inspect --format {fmt}').format(
+                docker=docker, fmt=shlex.quote(INSPECT_FORMAT))
+
+
+def parse_layers(output):
+    """Get the set of layer chains present on a remote host.
+
+    Each chain is a tuple of diff IDs. Every prefix of an image's layer
+    list is included since docker stores layers by chain, not
+    individually.
+    """
+    chains = set()
+    for line in output.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        layers = tuple(line.split(','))
+        for index in range(1, len(layers) + 1):
+            chains.add(layers[:index])
+    return chains
+
+
+def read_manifest(image_tar):
+    """Get the manifest and image configs from a `docker save` archive."""
+    with tarfile.open(image_tar) as tar:
+        manifest = json.loads(tar.extractfile('manifest.json').read().decode())
+        configs = {}
+        for entry in manifest:
+            name = entry['Config']
+            configs[name] = json.loads(tar.extractfile(name).read().decode())
+    return manifest, configs
+
+
+def skippable_files(manifest, configs, chains):
+    """Get the layer files that the remote host already has.
+
+    `docker load` checks whether each layer chain already exists before
+    opening the layer's file, so these can be left out of the archive.
+    A file is only skipped if every image in the archive that uses it
+    can do without it.
+    """
+    needed = set()
+    skippable = set()
+    for entry in manifest:
+        diff_ids = configs[entry['Config']]['rootfs']['diff_ids']
+        for index, layer_file in enumerate(entry['Layers']):
+            if tuple(diff_ids[:index + 1]) in chains:
+                skippable.add(layer_file)
+            else:
+                needed.add(layer_file)
+    return skippable - needed
+
+
+def write_image(image_tar, wfile, skip):
+    """Write |image_tar| to the binary file |wfile| as a tar stream.
+
+    The members named in |skip| are left out. The stream is written
+    sequentially, so |wfile| can be a pipe.
+    """
+    with tarfile.open(image_tar) as src, \
+            tarfile.open(fileobj=wfile, mode='w|') as dst:
+        for member in src:
+            if member.name in skip:
+                continue
+            if member.isfile():
+                dst.addfile(member, src.extractfile(member))
+            else:
+                dst.addfile(member)
+
+
+def filter_image(image_tar, wfile, chains):
+    """Write |image_tar| to |wfile| without the layers in |chains|.
+
+    Returns the number of layer files that were left out.
+    """
+    manifest, configs = read_manifest(image_tar)
+    skip = skippable_files(manifest, configs, chains)
+    write_image(image_tar, wfile, skip)
+    return len(skip)
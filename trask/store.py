@@ -0,0 +1,175 @@
+# TODO: remove this
+# pylint: disable=missing-docstring
+
+import hashlib
+import io
+import os
+import posixpath
+import shlex
+import stat
+import tarfile
+
+import attr
+
+from trask import hashindex
+
+# Unused releases and blobs are kept this long, so that an upload
+# running at the same time can still link to them
+GC_GRACE_MINUTES = 60
+
+
+@attr.s(frozen=True)
+class Entry:
+    """A file in a release: where it goes and which blob holds it."""
+    path = attr.ib()
+    src = attr.ib()
+    digest = attr.ib()
+    mode = attr.ib()
+
+    @property
+    def blob(self):
+        return '{}-{:o}'.format(self.digest, self.mode)
+
+
+def build_manifest(src, index=None, include=None, exclude=None):
+    """Get the sorted list of Entry objects for the files under |src|.
+
+    If |src| is a file the release contains just that file. Digests
+    come from |index| if given, so unchanged files are not re-read.
+    """
+    if index is None:
+        index = hashindex.HashIndex()
+    if os.path.isdir(src):
+        files = index.scan(src, include, exclude)
+    else:
+        files = index.digests([(os.path.basename(src), src, os.stat(src))])
+    return [
+        Entry(info.path, info.full_path, info.digest,
+              stat.S_IMODE(info.stat.st_mode)) for info in files
+    ]
+
+
+def release_id(manifest):
+    """Hash of the release contents, used to name the release directory."""
+    sha = hashlib.sha256()
+    for entry in manifest:
+        sha.update('{} {}\n'.format(entry.blob, entry.path).encode())
+    return sha.hexdigest()
+
+
+def blobs_dir(store):
+    return posixpath.join(store, 'blobs')
+
+
+def ref_path(store, dst):
+    """Symlink in |store| to the release that |dst| points at."""
+    name = hashlib.sha256(dst.encode()).hexdigest()
+    return posixpath.join(store, 'refs', name)
+
+
+def list_blobs_command(store):
+    """Shell command that lists the blobs already in the remote store."""
+    path = shlex.quote(blobs_dir(store))
+    return 'mkdir -p {path} && ls -1 {path}'.format(path=path)
+
+
+def missing_entries(manifest, output):
+    """Get one entry per blob that is not in the output of ls."""
+    present = set(output.split())
+    missing = {}
+    for entry in manifest:
+        if entry.blob not in present:
+            missing.setdefault(entry.blob, entry)
+    return sorted(missing.values(), key=lambda entry: entry.blob)
+
+
+def write_blob_archive(entries, tar_path):
+    """Write a tar of |entries| named by blob.
+
+    Blobs are made read-only since every release hardlinks to them.
+    """
+    with tarfile.open(tar_path, 'w') as tar:
+        for entry in entries:
+            info = tar.gettarinfo(entry.src, arcname=entry.blob)
+            info.mode = entry.mode & ~0o222
+            with open(entry.src, 'rb') as rfile:
+                tar.addfile(info, rfile)
+
+
+def assemble_script(store, manifest, dst):
+    """Shell script that builds the release and points |dst| at it.
+
+    The release directory is built under a temporary name and renamed
+    into place, then |dst| is swapped to a new symlink with a rename so
+    that it is never missing. If |dst| is a real directory it is moved
+    aside first and deleted afterwards. A ref to the release is kept in
+    the store so that gc_script knows it is in use.
+    """
+    quote = shlex.quote
+    release = posixpath.join(store, 'releases', release_id(manifest))
+    out = io.StringIO()
+    out.write('set -e\n')
+    out.write('release={}\n'.format(quote(release)))
+    out.write('if [ ! -d "$release" ]; then\n')
+    out.write('  tmp="$release.tmp.$$"\n')
+    out.write('  rm -rf "$tmp"\n')
+    dirs = sorted(
+        set(posixpath.dirname(entry.path) for entry in manifest) | {''})
+    for dirname in dirs:
+        out.write('  mkdir -p "$tmp"/{}\n'.format(quote(dirname)))
+    for entry in manifest:
+        blob = posixpath.join(blobs_dir(store), entry.blob)
+        out.write('  ln {} "$tmp"/{}\n'.format(quote(blob), quote(entry.path)))
+    out.write('  mv "$tmp" "$release"\n')
+    out.write('fi\n')
+    # Keep gc_script from deleting a release that is being reused
+    out.write('touch "$release"\n')
+    out.write('target="$(cd "$release" && pwd)"\n')
+    ref = ref_path(store, dst)
+    out.write('mkdir -p {}\n'.format(quote(posixpath.dirname(ref))))
+    out.write('ln -sfn "$target" {}.tmp.$$\n'.format(quote(ref)))
+    out.write('mv -T {ref}.tmp.$$ {ref}\n'.format(ref=quote(ref)))
+    dst = quote(dst)
+    out.write('old=\n')
+    out.write('if [ -d {dst} ] && [ ! -L {dst} ]; then\n'.format(dst=dst))
+    out.write('  old={}.old.$$\n'.format(dst))
+    out.write('  mv -T {} "$old"\n'.format(dst))
+    out.write('fi\n')
+    out.write('link={}.tmp.$$\n'.format(dst))
+    out.write('ln -sfn "$target" "$link"\n')
+    out.write('mv -T "$link" {}\n'.format(dst))
+    out.write('if [ -n "$old" ]; then\n')
+    out.write('  rm -rf "$old"\n')
+    out.write('fi\n')
+    return out.getvalue()
+
+
+def gc_script(store):
+    """Shell script that deletes what no release in |store| uses.
+
+    Releases that no ref points at are deleted, then the blobs that are
+    no longer hardlinked from any release. Both are kept for
+    GC_GRACE_MINUTES after they were last used.
+    """
+    quote = shlex.quote
+    minutes = '+{}'.format(GC_GRACE_MINUTES)
+    out = io.StringIO()
+    out.write('set -e\n')
+    out.write('cd {}\n'.format(quote(store)))
+    out.write('mkdir -p refs releases\n')
+    out.write('used="$(for ref in refs/*; do\n')
+    out.write('  if [ -L "$ref" ]; then basename "$(readlink "$ref")"; fi\n')
+    out.write('done)"\n')
+    out.write('for dir in releases/*; do\n')
+    out.write('  if [ ! -d "$dir" ] || [ -z "$(find "$dir" -maxdepth 0 '
+              '-mmin {})" ]; then\n'.format(minutes))
+    out.write('    continue\n')
+    out.write('  fi\n')
+    out.write('  if ! printf \'%s\\n\' "$used" | '
+              'grep -qxF "${dir##*/}"; then\n')
+    out.write('    rm -rf "$dir"\n')
+    out.write('  fi\n')
+    out.write('done\n')
+    out.write('find blobs -type f -links 1 -cmin {} '
+              '-exec rm -f {{}} +\n'.format(minutes))
+    return out.getvalue()
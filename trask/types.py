@@ -13,26 +13,29 @@ class Kind:
     Object = 'object'
 
 
-@attr.s
+@attr.s(slots=True)
 class Call:
     name = attr.ib()
     args = attr.ib()
 
 
-@attr.s
+@attr.s(slots=True)
 class Step:
     name = attr.ib()
     recipe = attr.ib()
     path = attr.ib()
+    label = attr.ib(default=None)
+    timeout = attr.ib(default=None)
+    worker = attr.ib(default=None)
 
 
-@attr.s(frozen=True)
+@attr.s(frozen=True, slots=True)
 class Value:
     data = attr.ib()
     is_path = attr.ib(default=False)
 
 
-@attr.s
+@attr.s(slots=True)
 class Var:
     name = attr.ib()
     choices = attr.ib(default=None)
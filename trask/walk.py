@@ -0,0 +1,132 @@
+# TODO: remove this
+# pylint: disable=missing-docstring
+
+import fnmatch
+import os
+import posixpath
+import re
+
+
+def translate_part(part):
+    """Regex for one path component of a glob, where * and ? stop at /."""
+    regex = ''
+    index = 0
+    while index < len(part):
+        char = part[index]
+        index += 1
+        if char == '*':
+            regex += '[^/]*'
+        elif char == '?':
+            regex += '[^/]'
+        elif char == '[':
+            end = part.find(']', index + 1)
+            if end == -1:
+                regex += re.escape(char)
+            else:
+                body = part[index:end]
+                if body.startswith('!'):
+                    body = '^' + body[1:]
+                regex += '[' + body.replace('\\', '\\\\') + ']'
+                index = end + 1
+        else:
+            regex += re.escape(char)
+    return regex
+
+
+def split_pattern(pattern):
+    """Split a glob into components.
+
+    A pattern without a slash matches at any depth, like in .gitignore.
+    """
+    pattern = pattern.strip('/')
+    if '/' not in pattern:
+        pattern = '**/' + pattern
+    return pattern.split('/')
+
+
+def compile_pattern(pattern, subtree=False):
+    """Compile a glob, also matching paths under a match if |subtree|."""
+    parts = split_pattern(pattern)
+    regex = ''
+    for index, part in enumerate(parts):
+        last = index == len(parts) - 1
+        if part == '**':
+            regex += '.*' if last else '(?:[^/]+/)*'
+        else:
+            regex += translate_part(part) + ('' if last else '/')
+    if subtree:
+        regex += '(?:/.*)?'
+    return re.compile(regex + r'\Z', re.DOTALL)
+
+
+def may_contain(parts, dir_path):
+    """Check if a pattern could match anything under |dir_path|."""
+    dir_parts = dir_path.split('/')
+    for index, dir_part in enumerate(dir_parts):
+        if index >= len(parts):
+            return False
+        if parts[index] == '**':
+            return True
+        if not fnmatch.fnmatchcase(dir_part, parts[index]):
+            return False
+    return len(parts) > len(dir_parts)
+
+
+class Matcher:
+    """Include and exclude globs, matched against relative paths.
+
+    Paths use / as the separator. With no include patterns everything
+    not excluded matches. A directory that matches a pattern is included
+    or excluded along with everything under it.
+    """
+
+    def __init__(self, include=None, exclude=None):
+        self.include = [(split_pattern(pattern),
+                         compile_pattern(pattern, subtree=True))
+                        for pattern in include or []]
+        self.exclude = [
+            compile_pattern(pattern[:-3] if pattern.endswith('/**') else
+                            pattern) for pattern in exclude or []
+        ]
+
+    def is_excluded(self, path):
+        return any(regex.match(path) for regex in self.exclude)
+
+    def matches(self, path):
+        if self.is_excluded(path):
+            return False
+        if not self.include:
+            return True
+        return any(regex.match(path) for _, regex in self.include)
+
+    def should_descend(self, dir_path):
+        if self.is_excluded(dir_path):
+            return False
+        if not self.include:
+            return True
+        return any(
+            may_contain(parts, dir_path) or regex.match(dir_path)
+            for parts, regex in self.include)
+
+
+def walk(root, include=None, exclude=None):
+    """Get (relative path, full path, stat) for the matching files.
+
+    Directories that are excluded, or that cannot contain anything
+    included, are never listed.
+    """
+    matcher = Matcher(include, exclude)
+    files = []
+    stack = [('', root)]
+    while stack:
+        rel_dir, dir_path = stack.pop()
+        # The iterator closes the directory once it is exhausted, it is
+        # only a context manager from Python 3.6
+        for entry in os.scandir(dir_path):
+            rel_path = posixpath.join(rel_dir, entry.name)
+            if entry.is_dir():
+                if matcher.should_descend(rel_path):
+                    stack.append((rel_path, entry.path))
+            elif entry.is_file() and matcher.matches(rel_path):
+                files.append((rel_path, entry.path, entry.stat()))
+    return files
@@ -0,0 +1,173 @@
+# TODO: remove this
+# pylint: disable=missing-docstring
+
+import os
+import time
+
+import attr
+
+from trask import checkpoint, phase1, phase2, phase3, selection, walk
+
+
+def to_tuple(patterns):
+    return None if patterns is None else tuple(patterns)
+
+
+@attr.s(frozen=True)
+class Input:
+    """A local path that a step reads.
+
+    For a directory only the files matching |include| and |exclude|
+    are read.
+    """
+    path = attr.ib()
+    include = attr.ib(default=None, converter=to_tuple)
+    exclude = attr.ib(default=None, converter=to_tuple)
+
+
+def step_inputs(step):
+    """Get the local paths that a resolved step reads."""
+    recipe = step.recipe
+    if step.name == 'copy':
+        return [
+            Input(src, recipe.include, recipe.exclude) for src in recipe.src
+        ]
+    elif step.name == 'docker-run':
+        return [Input(volume.host) for volume in recipe.volumes or []]
+    elif step.name == 'upload':
+        return [Input(recipe.src, recipe.include, recipe.exclude)]
+    return []
+
+
+def fingerprint(path, include=None, exclude=None):
+    """Something that changes when the file or tree at |path| changes.
+
+    In a tree only the files matching |include| and |exclude| count.
+    """
+    try:
+        stat_result = os.stat(path)
+    except FileNotFoundError:
+        return None
+    if not os.path.isdir(path):
+        return (stat_result.st_size, stat_result.st_mtime_ns)
+    return tuple(
+        sorted((rel_path, stat_result.st_size, stat_result.st_mtime_ns)
+               for rel_path, _, stat_result in walk.walk(
+                   path, include, exclude)))
+
+
+def dependents(steps, affected):
+    """Add the steps that use variables set by the |affected| steps."""
+    result = set(affected)
+    defined = set()
+    for index, step in enumerate(steps):
+        if index not in result:
+            if not phase3.variable_names(step.recipe) & defined:
+                continue
+            result.add(index)
+        defined |= selection.defined_variables(step)
+    return result
+
+
+class Watcher:
+    """Run a trask file, then re-run the steps affected by each change.
+
+    The trask file, its includes and the inputs of the steps are
+    polled. When one changes the steps that changed, that read a
+    changed input or that failed last time are run again, along with
+    the steps that use their variables. The session, and so parsed
+    includes and ssh connections, is kept between runs.
+    """
+
+    def __init__(self, path, dry_run=True, timeout=None):
+        self.path = os.path.abspath(path)
+        self.session = phase3.Session(dry_run=dry_run)
+        self.ctx = phase3.Context(
+            dry_run=dry_run, session=self.session, timeout=timeout)
+        self.hashes = []
+        self.inputs = []
+        self.pending = set()
+        self.snapshot = {}
+
+    def load(self):
+        root = phase1.load(self.path, self.session.include_cache)
+        return phase2.Phase2.load(phase2.get_schema(), root)
+
+    def watched_inputs(self):
+        result = {Input(path) for path in self.session.include_cache}
+        for inputs in self.inputs:
+            result.update(inputs)
+        return result
+
+    def watched_paths(self):
+        return {inp.path for inp in self.watched_inputs()}
+
+    def take_snapshot(self):
+        return {
+            inp: fingerprint(inp.path, inp.include, inp.exclude)
+            for inp in self.watched_inputs()
+        }
+
+    def changed_paths(self):
+        snapshot = self.take_snapshot()
+        return {
+            inp.path
+            for inp in snapshot.keys() | self.snapshot.keys()
+            if snapshot.get(inp) != self.snapshot.get(inp)
+        }
+
+    def run_steps(self, steps, indices):
+        """Run the steps at |indices|, returning True if all succeed."""
+        indices = sorted(indices)
+        for position, index in enumerate(indices):
+            try:
+                phase3.run_step(steps[index], self.ctx)
+            except Exception as err:  # pylint: disable=broad-except
+                print('error in step {} ({}): {}'.format(
+                    index + 1, steps[index].name, err))
+                self.pending = set(indices[position:])
+                return False
+            self.inputs[index] = step_inputs(self.ctx.step)
+        self.pending = set()
+        return True
+
+    def update(self, changed=()):
+        """Reload the file and run the steps affected by |changed|."""
+        for path in changed:
+            self.session.include_cache.pop(path, None)
+        try:
+            steps = self.load()
+        except Exception as err:  # pylint: disable=broad-except
+            print('error loading {}: {}'.format(self.path, err))
+            self.snapshot = self.take_snapshot()
+            return False
+        hashes = [checkpoint.step_hash(step) for step in steps]
+
+        affected = {index for index in self.pending if index < len(steps)}
+        for index, step_hash in enumerate(hashes):
+            if index >= len(self.hashes) or self.hashes[index] != step_hash:
+                affected.add(index)
+            elif changed and {inp.path
+                              for inp in self.inputs[index]} & set(changed):
+                affected.add(index)
+        affected = dependents(steps, affected)
+
+        self.inputs = (self.inputs + [[]] * len(hashes))[:len(hashes)]
+        self.hashes = hashes
+        result = self.run_steps(steps, affected)
+        self.snapshot = self.take_snapshot()
+        return result
+
+    def watch(self, interval=1.0):
+        try:
+            self.update()
+            while True:
+                time.sleep(interval)
+                changed = self.changed_paths()
+                if changed:
+                    print('changed:', ' '.join(sorted(changed)))
+                    self.update(changed)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.session.close()